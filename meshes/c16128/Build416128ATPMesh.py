@@ -31,6 +31,6 @@ def main():
     BuildATPMesh.buildATPMesh()
 
 if __name__ == '__main__':
-    print "Starting", os.path.basename(__file__)
+    print("Starting", os.path.basename(__file__))
     main()
-    print "Exiting", os.path.basename(__file__)
\ No newline at end of file
+    print("Exiting", os.path.basename(__file__))
\ No newline at end of file
@@ -1,6 +1,17 @@
+import os
+import sys
 import vtk
-import math
-import numpy as np
+
+# Run in current directory.
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# Import path for the FlatMeshATP script.
+importPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../util'))
+if not importPath in sys.path:
+    sys.path.insert(1, importPath)
+del importPath
+
+import FlatMeshATP
 
 ecReader = vtk.vtkXMLPolyDataReader()
 ecReader.SetFileName('quadMeshFullECc2000.vtp')
@@ -8,18 +19,8 @@ ecReader.Update()
 
 polydata = ecReader.GetOutput()
 
-# Create new ATP map array.
-newMapArray = vtk.vtkDoubleArray()
-newMapArray.SetName('initialATP')
-newMapArray.SetNumberOfComponents(1)
-newMapArray.SetNumberOfTuples(polydata.GetNumberOfCells())
-
 # Get cell centres.
-centresFilter = vtk.vtkCellCenters()
-centresFilter.SetInput(polydata)
-centresFilter.Update()
-
-centres = centresFilter.GetOutput()
+centres = FlatMeshATP.centreArray(FlatMeshATP.cellCentres(polydata))
 
 atp_min = 0.2
 atp_max = 0.7
@@ -30,36 +31,16 @@ r_x2 = 7000
 r_y1 = 6000
 r_y2 = 7000
 
-_, _, y_min, y_max, _, _ = centres.GetBounds()
-y_range = y_max - y_min
-
 # Set background value in the ATP array to vary linearly from atp_min to atp_max.
 # Create rectangular area of high ATP in the middle.
-for cid in range (0, centres.GetNumberOfPoints()):
-    x, y, _ = centres.GetPoint(cid)
-
-    if (r_x1 < x and x < r_x2) and (r_y1 < y and y < r_y2):
+atp = FlatMeshATP.rectangularPatchATP(centres, FlatMeshATP.linearATP(centres, atp_min, atp_max), (r_x1, r_x2), (r_y1, r_y2), atp_max)
 
-        # ATP max value.
-        atp_val = atp_max
-
-    else:
-
-        # Rescale to range.
-        atp_val = (y - y_min) * (atp_max - atp_min) / (y_max - y_min) + atp_min
-
-    newMapArray.SetValue(cid, atp_val)
-
-# Set new map.
-polydata.GetCellData().AddArray(newMapArray)
-polydata.GetCellData().SetActiveScalars('initialATP')
+# Set new map and write it.
+FlatMeshATP.writeATPMap(polydata, atp, 'quadMeshFullATPc2000.vtp')
 
 # Setup actor and mapper
 mapper = vtk.vtkPolyDataMapper()
-if vtk.VTK_MAJOR_VERSION <= 5:
-    mapper.SetInput(polydata)
-else:
-    mapper.SetInputData(polydata)
+mapper.SetInputData(polydata)
 actor = vtk.vtkActor()
 actor.SetMapper(mapper)
 
@@ -72,9 +53,3 @@ renderWindowInteractor.SetRenderWindow(renderWindow)
 renderer.AddActor(actor)
 renderWindow.Render()
 renderWindowInteractor.Start()
-
-mapWriter = vtk.vtkXMLPolyDataWriter()
-mapWriter.SetFileName('quadMeshFullATPc2000.vtp')
-mapWriter.SetInput(polydata)
-mapWriter.Update()
-
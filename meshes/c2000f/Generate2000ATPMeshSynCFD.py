@@ -1,19 +1,26 @@
+import os
+import sys
 import vtk
-import math
-import numpy as np
 
-sigmoid_grad = -3.0
+# Run in current directory.
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-def sigmoid(x):
-    return 1.0 / (1.0 + np.exp(-sigmoid_grad * x))
+# Import path for the HotSpotATP script.
+importPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../util'))
+if not importPath in sys.path:
+    sys.path.insert(1, importPath)
+del importPath
+
+import HotSpotATP
 
-inner_par_rad = 1/2.0
 atp_base = 0.35
 
-sigmoind_domain_min = -2.0
-sigmoind_domain_max = 2.0
-sigmoid_domain = sigmoind_domain_max - sigmoind_domain_min
-scaling_to_sigmoid_domain = sigmoid_domain / (1.0 - inner_par_rad)
+# One HI and two LO ATP spheres. Where they overlap the one listed last wins.
+hot_spots = [
+    HotSpotATP.HotSpot(centre=(5000, 6500, 0), radius=1500, peak=0.68),
+    HotSpotATP.HotSpot(centre=(3000, 3022.5, 0), radius=1500, peak=0.25),
+    HotSpotATP.HotSpot(centre=(7000, 3022.5, 0), radius=1500, peak=0.3),
+]
 
 ecReader = vtk.vtkXMLPolyDataReader()
 ecReader.SetFileName('quadMeshFullECc2000.vtp')
@@ -21,133 +28,11 @@ ecReader.Update()
 
 polydata = ecReader.GetOutput()
 
-# Create new ATP map array.
-newMapArray = vtk.vtkDoubleArray()
-newMapArray.SetName('initialATP')
-newMapArray.SetNumberOfComponents(1)
-newMapArray.SetNumberOfTuples(polydata.GetNumberOfCells())
-
-# Set background value in the ATP array.
-for cid in range(0, polydata.GetNumberOfCells()):
-    newMapArray.SetValue(cid, atp_base)
-
 # Get cell centres.
-centresFilter = vtk.vtkCellCenters()
-centresFilter.SetInput(polydata)
-centresFilter.Update()
-
-centres = centresFilter.GetOutput()
-
-sphere_rad = 1500
-centre = (5000, 6500, 0)
-max_atp = 0.68
-
-# Do HI ATP by running over all cell centres in polydata and processing only the ones that fall in the specified radius.
-for cid in range (0, centres.GetNumberOfPoints()):
-
-    # Distance from the point to sphere centre.
-    dist2 = vtk.vtkMath.Distance2BetweenPoints(centres.GetPoint(cid), centre)
-
-    # If the point falls into the sphere radius.
-    if dist2 < sphere_rad**2:
-
-        # Parametric distance from point to sphere centre.
-        par_dist = math.sqrt(dist2) / sphere_rad
-
-        if par_dist <= inner_par_rad:
-            # The centre is atp_max.
-            atp_val = max_atp
-        else:
-            # Discard the inner radius from our parametric distance.
-            x0 = par_dist - inner_par_rad
-
-            # Map distance to sigmoind domain min to max range.
-            x1 = x0 * scaling_to_sigmoid_domain
-            x2 = x1 + sigmoind_domain_min
-
-            # Calculate sigmoid value and subtract the min sigmoid value for this domain.
-            s = sigmoid(x2)
-            s1 = s
-
-            # Scale to atp range.
-            atp_range = max_atp - atp_base
-            atp_val = atp_base + s1 * atp_range
-
-        newMapArray.SetValue(cid, atp_val)
-
-sphere_rad = 1500
-centre = (3000, 3022.5, 0)
-max_atp = 0.25
-
-# Do LO ATP 1 by running over all cell centress in polydata and processing only the ones that fall in the specified radius.
-for cid in range (0, centres.GetNumberOfPoints()):
-
-    # Distance from the point to sphere centre.
-    dist2 = vtk.vtkMath.Distance2BetweenPoints(centres.GetPoint(cid), centre)
+centres = HotSpotATP.cellCentres(polydata)
 
-    # If the point falls into the sphere radius.
-    if dist2 < sphere_rad**2:
-
-        # Parametric distance from point to sphere centre.
-        par_dist = math.sqrt(dist2) / sphere_rad
-
-        if par_dist <= inner_par_rad:
-            # The centre is atp_max.
-            atp_val = max_atp
-        else:
-            # Discard the inner radius from our parametric distance.
-            x0 = par_dist - inner_par_rad
-
-            # Map distance to sigmoind domain min to max range.
-            x1 = x0 * scaling_to_sigmoid_domain
-            x2 = x1 + sigmoind_domain_min
-
-            # Calculate sigmoid value and subtract the min sigmoid value for this domain.
-            s = sigmoid(x2)
-            s1 = s
-
-            # Scale to atp range.
-            atp_range = max_atp - atp_base
-            atp_val = atp_base + s1 * atp_range
-
-        newMapArray.SetValue(cid, atp_val)
-
-sphere_rad = 1500
-centre = (7000, 3022.5, 0)
-max_atp = 0.3
-
-# Do LO ATP 2 by running over all cell centres in polydata and processing only the ones that fall in the specified radius.
-for cid in range (0, centres.GetNumberOfPoints()):
-
-    # Distance from the point to sphere centre.
-    dist2 = vtk.vtkMath.Distance2BetweenPoints(centres.GetPoint(cid), centre)
-
-    # If the point falls into the sphere radius.
-    if dist2 < sphere_rad**2:
-
-        # Parametric distance from point to sphere centre.
-        par_dist = math.sqrt(dist2) / sphere_rad
-
-        if par_dist <= inner_par_rad:
-            # The centre is atp_max.
-            atp_val = max_atp
-        else:
-            # Discard the inner radius from our parametric distance.
-            x0 = par_dist - inner_par_rad
-
-            # Map distance to sigmoind domain min to max range.
-            x1 = x0 * scaling_to_sigmoid_domain
-            x2 = x1 + sigmoind_domain_min
-
-            # Calculate sigmoid value and subtract the min sigmoid value for this domain.
-            s = sigmoid(x2)
-            s1 = s
-
-            # Scale to atp range.
-            atp_range = max_atp - atp_base
-            atp_val = atp_base + s1 * atp_range
-
-        newMapArray.SetValue(cid, atp_val)
+# Create new ATP map array.
+newMapArray = HotSpotATP.hotSpotATPArray(HotSpotATP.hotSpotATP(centres, hot_spots, atp_base, 'last'))
 
 # Set new map.
 polydata.GetCellData().AddArray(newMapArray)
@@ -155,10 +40,7 @@ polydata.GetCellData().SetActiveScalars('initialATP')
 
 # Setup actor and mapper
 mapper = vtk.vtkPolyDataMapper()
-if vtk.VTK_MAJOR_VERSION <= 5:
-    mapper.SetInput(polydata)
-else:
-    mapper.SetInputData(polydata)
+mapper.SetInputData(polydata)
 actor = vtk.vtkActor()
 actor.SetMapper(mapper)
 
@@ -174,6 +56,5 @@ renderWindowInteractor.Start()
 
 mapWriter = vtk.vtkXMLPolyDataWriter()
 mapWriter.SetFileName('quadMeshFullATPc2000.vtp')
-mapWriter.SetInput(polydata)
+mapWriter.SetInputData(polydata)
 mapWriter.Update()
-
@@ -1,6 +1,17 @@
+import os
+import sys
 import vtk
-import math
-import numpy as np
+
+# Run in current directory.
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# Import path for the FlatMeshATP script.
+importPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../util'))
+if not importPath in sys.path:
+    sys.path.insert(1, importPath)
+del importPath
+
+import FlatMeshATP
 
 atp_min = 0.2
 atp_max = 0.7
@@ -15,49 +26,15 @@ if __name__ == "__main__":
     # Rememeber the cells.
     polydata = ecReader.GetOutput()
 
-    # Create new ATP map array.
-    newMapArray = vtk.vtkDoubleArray()
-    newMapArray.SetName('initialATP')
-    newMapArray.SetNumberOfComponents(1)
-    newMapArray.SetNumberOfTuples(polydata.GetNumberOfCells())
-
     # Get cell centres.
-    centresFilter = vtk.vtkCellCenters()
-    centresFilter.SetInput(polydata)
-    centresFilter.Update()
-
-    centres = centresFilter.GetOutput()
-
-    _, _, y_min, y_max, _, _ = centres.GetBounds()
-    y_range = y_max - y_min
-    atp_range = atp_max - atp_min
-
-    # Set background value in the ATP array to vary linearly from atp_min to atp_max.
-    # Create rectangular area of high ATP in the middle.
-    for cid in range (0, centres.GetNumberOfPoints()):
-        x, y, _ = centres.GetPoint(cid)
-
-        # Rescale to range.
-        atp_val = (y - y_min) * (atp_range) / (y_range) + atp_min
-
-        newMapArray.SetValue(cid, atp_val)
-
-    # Set new map.
-    polydata.GetCellData().AddArray(newMapArray)
-    polydata.GetCellData().SetActiveScalars('initialATP')
+    centres = FlatMeshATP.centreArray(FlatMeshATP.cellCentres(polydata))
 
-    # Write the map.
-    mapWriter = vtk.vtkXMLPolyDataWriter()
-    mapWriter.SetFileName('quadMeshFullATPc256.vtp')
-    mapWriter.SetInput(polydata)
-    mapWriter.Update()
+    # Set the ATP map to vary linearly from atp_min to atp_max along y and write it.
+    FlatMeshATP.writeATPMap(polydata, FlatMeshATP.linearATP(centres, atp_min, atp_max), 'quadMeshFullATPc256.vtp')
 
     # Setup actor and mapper
     mapper = vtk.vtkPolyDataMapper()
-    if vtk.VTK_MAJOR_VERSION <= 5:
-        mapper.SetInput(polydata)
-    else:
-        mapper.SetInputData(polydata)
+    mapper.SetInputData(polydata)
     actor = vtk.vtkActor()
     actor.SetMapper(mapper)
 
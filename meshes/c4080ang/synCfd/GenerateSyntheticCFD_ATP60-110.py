@@ -6,11 +6,16 @@ sphere centre to an ATP value.
 """
 
 import os
+import sys
 import vtk
-import math
 
-import numpy as np
-import matplotlib.pyplot as plt
+# Import path for the HotSpotATP script.
+importPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../util'))
+if not importPath in sys.path:
+    sys.path.insert(1, importPath)
+del importPath
+
+import HotSpotATP
 
 numECsCirc = 20
 numECsAx = 4
@@ -26,23 +31,18 @@ rad_dec = 0.06
 inner_rad = 1/2.0
 sigmoind_domain_min = -2.0
 sigmoind_domain_max = 2.0
-sigmoid_domain = sigmoind_domain_max - sigmoind_domain_min
-scaling_to_sigmoid_domain = sigmoid_domain / (1.0 - inner_rad)
 
 # This is for the c4080 mesh.
 numQuadRings = 34
 numQuadsPerRing = 40
 
-def sigmoid(x):
-    return 1.0 / (1.0 + np.exp(-sigmoid_grad * x))
-
 def main():
 
     angle_num = 1
 
     for angle in range(60, 120, 10):
 
-        print 'Processing angle', angle, '...'
+        print('Processing angle', angle, '...')
         # Read the EC mesh.
         ecFileName = os.path.join(str(angle), 'quadMeshFullECc4080.vtp')
         ecMeshReader = vtk.vtkXMLPolyDataReader()
@@ -53,86 +53,38 @@ def main():
         ecMesh = ecMeshReader.GetOutput()
 
         # Get EC centres.
-        cellCentresFilter = vtk.vtkCellCenters()
-        cellCentresFilter.VertexCellsOn()
-        cellCentresFilter.SetInput(ecMesh)
-        cellCentresFilter.Update()
-
-        ecMeshCentres = cellCentresFilter.GetOutput()
-        pointsPerBranch = ecMeshCentres.GetNumberOfPoints() / 3
+        ecMeshCentres = HotSpotATP.cellCentres(ecMesh)
+        pointsPerBranch = ecMeshCentres.GetNumberOfPoints() // 3
 
         # Find three saddle points.
         # The first point is 3/4th of the EC row away from the end of the parent branch.
         # The second point is 1/4th of the EC row away from the end of the parent branch.
         # The third point is 3/4th of the way from the start of the first sibling branch.
-        saddle_ids = [pointsPerBranch - (numQuadsPerRing / 4) * (numECsAx * numECsCirc),
-                         pointsPerBranch - ((numQuadsPerRing / 4) * 3) * (numECsAx * numECsCirc),
-                         pointsPerBranch + ((numQuadsPerRing / 4) * 3) * (numECsAx * numECsCirc)]
+        saddle_ids = [pointsPerBranch - (numQuadsPerRing // 4) * (numECsAx * numECsCirc),
+                         pointsPerBranch - ((numQuadsPerRing // 4) * 3) * (numECsAx * numECsCirc),
+                         pointsPerBranch + ((numQuadsPerRing // 4) * 3) * (numECsAx * numECsCirc)]
 
         saddle_points = [ecMeshCentres.GetPoint(sId) for sId in saddle_ids]
 
-        atpArray = vtk.vtkDoubleArray()
-        atpArray.SetName("initialATP")
-
-        # Loop through each centre point.
-        for cId in range(pointsPerBranch * 3):
-            # If it falls within one of the three spheres, map it to ATP.
-            point = ecMeshCentres.GetPoints().GetPoint(cId)
-
-            # Find closest saddle point to work with.
-            # List of distances to all three saddle points.
-            dist2_list = [vtk.vtkMath.Distance2BetweenPoints(point, saddle_point) for saddle_point in saddle_points]
-
-            # Position of the closest saddle point.
-            saddle_id = dist2_list.index(min(dist2_list))
-
-            sphere_rad = sphere_rads[saddle_id]
-            max_atp = atp_max[saddle_id]
-
-            # Decrement radius if on the first one; this is the changing angle for bifurcation outer curve.
-            if saddle_id == 0:
-                sphere_rad -= (angle_num * rad_dec) * sphere_rad
-
-            # Increment radius if on the third one; this is the neck of the bifurcation.
-            if saddle_id == 2:
-                sphere_rad += (angle_num * rad_inc) * sphere_rad
-
-            # Increase intensity if on the third one.
-            if saddle_id == 2:
-                max_atp += ((angle_num - 1) * atp_inc)
-
-            # Does dist2 fall into sphere_rad2?
-            if dist2_list[saddle_id] <= sphere_rad**2:
-
-                # Map to parametric distance in the range [0, 1].
-                par_dist = math.sqrt(dist2_list[saddle_id]) / sphere_rad
-
-                # Map to ATP range, depending on the saddle id.
-                if par_dist <= inner_rad:
-                    # The centre is atp_max.
-                    atp_val = max_atp
-                else:
-                    # Discard the inner radius from our parametric distance.
-                    x0 = par_dist - inner_rad
+        sphere_rad = list(sphere_rads)
+        max_atp = list(atp_max)
 
-                    # Map distance to sigmoind domain min to max range.
-                    x1 = x0 * scaling_to_sigmoid_domain
-                    x2 = x1 + sigmoind_domain_min
+        # Decrement radius on the first one; this is the changing angle for bifurcation outer curve.
+        sphere_rad[0] -= (angle_num * rad_dec) * sphere_rad[0]
 
-                    # Calculate sigmoid value and subtract the min sigmoid value for this domain.
-                    s = sigmoid(x2)
-                    s1 = s
+        # Increment radius on the third one; this is the neck of the bifurcation.
+        sphere_rad[2] += (angle_num * rad_inc) * sphere_rad[2]
 
-                    # Scale to atp range.
-                    atp_range = max_atp - atp_base
-                    atp_val = atp_base + s1 * atp_range
+        # Increase intensity on the third one.
+        max_atp[2] += ((angle_num - 1) * atp_inc)
 
-            # Outside the sphere_rad2.
-            else:
-                atp_val = atp_base
+        hot_spots = [HotSpotATP.HotSpot(saddle_points[saddle_id], sphere_rad[saddle_id], max_atp[saddle_id],
+                                        sigmoid_grad, inner_rad, (sigmoind_domain_min, sigmoind_domain_max))
+                     for saddle_id in range(3)]
 
-            # Remember the ATP value.
-            atpArray.InsertNextValue(atp_val)
+        # Each centre point is mapped by the sphere of its closest saddle point,
+        # if it falls within that sphere.
+        atpArray = HotSpotATP.hotSpotATPArray(HotSpotATP.hotSpotATP(ecMeshCentres, hot_spots, atp_base, 'nearest'))
 
         ecMeshCentres.GetCellData().SetScalars(atpArray)
         angle_num += 1
@@ -141,12 +93,12 @@ def main():
 
         atpFileName = os.path.join(str(angle), 'quadMeshFullATPc4080.vtp')
         # atpFileName = 'quadMeshFullATPc4080_' + str(angle) + '.vtp'
-        print 'Writing', atpFileName, '...'
+        print('Writing', atpFileName, '...')
 
         writer = vtk.vtkXMLPolyDataWriter()
         writer.SetFileName(atpFileName)
-        writer.SetInput(ecMeshCentres)
-        # writer.SetInput(ecMesh)
+        writer.SetInputData(ecMeshCentres)
+        # writer.SetInputData(ecMesh)
         writer.Update()
 
         # # Setup actor and mapper
@@ -170,7 +122,7 @@ def main():
         # renderWindowInteractor.Start()
 
 if __name__ == '__main__':
-    print "Starting", os.path.basename(__file__)
+    print("Starting", os.path.basename(__file__))
 
     #t1 = np.arange(sigmoind_domain_min, sigmoind_domain_max, 0.001)
     #plt.plot(t1, sigmoid(t1))
@@ -178,6 +130,6 @@ if __name__ == '__main__':
 
     main()
 
-    print "Exiting", os.path.basename(__file__)
+    print("Exiting", os.path.basename(__file__))
 else:
-    print __file__, "is to be run as main script."
+    print(__file__, "is to be run as main script.")
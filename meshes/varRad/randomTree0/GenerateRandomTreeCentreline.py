@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Generate a random bifurcating centreline tree and write it out as .vtk legacy format.
+"""
+
+import os
+import sys
+import time
+
+# Run in current directory.
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# Import path for the CentrelineGenerator script.
+importPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../util'))
+if not importPath in sys.path:
+    sys.path.insert(1, importPath)
+del importPath
+
+import CentrelineGenerator
+
+# A tree with 10 levels of bifurcations, 2047 segments.
+depth = 10
+seed = 1
+
+CentrelineGenerator.radiusBase = 2.5
+CentrelineGenerator.outputFileName = "randomTreeCentreline.vtk"
+CentrelineGenerator.sphereRadius = None
+
+# The preview of large trees is rendered off-screen.
+CentrelineGenerator.preview = 'png'
+
+# Fail if any branches of the generated tree cross.
+CentrelineGenerator.checkCrossings = True
+
+def main():
+    startTime = time.time()
+    CentrelineGenerator.segmentList = CentrelineGenerator.RandomTreeSegmentList(depth, CentrelineGenerator.radiusBase,
+                                                                                lengthRadiusRatio = 7.0,
+                                                                                branchAngleRange = (30.0, 60.0),
+                                                                                seed = seed)
+    print("Built the segment list of a depth %d tree in %.2f seconds." % (depth, time.time() - startTime))
+
+    CentrelineGenerator.GenerateCentreline(CentrelineGenerator.BuildMurraysLawRadii)
+
+if __name__ == '__main__':
+    print("Starting", os.path.basename(__file__))
+    main()
+    print("Exiting", os.path.basename(__file__))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass analysis of the branches in a task mesh.
+
+The "branchId" and "gridCoords" cell arrays are read once with NumPy to find,
+for every branch label, the contiguous range of cells it occupies, the number
+of rings of quads and the extent of its grid coordinates. The result is saved
+as JSON next to the task mesh, so later scripts can use it without reading the
+task mesh again. The saved analysis is discarded automatically when the task
+mesh file changes.
+"""
+
+import os
+import json
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+import MeshReordering
+
+# Names of the branches in output file names, by label. Labels beyond these are
+# named "branch_<label>".
+branchNames = ["parent", "left_daughter", "right_daughter"]
+
+def branchName(label):
+    """ Name of the branch with the given label, for output file names. """
+    if label < len(branchNames):
+        return branchNames[label]
+    return "branch_%d" % label
+
+def cellBranchIds(mesh):
+    """ Branch of every cell, from the "branchId" cell array. Meshes without
+        the array are taken to hold the cells of the three branches of a
+        bifurcation in equal consecutive parts.
+    """
+    numCells = mesh.GetNumberOfCells()
+    branchIdArray = mesh.GetCellData().GetArray("branchId")
+
+    if branchIdArray != None:
+        return numpy_support.vtk_to_numpy(branchIdArray).astype(numpy.int64)
+
+    return numpy.arange(numCells) // (numCells // 3)
+
+def analyseTaskMesh(taskMesh, numQuadsPerRing):
+    """ Analyse the branches of a task mesh. Returns a dictionary with the
+        labels, and per label the cell range [begin, end), number of rings
+        and grid coordinates extent ([min axial, min circumferential],
+        [max axial, max circumferential]).
+    """
+    cellData = taskMesh.GetCellData()
+    if cellData.HasArray("branchId"):
+        branchIds = numpy_support.vtk_to_numpy(cellData.GetArray("branchId"))
+    else:
+        branchIds = numpy_support.vtk_to_numpy(cellData.GetScalars())
+    branchIds = branchIds.reshape(-1).astype(numpy.int64)
+
+    gridCoords = None
+    if cellData.HasArray("gridCoords"):
+        gridCoords = numpy_support.vtk_to_numpy(cellData.GetArray("gridCoords")).reshape(branchIds.shape[0], -1)
+
+    # Runs of consecutive cells with the same label.
+    runStarts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(branchIds)) + 1))
+    runEnds = numpy.concatenate((runStarts[1:], [branchIds.shape[0]]))
+    runLabels = branchIds[runStarts]
+
+    assert numpy.unique(runLabels).shape[0] == runLabels.shape[0], \
+        "The cells of every branch label must be stored contiguously in the task mesh."
+
+    if gridCoords is not None:
+        runMin = numpy.minimum.reduceat(gridCoords, runStarts, axis=0)
+        runMax = numpy.maximum.reduceat(gridCoords, runStarts, axis=0)
+
+    # Labels span the whole range, as the label range of the scalars did.
+    labels = list(range(int(runLabels.min()), int(runLabels.max()) + 1))
+
+    topology = {
+        "numQuadsPerRing": int(numQuadsPerRing),
+        "topologyKey": MeshReordering.topologyKey(taskMesh),
+        "labels": labels,
+        "cellRanges": {},
+        "numRings": {},
+        "gridExtents": {},
+    }
+
+    for label in labels:
+        topology["cellRanges"][label] = (0, 0)
+        topology["numRings"][label] = 0
+        topology["gridExtents"][label] = None
+
+    for run in range(runLabels.shape[0]):
+        label = int(runLabels[run])
+        numCells = int(runEnds[run] - runStarts[run])
+
+        assert numCells % numQuadsPerRing == 0, \
+            "Label %d has %d cells, which is not a multiple of %d quads per ring." % (label, numCells, numQuadsPerRing)
+
+        topology["cellRanges"][label] = (int(runStarts[run]), int(runEnds[run]))
+        topology["numRings"][label] = numCells // int(numQuadsPerRing)
+
+        if gridCoords is not None:
+            topology["gridExtents"][label] = (runMin[run].tolist(), runMax[run].tolist())
+
+    return topology
+
+def topologyFileName(taskMeshFile):
+    return os.path.splitext(taskMeshFile)[0] + ".topology.json"
+
+def saveTopology(topology, fileName):
+    """ Save a branch topology as JSON. """
+    labelRecords = []
+    for label in topology["labels"]:
+        labelRecords.append({
+            "label": label,
+            "cellRange": list(topology["cellRanges"][label]),
+            "numRings": topology["numRings"][label],
+            "gridExtent": topology["gridExtents"][label],
+        })
+
+    record = dict((key, value) for key, value in topology.items()
+                  if key not in ["labels", "cellRanges", "numRings", "gridExtents"])
+    record["branches"] = labelRecords
+
+    with open(fileName, 'w') as f:
+        json.dump(record, f, indent=2)
+
+def loadTopology(fileName):
+    """ Load a branch topology saved by saveTopology. """
+    with open(fileName, 'r') as f:
+        record = json.load(f)
+
+    topology = dict((key, value) for key, value in record.items() if key != "branches")
+    topology["labels"] = []
+    topology["cellRanges"] = {}
+    topology["numRings"] = {}
+    topology["gridExtents"] = {}
+
+    for labelRecord in record["branches"]:
+        label = labelRecord["label"]
+        topology["labels"].append(label)
+        topology["cellRanges"][label] = tuple(labelRecord["cellRange"])
+        topology["numRings"][label] = labelRecord["numRings"]
+        topology["gridExtents"][label] = labelRecord["gridExtent"]
+
+    return topology
+
+def branchTopology(taskMeshFile, numQuadsPerRing, taskMesh = None):
+    """ Branch topology of a task mesh file. The saved analysis next to the task
+        mesh is used when it matches the current task mesh file, otherwise the
+        task mesh is analysed (and read, unless given) and the analysis saved.
+    """
+    stat = os.stat(taskMeshFile)
+    fileStamp = [stat.st_size, stat.st_mtime]
+    fileName = topologyFileName(taskMeshFile)
+
+    if taskMesh is None and os.path.isfile(fileName):
+        topology = loadTopology(fileName)
+        if topology.get("taskMeshStamp") == fileStamp and topology["numQuadsPerRing"] == int(numQuadsPerRing):
+            print("Using branch topology from", fileName, "...")
+            return topology
+        print("Branch topology", fileName, "is stale, analysing the task mesh ...")
+
+    if taskMesh is None:
+        taskMeshReader = vtk.vtkXMLPolyDataReader()
+        taskMeshReader.SetFileName(taskMeshFile)
+        taskMeshReader.Update()
+        taskMesh = taskMeshReader.GetOutput()
+
+    topology = analyseTaskMesh(taskMesh, numQuadsPerRing)
+    topology["taskMeshStamp"] = fileStamp
+
+    try:
+        saveTopology(topology, fileName)
+    except (IOError, OSError) as e:
+        print("Could not write branch topology", fileName, ":", e)
+
+    return topology
+
+def usage():
+    print("This module provides task mesh analysis helpers to be imported by the mesh export scripts.")
+
+if __name__ == '__main__':
+    print("Starting", os.path.basename(__file__))
+    usage()
+    print("Exiting", os.path.basename(__file__))
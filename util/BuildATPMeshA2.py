@@ -3,14 +3,14 @@
 Create an initial ATP Profile for an ECs Mesh and write it out as .vtp.
 """
 
-# TODO: Separating the dataset into branches would make the script simpler.
-# Branch labelling is also required for processing tree datasets of arbitrary complexity.
-
 import os
 import vtk
 import numpy
+from vtk.util import numpy_support
 import matplotlib.pyplot as pyplot
 
+import BranchTopology
+
 meshFile = ''
 atpFile = ''
 numBranches = ''
@@ -29,7 +29,7 @@ def sigmoidATP(x, grd):
 
 def buildATPMeshAsymGrad():
     # Report our CWD just for testing purposes.
-    print "CWD:", os.getcwd()
+    print("CWD:", os.getcwd())
 
     # Read in the mesh.
     meshReader = vtk.vtkXMLPolyDataReader()
@@ -37,13 +37,13 @@ def buildATPMeshAsymGrad():
     meshReader.Update()
 
     mesh = meshReader.GetOutput()
-    print mesh.GetNumberOfCells()
+    print(mesh.GetNumberOfCells())
     
     # Put it through centroids filter.
     # Use VTK centroid filter to get the centroids in the right order
     # from the reorderedECMeshBranch.
     centroidFilter = vtk.vtkCellCenters()
-    centroidFilter.SetInput(mesh)
+    centroidFilter.SetInputData(mesh)
 
     # Create a vertex cell for each point.
     pointsToVerticesFilter = vtk.vtkVertexGlyphFilter()
@@ -53,57 +53,43 @@ def buildATPMeshAsymGrad():
     atpDataset = pointsToVerticesFilter.GetOutput()
     
     # Here we are assuming that cell ordering has been preserved.
-    gridCoords = mesh.GetCellData().GetArray("gridCoords")
+    gridCoords = numpy_support.vtk_to_numpy(mesh.GetCellData().GetArray("gridCoords"))
 
-    # Create a new cell data array "parametricDistance" in the centroids
-    # dataset with the values from the previous step. This array is really not
-    # needed for any computations is good to have for verification. Also,
-    # remember the max value for each branch.
-    axialDist = vtk.vtkIntArray()
+    # The first component of the "gridCoords" cell data array is the axial
+    # distance of the cell. It is kept in the "parametriDistance" array. This
+    # array is really not needed for any computations but is good to have for
+    # verification. Also, it is useful to know the max value for each branch.
+    axialDistValues = gridCoords.reshape(mesh.GetNumberOfCells(), -1)[:, 0].astype(numpy.int32)
+
+    axialDist = numpy_support.numpy_to_vtk(axialDistValues, deep=True, array_type=vtk.VTK_INT)
     axialDist.SetName("parametriDistance")
     
-    # Iterate over all quad cells in the mesh and pull out the first component
-    # of the "gridCoords" cell data array. Here we assuming the mesh contains
-    # only quad cells.
-    # If the branches were labelled properly here, it would be much simpler
-    # to set the neganive axiial distance values by examining the range first.
-    for cellId in range(0, mesh.GetNumberOfCells()):
-        axialDist.InsertNextValue(gridCoords.GetTuple(cellId)[0])
-
-    atpArray = vtk.vtkDoubleArray()
-    atpArray.SetName("initialATP")
-    
     axialDistRange = [0, 0]
     axialDist.GetRange(axialDistRange, 0)
-    
-    # Iterate over the "axialDist" cell array and for each value call
-    # the agonistValue function and store the computed values in the new
-    # "initialATP" cell data array.
-    for cellId in range(0, axialDist.GetNumberOfTuples()):
-        # Figure out the current branch id.
-        branchId = cellId / (axialDist.GetNumberOfTuples() / 3)
-        
+
+    branchIds = BranchTopology.cellBranchIds(mesh)
+    atpGradients = [atpGradient0, atpGradient1, atpGradient2]
+    atpValues = numpy.empty(axialDistValues.shape[0], dtype=numpy.float64)
+
+    # The axial distance takes few distinct values, so the sigmoid is only
+    # evaluated once for each of them in every branch and the values are
+    # gathered for the cells by index.
+    for branchId in numpy.unique(branchIds):
+        branchCells = numpy.flatnonzero(branchIds == branchId)
+        distValues, distIndex = numpy.unique(axialDistValues[branchCells], return_inverse=True)
+
         # For the first branch the parametric distance value must be in the
         # range [maxDist - 1, 0). Range values are required for this.
-        
-        # TODO: The ATP calculations here are repeated many times for the same value
-        # of the parametric distnace. It would make sense to have a lookup table (dictionary)
-        # for previously calculated values.
         if branchId == 0:
-            distVal = axialDist.GetValue(cellId) - axialDistRange[1] - 1
-            atpVal = sigmoidATP(distVal, atpGradient0)
-            atpArray.InsertNextValue(atpVal)
-        elif branchId == 1:
-            distVal = axialDist.GetValue(cellId)
-            atpVal = sigmoidATP(distVal, atpGradient1)
-            atpArray.InsertNextValue(atpVal)
-        elif branchId == 2:
-            distVal = axialDist.GetValue(cellId)
-            atpVal = sigmoidATP(distVal, atpGradient2)
-            atpArray.InsertNextValue(atpVal)
+            distValues = distValues - axialDistRange[1] - 1
+
+        atpValues[branchCells] = sigmoidATP(distValues.astype(numpy.float64), atpGradients[branchId])[distIndex.ravel()]
+
+    atpArray = numpy_support.numpy_to_vtk(atpValues, deep=True)
+    atpArray.SetName("initialATP")
 
     # Assert the number of cells is equal to the number of items in the cell arrays.
-    assert axialDist.GetNumberOfTuples() == atpDataset.GetNumberOfCells(), "Number of cells (%d) and cell data values (%d) mismatch." % (axialDist.GetNumberOfTuples(), atpDataset.GetNumberOfCells)
+    assert axialDist.GetNumberOfTuples() == atpDataset.GetNumberOfCells(), "Number of cells (%d) and cell data values (%d) mismatch." % (axialDist.GetNumberOfTuples(), atpDataset.GetNumberOfCells())
     assert atpArray.GetNumberOfTuples() == atpDataset.GetNumberOfCells(), "Number of cells (%d) and cell data values (%d) mismatch." % (atpArray.GetNumberOfTuples(), atpDataset.GetNumberOfCells())
     
     atpDataset.GetCellData().AddArray(axialDist)
@@ -111,38 +97,24 @@ def buildATPMeshAsymGrad():
     
     atpMapWriter = vtk.vtkXMLPolyDataWriter()
     atpMapWriter.SetFileName(atpFile)
-    atpMapWriter.SetInput(atpDataset)
+    atpMapWriter.SetInputData(atpDataset)
     atpMapWriter.Update()
 
-    f, (ax1, ax2, ax3) = pyplot.subplots(3, sharex=True, sharey=True)
-    
+    f, axes = pyplot.subplots(3, sharex=True, sharey=True)
+
+    # Provide a quick visualisation of the ATP profile for validation.
+    pointsX = numpy.arange(-int(axialDistRange[1] - 1), int(axialDistRange[1]))
+
     for branchId in range(0, 3):
-        # Provide a quick visualisation of the ATP profile for validation.
-        pointsX = range(-int(axialDistRange[1] - 1), int(axialDistRange[1]))
-        pointsY = []
-        
-        for pt in pointsX:
-            if branchId == 0:
-                pointsY.append(sigmoidATP(pt, atpGradient0))
-            elif branchId == 1:
-                pointsY.append(sigmoidATP(pt, atpGradient1))
-            elif branchId == 2:
-                pointsY.append(sigmoidATP(pt, atpGradient2))
-            
-        if branchId == 0:
-            ax1.plot(pointsX, pointsY, 'b')
-        elif branchId == 1:
-            ax2.plot(pointsX, pointsY, 'b')
-        elif branchId == 2:
-            ax3.plot(pointsX, pointsY, 'b')
+        axes[branchId].plot(pointsX, sigmoidATP(pointsX, atpGradients[branchId]), 'b')
 
     f.subplots_adjust(hspace=0)
     pyplot.show()
 
 def main():
-    print "This script is to be run with global parameters (input, output files, etc.) set in the calling script."
+    print("This script is to be run with global parameters (input, output files, etc.) set in the calling script.")
 
 if __name__ == '__main__':
-    print "Starting", os.path.basename(__file__)
+    print("Starting", os.path.basename(__file__))
     main()
-    print "Exiting", os.path.basename(__file__)
\ No newline at end of file
+    print("Exiting", os.path.basename(__file__))
@@ -6,23 +6,39 @@
 # and right branches if any.
 #
 # Parameters to control the generated tree points are to be set in this file.
-# VTK visualisation of the tree is shown at the end.
+# VTK visualisation of the tree is shown at the end, or rendered off-screen to
+# a PNG file, or skipped, depending on the preview parameter.
 # 
 # Tree grows from (0,0,0) towards positive x-axis. Bifurcations occur at 45 degrees
 # by defualt, or at a given angle if specfied.
 #
 # Domains are either given as a number, which represents the domain length, or a 
-# tuple that represents (domain length, angle).
+# tuple that represents (domain length, angle), or (domain length, (x, y, z))
+# for a branch heading along the vector (x, y, z) out of the XY plane.
+#
+# Large random bifurcating trees can be built with RandomTreeSegmentList
+# instead of writing the nested list by hand. Their bifurcation planes are
+# rotated about the branches, so they grow in 3D, and no branch comes closer to
+# another one than the sum of their radii.
 #
 # All angles are measured clockwise from the positive y-axis, and are specified
 # in degrees.
 #
 # Output centrelines are saved in VTK legacy format.
+#
+# GenerateCentreline uses the module parameters below. The TreeCentreline class
+# takes them as arguments instead and returns a new vtkPolyData on every call,
+# for generating many centrelines in one process.
 
 import os
 import sys
+import time
 import vtk
 import math
+import numpy
+from vtk.util import numpy_support
+
+import MeshReordering
 
 
 # Default branch angle if the angle per branch is not specified.
@@ -34,270 +50,474 @@ radiusBase = 1.0
 # Otherwise the centreline is wrapped on a sphere of the specified radius.
 sphereRadius = None
 
-points = vtk.vtkPoints()
-lines = vtk.vtkCellArray()
-radii = vtk.vtkDoubleArray()
-radii.SetName("radiiScalars")
-centreline = vtk.vtkPolyData()
+# Preview of the centreline: 'show' opens an interactive VTK window, 'png'
+# renders it off-screen to previewFile and None skips it. 'png' and None do not
+# block, so sweeps can run unattended.
+preview = 'show'
 
-def BuildCentreline(segmentList, firstId = 0, firstPt = (0.0,0.0,0.0), direction = 0.0):
-    print("Processing centreline:", segmentList)
-    
-    domain = None
+# PNG file for the 'png' preview, defaults to outputFileName with the .png extension.
+previewFile = None
+previewSize = (800, 600)
 
-    try:
-        domain = segmentList[0]
-    except IndexError:
-        sys.exit("Missing domain length in list " + str(list) + ".")
-        
-    if isinstance(domain, tuple):
-        domainLength = domain[0]
-        angle = math.radians(domain[1])
-    else:    
-        if not isinstance(domain, (int, float)):
-            sys.exit("Domain length should be a number, not a(an) " + str(type(domainLength)) + ".")
-        angle = branchAngle
-        domainLength = domain
-    
-    leftBranch = None
-    try:
-        leftBranch = segmentList[1]
-    except IndexError:
-        pass
-    
-    rightBranch = None
-    try:
-        rightBranch = segmentList[2]
-    except IndexError:
-        pass
-    
-    line = vtk.vtkPolyLine()
-    
-    if  direction < 0:
-        angle = math.pi - angle
-    
-    for pId in range (0, int(domainLength / step) + 1):
-            nextPt = ((firstPt[0] + (1.0 if direction == 0.0 else math.sin(angle)) * (step * pId)) * scaling, \
-                        (firstPt[1] + (1.0 if direction == 0.0 else math.cos(angle)) * (step * pId) * direction) * scaling , \
-                        firstPt[2] * scaling)
-                        
-            if sphereRadius != None:
-                longitude = nextPt[0] / sphereRadius
-                latitude = 2 * math.atan(math.exp(nextPt[1] / sphereRadius)) - math.pi / 2.0
-                nextPtS = (sphereRadius * math.cos(latitude) * math.cos(longitude),\
-                            sphereRadius * math.cos(latitude) * math.sin(longitude),\
-                            sphereRadius * math.sin(latitude))
-            
-                if firstId == 0 or pId > 0:
-                    nextId = points.InsertNextPoint(nextPtS)
-                else:
-                    nextId = firstId
-            else:
-                if firstId == 0 or pId > 0:
-                    nextId = points.InsertNextPoint(nextPt)
-                else:
-                    nextId = firstId
-            
-            line.GetPointIds().InsertNextId(nextId)
-            
-    lines.InsertNextCell(line)
-    
-    if isinstance(leftBranch, list):
-        BuildCentreline(leftBranch, nextId, nextPt, 1.0)
+# Exit with an error from GenerateCentreline if any branches of the tree cross,
+# see TreeCentreline.Crossings.
+checkCrossings = False
 
-    if isinstance(rightBranch, list):
-        BuildCentreline(rightBranch, nextId, nextPt, -1.0)
+def SegmentDistances(start, end, starts, ends):
+    """ Shortest distances between the straight segment from start to end and
+        each of the segments from starts[i] to ends[i].
+    """
+    start = numpy.asarray(start, dtype=numpy.float64)
+    direction = numpy.asarray(end, dtype=numpy.float64) - start
+    starts = numpy.asarray(starts, dtype=numpy.float64)
+    directions = numpy.asarray(ends, dtype=numpy.float64) - starts
+    offsets = start - starts
 
-# TODO: What does this function return?
-def TreeTraversal(startingCell):
-    
-    branchesToExplore = vtk.vtkPriorityQueue()
-    points1 = vtk.vtkGenericCell()
-    cellIds = vtk.vtkIdList()
-    priority = int(lines.GetNumberOfCells())
-    
-    path = [startingCell]
-    paths = []
-    traversal = []    
-    
-    lengths = [0] * int(lines.GetNumberOfCells())  
-    branchesToExplore.Insert(priority, startingCell)
-    priority -= 1
-    
-        
-    centreline.GetCell(startingCell, points1)
-    lengths[startingCell] = int(points1.GetNumberOfPoints() - 1)
-    currentId = startingCell
-    
-    while branchesToExplore.GetNumberOfItems() != 0:
-        points2 = vtk.vtkGenericCell()
-   
-        centreline.GetCell(currentId, points2)
-        
-        endPointId = int(points2.GetPointId(points2.GetNumberOfPoints() - 1))
-        
-        centreline.GetPointCells(endPointId, cellIds)
-        
-        if cellIds.GetNumberOfIds() > 1:
-            for pos in range(1, cellIds.GetNumberOfIds()):
-                branchesToExplore.Insert(priority, cellIds.GetId(pos))
-                priority -= 1
-                
-                centreline.GetCell(cellIds.GetId(pos), points2)
-                lengths[cellIds.GetId(pos)] = int(points2.GetNumberOfPoints() - 1 + lengths[currentId])
-
-                paths.append(path[:] + [int(cellIds.GetId(pos))])
-                
+    a = max(numpy.dot(direction, direction), 1e-300)
+    b = numpy.dot(directions, direction)
+    c = numpy.dot(offsets, direction)
+    e = (directions * directions).sum(axis=1)
+    f = (offsets * directions).sum(axis=1)
+
+    # Parameters of the closest points on the infinite lines, clamped to the
+    # segments, the other parameter recomputed for the clamped one. Segments
+    # of (almost) no length are points, at s = 0 or t = 0.
+    denominator = a * e - b * b
+    points = e <= 1e-12 * a
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        s = numpy.where(denominator > 1e-12 * a * e, numpy.clip((b * f - c * e) / denominator, 0.0, 1.0), 0.0)
+        t = numpy.where(points, 0.0, (b * s + f) / e)
+
+        below = (t < 0.0) | points
+        above = t > 1.0
+        t = numpy.clip(t, 0.0, 1.0)
+        s = numpy.where(below, numpy.clip(-c / a, 0.0, 1.0), s)
+        s = numpy.where(above, numpy.clip((b - c) / a, 0.0, 1.0), s)
+
+    closest = offsets + s[:, None] * direction[None, :] - t[:, None] * directions
+    return numpy.sqrt((closest * closest).sum(axis=1))
+
+def CountSegments(segmentList):
+    """ Number of segments in a segment list. """
+    return 1 + sum(CountSegments(branch) for branch in segmentList[1:] if isinstance(branch, list))
+
+class TreeCentreline(object):
+    """ Centreline of a tree given as a nested segment list. Every call to
+        Generate builds an independent vtkPolyData, so many centrelines can be
+        generated in one process or in parallel.
+    """
+
+    def __init__(self, segmentList, branchAngle = branchAngle, scaling = scaling, step = step,
+                 radiusBase = radiusBase, sphereRadius = sphereRadius):
+        self.segmentList = segmentList
+        self.branchAngle = branchAngle
+        self.scaling = scaling
+        self.step = step
+        self.radiusBase = radiusBase
+        self.sphereRadius = sphereRadius
+
+    def ProjectToSphere(self, planarPoints):
+        # Wrap points in the XY plane on the sphere, x is the longitude and y
+        # the Mercator projection of the latitude.
+        longitude = planarPoints[:, 0] / self.sphereRadius
+        latitude = 2 * numpy.arctan(numpy.exp(planarPoints[:, 1] / self.sphereRadius)) - math.pi / 2.0
+
+        return numpy.column_stack((self.sphereRadius * numpy.cos(latitude) * numpy.cos(longitude),
+                                   self.sphereRadius * numpy.cos(latitude) * numpy.sin(longitude),
+                                   self.sphereRadius * numpy.sin(latitude)))
+
+    def BuildSegment(self, segmentList, firstId = 0, firstPt = (0.0,0.0,0.0), direction = 0.0, parentCell = -1):
+        domain = None
+
+        try:
+            domain = segmentList[0]
+        except IndexError:
+            sys.exit("Missing domain length in list " + str(segmentList) + ".")
+
+        heading = None
+        if isinstance(domain, tuple) and isinstance(domain[1], (tuple, list)):
+            if self.sphereRadius != None:
+                sys.exit("Domain " + str(domain) + " with a heading vector can't be wrapped on a sphere.")
+            domainLength = domain[0]
+            angle = None
+            heading = numpy.array(domain[1], dtype=numpy.float64)
+            heading /= numpy.linalg.norm(heading)
+        elif isinstance(domain, tuple):
+            domainLength = domain[0]
+            angle = math.radians(domain[1])
         else:
-            traversal.append([path,lengths[currentId]])
-            
-        currentId = int(branchesToExplore.Pop())
-        if len(paths) != 0:    
-            path = paths.pop()
-        
-    traversal.sort(key = lambda x: x[1], reverse = True)
-    
-    return traversal
-                
-def BuildDecreasingRadiiScalars():
+            if not isinstance(domain, (int, float)):
+                sys.exit("Domain length should be a number, not a(an) " + str(type(domain)) + ".")
+            angle = self.branchAngle
+            domainLength = domain
 
-    print("Generating decreasing vessel radii...")
-    
-    radii.SetNumberOfValues(points.GetNumberOfPoints())
-    radii.InsertValue(0, radiusBase)
-    alreadyBuilt = []
-    bifurcationValues = dict()
-    distanceCovered = 0
-    traversal = TreeTraversal(0)
-    
-    # For every path, starting from longest route.
-    for path, length in traversal:
-    
-        distanceCovered = 0
-        
-        # For each cellId in path, check hasn't already been done.
-        for cellId in path:
-        
-            connectedCellIds = vtk.vtkIdList()            
-            ids = vtk.vtkGenericCell()
-            centreline.GetCell(cellId, ids)
-        
-            newId = ids.GetPointId(0)
-            centreline.GetPointCells(newId, connectedCellIds)
-        
-            if connectedCellIds.GetNumberOfIds() > 1:
-                minCellId = connectedCellIds.GetId(0)
-        
-                for i in range(1, connectedCellIds.GetNumberOfIds()):
-                    minCellId = min(minCellId, connectedCellIds.GetId(i))
-                
-                scalarValue = bifurcationValues[minCellId]
-                
-            else: # for first iteration (inlet)
-                scalarValue = radiusBase
-                
-            if cellId not in alreadyBuilt:
-                start = int(ids.GetPointId(1))
-                end = int(ids.GetNumberOfPoints()) + start - 1
-
-                p = length - distanceCovered
-                i = 1
-                
-                for pointId in range(start, end):
-                    k = (math.log(0.5)-math.log(scalarValue))/p
-                    x0 = math.exp(math.log(0.5)-k*p)
-                    x = x0 * math.exp(k*i)   
-                                    
-                    radii.SetValue(pointId, x)
-                    i += 1
-                    
-                bifurcationValues[cellId] = x
-                alreadyBuilt.append(cellId)
-                
-            distanceCovered += int(ids.GetNumberOfPoints() - 1)
-
-def BuildMurraysLawRadii(decreaseLength = 3):
-    print("Generating vessel radii as per Murry\'s Law...")
-    
-    radii.SetNumberOfValues(points.GetNumberOfPoints())
+        leftBranch = None
+        try:
+            leftBranch = segmentList[1]
+        except IndexError:
+            pass
 
-    ids = vtk.vtkIdList()
-    lines.InitTraversal()
-    lines.GetNextCell(ids)
-    
-    decreaseLength /= step
-    
-    # Assign trunk scalars indentically as radiusBase.
-    for pointId in range(ids.GetId(0), ids.GetNumberOfIds()):
-        radii.SetValue(pointId, radiusBase)
-        
-    numLines = int(lines.GetNumberOfCells())
-    # For each line (cell) in the tree.
-    for line in range (1, numLines):
-        ids = vtk.vtkIdList()
-        lines.GetNextCell(ids)
-        
-        start = ids.GetId(1)
-        end = ids.GetNumberOfIds() + start - 1
-        
-        i = 1
-        # With the DFS the previous value will always exist...?
-        parentValue = radii.GetValue(ids.GetId(0)) # Can we assume this?
-        childValue = ((parentValue ** 3) / 2) ** (1 / 3.0)
-        
-        distance = parentValue * decreaseLength
-        if distance > ids.GetNumberOfIds():
-            distance = ids.GetNumberOfIds()
-
-        for pointId in range(start, end):  
-            if i < distance:
-                k = (math.log(childValue)-math.log(parentValue)) / distance
-                x0 = math.exp(math.log(childValue) - k * distance)
-                x = x0 * math.exp(k*i)   
-                                
-                radii.SetValue(pointId, x)
-                i += 1
-            else:
-                radii.SetValue(pointId, childValue)
+        rightBranch = None
+        try:
+            rightBranch = segmentList[2]
+        except IndexError:
+            pass
 
-def GenerateCentreline(radiiBuilderFunction = None):
-    global centreline
-    
-    BuildCentreline(segmentList)
-    
-    print("Number of points in the centreline:", points.GetNumberOfPoints())
-    centreline.SetPoints(points)    
-    centreline.SetLines(lines)
-    
-    if radiiBuilderFunction != None:
-        radiiBuilderFunction()
-    else:
-        print("Generating constant radii for all points...")
-        rIdx = 0
-        while rIdx < points.GetNumberOfPoints():
-            radii.InsertNextValue(radiusBase)
-            rIdx = rIdx + 1
-    
-    centreline.GetPointData().SetScalars(radii)
-
-    if sphereRadius != None:
-        origin = centreline.GetPoint(0)
-        transform = vtk.vtkTransform()
-        transform.Translate(-origin[0],-origin[1],-origin[2])
-        transformFilter = vtk.vtkTransformPolyDataFilter()
-        transformFilter.SetInputData(centreline)
-        transformFilter.SetTransform(transform)
-        
-        transformFilter.Update()
-        centreline = transformFilter.GetOutput()
+        if  direction < 0 and heading is None:
+            angle = math.pi - angle
+
+        # All points of the segment at once, before scaling and wrapping.
+        numSegmentPoints = int(domainLength / self.step) + 1
+        distance = numpy.linspace(0.0, self.step * (numSegmentPoints - 1), numSegmentPoints)
+
+        planarPoints = numpy.empty((numSegmentPoints, 3))
+        if heading is not None:
+            planarPoints[:] = (numpy.array(firstPt) + heading * distance[:, None]) * self.scaling
+        else:
+            planarPoints[:, 0] = (firstPt[0] + (1.0 if direction == 0.0 else math.sin(angle)) * distance) * self.scaling
+            planarPoints[:, 1] = (firstPt[1] + (1.0 if direction == 0.0 else math.cos(angle)) * distance * direction) * self.scaling
+            planarPoints[:, 2] = firstPt[2] * self.scaling
+
+        segmentPoints = planarPoints
+        if self.sphereRadius != None:
+            segmentPoints = self.ProjectToSphere(planarPoints)
+
+        # The first point of a branch is the last point of its parent.
+        if firstId == 0:
+            pointIds = numpy.arange(self.numPoints, self.numPoints + numSegmentPoints)
+        else:
+            segmentPoints = segmentPoints[1:]
+            pointIds = numpy.concatenate(([firstId], numpy.arange(self.numPoints, self.numPoints + numSegmentPoints - 1)))
+
+        # Record the segment as a cell of the tree's adjacency list.
+        cellId = len(self.cellPointIds)
+        self.cellPointIds.append(pointIds)
+        self.cellParents.append(parentCell)
+        self.cellChildren.append([])
+        if parentCell >= 0:
+            self.cellChildren[parentCell].append(cellId)
+
+        self.pointBlocks.append(segmentPoints)
+        self.numPoints += segmentPoints.shape[0]
+
+        lastId = int(pointIds[-1])
+        lastPt = tuple(planarPoints[-1])
+
+        if isinstance(leftBranch, list):
+            self.BuildSegment(leftBranch, lastId, lastPt, 1.0, cellId)
+
+        if isinstance(rightBranch, list):
+            self.BuildSegment(rightBranch, lastId, lastPt, -1.0, cellId)
+
+    def BuildCentreline(self):
+        """ Build the points and polylines of the centreline. """
+        self.pointBlocks = []
+        self.cellPointIds = []
+        self.cellParents = []
+        self.cellChildren = []
+        self.numPoints = 0
+
+        # Large trees are too long to print.
+        numSegments = CountSegments(self.segmentList)
+        if numSegments <= 15:
+            print("Processing centreline:", self.segmentList)
+        else:
+            print("Processing centreline with", numSegments, "segments")
+        self.BuildSegment(self.segmentList)
+
+        self.points = vtk.vtkPoints()
+        self.points.SetData(numpy_support.numpy_to_vtk(numpy.concatenate(self.pointBlocks).astype(numpy.float32), deep=True))
+
+        offsets = numpy.cumsum([0] + [len(ids) for ids in self.cellPointIds]).astype(numpy.int64)
+        connectivity = numpy.concatenate(self.cellPointIds).astype(numpy.int64)
+
+        self.lines = MeshReordering.buildCellArray(offsets, connectivity)
+
+        del self.pointBlocks
+
+        self.radii = vtk.vtkDoubleArray()
+        self.radii.SetName("radiiScalars")
+
+        self.centreline = vtk.vtkPolyData()
+        self.centreline.SetPoints(self.points)
+        self.centreline.SetLines(self.lines)
+
+    def DepthFirstCells(self):
+        """ Cell ids of the tree in depth-first order, left branches first. """
+        order = []
+        stack = [0]
+        while len(stack) != 0:
+            cellId = stack.pop()
+            order.append(cellId)
+            stack.extend(reversed(self.cellChildren[cellId]))
+        return order
+
+    def Crossings(self):
+        """ Pairs of cells that are not neighbours (parent and child, or
+            siblings) whose straight segments, between their end points, come
+            closer than the sum of their largest radii. An empty list for a
+            valid tree. Without radii any touching segments are reported.
+        """
+        points = numpy_support.vtk_to_numpy(self.points.GetData()).astype(numpy.float64)
+        starts = points[[ids[0] for ids in self.cellPointIds]]
+        ends = points[[ids[-1] for ids in self.cellPointIds]]
+
+        radiiValues = numpy.zeros(points.shape[0])
+        if self.radii.GetNumberOfTuples() == points.shape[0]:
+            radiiValues = numpy_support.vtk_to_numpy(self.radii)
+        cellRadii = numpy.array([radiiValues[ids].max() for ids in self.cellPointIds])
+
+        crossings = []
+        for cellId in range(len(self.cellPointIds) - 1):
+            others = numpy.arange(cellId + 1, len(self.cellPointIds))
+            distances = SegmentDistances(starts[cellId], ends[cellId], starts[others], ends[others])
+
+            parentCell = self.cellParents[cellId]
+            neighbours = set(self.cellChildren[cellId])
+            if parentCell >= 0:
+                neighbours.add(parentCell)
+                neighbours.update(self.cellChildren[parentCell])
+
+            for otherId in others[distances < cellRadii[cellId] + cellRadii[others]]:
+                if int(otherId) not in neighbours:
+                    crossings.append((cellId, int(otherId)))
+
+        return crossings
+
+    def SetRadii(self, radiiValues):
+        self.radii = numpy_support.numpy_to_vtk(radiiValues, deep=True)
+        self.radii.SetName("radiiScalars")
+
+    def BuildDecreasingRadiiScalars(self):
+        """ Radii decreasing exponentially from radiusBase at the inlet to 0.5
+            at the end of the longest path through every segment.
+        """
+        print("Generating decreasing vessel radii...")
+
+        order = self.DepthFirstCells()
+        numCells = len(order)
+        segmentLengths = [len(ids) - 1 for ids in self.cellPointIds]
+
+        # Path length from the inlet to the start of every segment, and to the
+        # furthest outlet reached through it.
+        startLengths = [0] * numCells
+        for cellId in order[1:]:
+            parentCell = self.cellParents[cellId]
+            startLengths[cellId] = startLengths[parentCell] + segmentLengths[parentCell]
+
+        pathLengths = [0] * numCells
+        for cellId in reversed(order):
+            pathLengths[cellId] = max([pathLengths[child] for child in self.cellChildren[cellId]] or
+                                      [startLengths[cellId] + segmentLengths[cellId]])
+
+        radiiValues = numpy.empty(self.points.GetNumberOfPoints())
+        radiiValues[0] = self.radiusBase
+        endValues = [0.0] * numCells
+
+        for cellId in order:
+            parentCell = self.cellParents[cellId]
+            scalarValue = self.radiusBase if parentCell < 0 else endValues[parentCell]
+
+            # The profile reaches 0.5 at the end of the longest path.
+            p = pathLengths[cellId] - startLengths[cellId]
+            k = (math.log(0.5) - math.log(scalarValue)) / p
+            x0 = math.exp(math.log(0.5) - k * p)
+
+            pointIds = self.cellPointIds[cellId][1:]
+            radiiValues[pointIds] = x0 * numpy.exp(k * numpy.arange(1, len(pointIds) + 1))
+
+            endValues[cellId] = radiiValues[pointIds[-1]] if len(pointIds) != 0 else scalarValue
+
+        self.SetRadii(radiiValues)
+
+    def BuildMurraysLawRadii(self, decreaseLength = 3):
+        """ Radii halving the cube of the parent radius at every bifurcation as
+            per Murray's law, over decreaseLength parent radii into a branch.
+        """
+        print("Generating vessel radii as per Murry\'s Law...")
+
+        decreaseLength /= self.step
+
+        radiiValues = numpy.empty(self.points.GetNumberOfPoints())
+
+        for cellId in self.DepthFirstCells():
+            pointIds = self.cellPointIds[cellId]
+
+            if self.cellParents[cellId] < 0:
+                # Assign trunk scalars indentically as radiusBase.
+                radiiValues[pointIds] = self.radiusBase
+                continue
+
+            # With the DFS the parent value always exists.
+            parentValue = radiiValues[pointIds[0]]
+            childValue = ((parentValue ** 3) / 2) ** (1 / 3.0)
+
+            distance = min(parentValue * decreaseLength, len(pointIds))
+
+            k = (math.log(childValue) - math.log(parentValue)) / distance
+            x0 = math.exp(math.log(childValue) - k * distance)
+
+            i = numpy.arange(1, len(pointIds))
+            radiiValues[pointIds[1:]] = numpy.where(i < distance, x0 * numpy.exp(k * i), childValue)
+
+        self.SetRadii(radiiValues)
+
+    def Generate(self, radiiBuilderFunction = None):
+        """ Build the centreline and its radii, given by radiiBuilderFunction
+            called with this generator, e.g. TreeCentreline.BuildMurraysLawRadii.
+            Returns a new vtkPolyData.
+        """
+        self.BuildCentreline()
+
+        print("Number of points in the centreline:", self.points.GetNumberOfPoints())
+
+        if radiiBuilderFunction != None:
+            radiiBuilderFunction(self)
+        else:
+            print("Generating constant radii for all points...")
+            self.SetRadii(numpy.full(self.points.GetNumberOfPoints(), self.radiusBase))
+
+        self.centreline.GetPointData().SetScalars(self.radii)
+
+        if self.sphereRadius != None:
+            origin = self.centreline.GetPoint(0)
+            transform = vtk.vtkTransform()
+            transform.Translate(-origin[0],-origin[1],-origin[2])
+            transformFilter = vtk.vtkTransformPolyDataFilter()
+            transformFilter.SetInputData(self.centreline)
+            transformFilter.SetTransform(transform)
+
+            transformFilter.Update()
+            self.centreline = transformFilter.GetOutput()
+
+        return self.centreline
+
+def RotateVector(vector, axis, angle):
+    """ vector rotated by angle (radians) about the unit vector axis. """
+    return (vector * math.cos(angle) + numpy.cross(axis, vector) * math.sin(angle) +
+            axis * numpy.dot(axis, vector) * (1.0 - math.cos(angle)))
+
+def RandomTreeSegmentList(depth, radiusBase = radiusBase, lengthRadiusRatio = 7.0, branchAngleRange = (30.0, 60.0), seed = None,
+                          rollAngleRange = (60.0, 120.0), maxTries = 100):
+    """ Segment list of a random symmetric bifurcating tree with depth levels
+        of bifurcations, 2 ** (depth + 1) - 1 segments in all.
+
+        Radii follow Murray's law, the cube of a parent radius is split evenly
+        between its branches, and every segment is lengthRadiusRatio times as
+        long as its radius. Each branch turns away from its parent's heading
+        by an angle drawn uniformly from branchAngleRange (degrees). The first
+        bifurcation is in the XY plane, the left branch towards the positive
+        y-axis, and the plane of every further bifurcation is rolled about the
+        parent by an angle drawn from rollAngleRange (degrees), so the tree
+        grows in 3D.
+
+        Branches are drawn again, up to maxTries times, while they come closer
+        to a segment other than their parent or sibling than the sum of the
+        two radii, each segment taking its parent's radius. If they still don't
+        fit, their parent is drawn again. The same seed gives the same tree.
+        Use it with BuildMurraysLawRadii to get the matching radii.
+    """
+    random = numpy.random.RandomState(seed)
+
+    radii = radiusBase * 2.0 ** (-numpy.arange(depth + 1) / 3.0)
+    domainLengths = radii * lengthRadiusRatio
+    # As built by TreeCentreline.BuildSegment, in whole steps.
+    segmentLengths = step * (domainLengths / step).astype(int)
+
+    # Segments in breadth first order, the branches of segment i are 2 * i + 1
+    # and 2 * i + 2, with the plane normal of the bifurcation they come from.
+    # The trunk runs along the x-axis.
+    numSegments = 2 ** (depth + 1) - 1
+    starts = numpy.zeros((numSegments, 3))
+    ends = numpy.zeros((numSegments, 3))
+    headings = numpy.zeros((numSegments, 3))
+    normals = numpy.zeros((numSegments, 3))
+    clearances = numpy.zeros(numSegments)
+
+    ends[0] = (segmentLengths[0], 0.0, 0.0)
+    headings[0] = (1.0, 0.0, 0.0)
+    normals[0] = (0.0, 0.0, 1.0)
+    clearances[0] = radiusBase
+
+    def fits(start, end, clearance, numPlaced, excluded):
+        distances = SegmentDistances(start, end, starts[:numPlaced], ends[:numPlaced]) - clearances[:numPlaced]
+        distances[excluded] = numpy.inf
+        return distances.min() > clearance + 1e-3
+
+    def bifurcation(parent, numPlaced):
+        """ Plane normal and headings of the branches of parent, None if they
+            don't fit in maxTries.
+        """
+        generation = (parent + 1).bit_length()
+        for tries in range(maxTries):
+            leftAngle, rightAngle = numpy.radians(random.uniform(branchAngleRange[0], branchAngleRange[1], 2))
+            normal = normals[parent]
+            if parent != 0:
+                normal = RotateVector(normal, headings[parent], math.radians(random.uniform(rollAngleRange[0], rollAngleRange[1])))
+
+            branchHeadings = [RotateVector(headings[parent], normal, leftAngle), RotateVector(headings[parent], normal, -rightAngle)]
+            if all(fits(ends[parent], ends[parent] + heading * segmentLengths[generation], radii[generation - 1], numPlaced, [parent])
+                   for heading in branchHeadings):
+                return normal, branchHeadings
+
+        return None
+
+    for parent in range(2 ** depth - 1):
+        generation = (parent + 1).bit_length()
+
+        # Segments up to 2 * parent are placed.
+        numPlaced = 2 * parent + 1
+        branches = bifurcation(parent, numPlaced)
+
+        redraws = 0
+        while branches == None:
+            if parent == 0 or redraws == maxTries:
+                raise RuntimeError("Can't fit the branches of segment %d of the random tree with seed %s." % (parent, seed))
+            redraws += 1
+
+            # Turn the parent to another side of its own parent, keeping its
+            # sibling, and try its branches again.
+            grandparent = (parent - 1) // 2
+            sibling = parent + 1 if parent % 2 == 1 else parent - 1
+            normal = RotateVector(normals[parent], headings[grandparent], math.radians(random.uniform(0.0, 360.0)))
+            heading = RotateVector(headings[grandparent], normal, math.radians(random.uniform(branchAngleRange[0], branchAngleRange[1])))
+            end = ends[grandparent] + heading * segmentLengths[generation - 1]
+
+            if fits(ends[grandparent], end, clearances[parent], numPlaced, [grandparent, parent, sibling]):
+                ends[parent] = end
+                headings[parent] = heading
+                normals[parent] = normal
+                branches = bifurcation(parent, numPlaced)
+
+        normal, branchHeadings = branches
+        for branch, heading in zip((2 * parent + 1, 2 * parent + 2), branchHeadings):
+            starts[branch] = ends[parent]
+            ends[branch] = ends[parent] + heading * segmentLengths[generation]
+            headings[branch] = heading
+            normals[branch] = normal
+            clearances[branch] = radii[generation - 1]
+
+    def segment(cellId):
+        generation = (cellId + 1).bit_length() - 1
+        domain = float(domainLengths[0]) if cellId == 0 else (float(domainLengths[generation]), tuple(float(x) for x in headings[cellId]))
+
+        if generation == depth:
+            return [domain, None, None]
+        return [domain, segment(2 * cellId + 1), segment(2 * cellId + 2)]
+
+    return segment(0)
+
+# The radii builders, to be passed to GenerateCentreline.
+BuildDecreasingRadiiScalars = TreeCentreline.BuildDecreasingRadiiScalars
+BuildMurraysLawRadii = TreeCentreline.BuildMurraysLawRadii
+
+def PreviewCentreline(centreline):
+    if preview == None:
+        return
+
+    if preview not in ['show', 'png']:
+        raise ValueError("Unknown preview '%s', expected 'show', 'png' or None." % preview)
 
-    print("Writing output as", os.path.abspath(outputFileName))
-    writer = vtk.vtkPolyDataWriter()
-    writer.SetInputData(centreline)
-    writer.SetFileName(outputFileName)
-    writer.SetFileTypeToASCII()
-    writer.Write()
-    
     mapper = vtk.vtkDataSetMapper()
     mapper.SetInputData(centreline)
     
@@ -310,7 +530,29 @@ def GenerateCentreline(radiiBuilderFunction = None):
     
     rendererWindow = vtk.vtkRenderWindow()
     rendererWindow.AddRenderer(renderer)
-        
+
+    if preview == 'png':
+        fileName = previewFile
+        if fileName == None:
+            fileName = os.path.splitext(outputFileName)[0] + ".png"
+
+        rendererWindow.SetOffScreenRendering(1)
+        rendererWindow.SetSize(previewSize[0], previewSize[1])
+        rendererWindow.Render()
+
+        windowToImage = vtk.vtkWindowToImageFilter()
+        windowToImage.SetInput(rendererWindow)
+        windowToImage.Update()
+
+        pngWriter = vtk.vtkPNGWriter()
+        pngWriter.SetInputConnection(windowToImage.GetOutputPort())
+        pngWriter.SetFileName(fileName)
+        pngWriter.Write()
+
+        rendererWindow.Finalize()
+        print("Wrote centreline preview", os.path.abspath(fileName))
+        return
+
     interactor = vtk.vtkRenderWindowInteractor()
     style = vtk.vtkInteractorStyleTrackballCamera()
     interactor.SetInteractorStyle(style)
@@ -322,6 +564,31 @@ def GenerateCentreline(radiiBuilderFunction = None):
     rendererWindow.Finalize()
     interactor.TerminateApp()
 
+def GenerateCentreline(radiiBuilderFunction = None):
+    startTime = time.time()
+
+    generator = TreeCentreline(segmentList, branchAngle, scaling, step, radiusBase, sphereRadius)
+    centreline = generator.Generate(radiiBuilderFunction)
+
+    if checkCrossings:
+        crossings = generator.Crossings()
+        if crossings:
+            sys.exit("The centreline has %d crossing branches, e.g. cells %d and %d." % ((len(crossings),) + crossings[0]))
+        print("No crossing branches in the centreline.")
+
+    print("Writing output as", os.path.abspath(outputFileName))
+    writer = vtk.vtkPolyDataWriter()
+    writer.SetInputData(centreline)
+    writer.SetFileName(outputFileName)
+    writer.SetFileTypeToASCII()
+    writer.Write()
+
+    PreviewCentreline(centreline)
+
+    print("Generated centreline in %.2f seconds." % (time.time() - startTime))
+
+    return centreline
+
 def Usage():
     print("This script is to be run with global parameters (segment list, output file name, etc.) set in the calling script.")
 
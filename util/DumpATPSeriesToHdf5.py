@@ -2,11 +2,21 @@
 Reads in a number of .vtp ATP files and writes them to hdf5 files. Each time-step
 exists as a dataset within the hdf5 file for the particular branch of the input
 geometry.
+
+With perStepLayout unset the time-steps for each branch are stored as a single
+(time-steps, ECs) dataset "/atp" within the hdf5 file for that branch instead.
+The original step number of every row is kept in the "/timeIndex" dataset.
 """
 import h5py
 import os
+import numpy
 import vtk
 import glob
+import collections
+import concurrent.futures
+
+import MeshReordering
+import BranchTopology
 
 originalTimeStep = 0.01
 timeStep = 0.01
@@ -23,152 +33,197 @@ numSMCsPerCol = numECsPerCol * 13
 numECsPerQuad = numECsPerRow * numECsPerCol
 numSMCsPerQuad = numSMCsPerCol * numSMCsPerRow
 
-atpHdf5Files = [
-"files/parent_atp.h5",
-"files/left_daughter_atp.h5",
-"files/right_daughter_atp.h5",
-]
+# Write one dataset per time-step, named after its index. This is the layout the
+# coupled cells solver reads. With False a single time series dataset is written
+# per branch instead.
+perStepLayout = True
+
+# Number of time-steps gathered in memory before they are appended to the files.
+batchSize = 32
+
+# Number of time-steps stored in each chunk of the time series datasets.
+timeChunkSize = 32
+
+# Compression of the time series datasets: None, 'gzip' or 'lzf'.
+compression = None
+compressionLevel = 4
+
+# Number of worker processes parsing and reordering time-steps. With 0 or 1
+# the time-steps are read in this process.
+numWorkers = 0
+
+# Maximum number of time-steps being read ahead of the writer, this bounds the
+# memory used by the workers' results.
+maxInFlight = 16
+
+# H5 files to write, named after the branch of each label (see
+# BranchTopology.branchName).
+atpHdf5File = "files/%s_atp.h5"
+
+# Arguments for readTimeStep in the worker processes, set by initWorker.
+workerArgs = None
+
+def readTimeStep(atpFile, labelRange, numRingsPerLabel, permutations):
+    """ Read one ATP file and return the reordered ATP values for every label. """
+    atpMeshReader = vtk.vtkXMLPolyDataReader()
+    atpMeshReader.SetFileName(atpFile)
+    atpMeshReader.Update()
+
+    atpMesh = atpMeshReader.GetOutput()
+
+    reorderedATP = {}
+
+    # For every label in the range of labels we want to extract all ECs.
+    for label in labelRange:
+
+        # The permutation covers all ECs in the branch.
+        permutation = permutations[int(numRingsPerLabel[label])]
+        numECsPerLabel = permutation.shape[0]
+
+        # The ECs of the branch are a contiguous block of the ATP mesh.
+        _, _, cellData = MeshReordering.branchSlice(atpMesh, label, numECsPerLabel, ["ATP"])
+
+        # Gather the values with rings and rows of ECs in reverse order.
+        reorderedATP[label] = cellData["ATP"][permutation].astype(numpy.float32)
+
+    return reorderedATP
+
+def initWorker(labelRange, numRingsPerLabel, permutations):
+    global workerArgs
+    workerArgs = (labelRange, numRingsPerLabel, permutations)
+
+def readTimeStepWorker(atpFile):
+    return readTimeStep(atpFile, *workerArgs)
+
+def readTimeSteps(atpFileList, labelRange, numRingsPerLabel, permutations):
+    """ Yield the reordered ATP values of the given files in order, reading them
+        in a pool of numWorkers processes with at most maxInFlight files pending.
+    """
+    if numWorkers <= 1:
+        for atpFile in atpFileList:
+            yield readTimeStep(atpFile, labelRange, numRingsPerLabel, permutations)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(numWorkers, initializer=initWorker,
+                                                initargs=(labelRange, numRingsPerLabel, permutations)) as executor:
+        pending = collections.deque()
+        for atpFile in atpFileList:
+            if len(pending) >= max(1, maxInFlight):
+                yield pending.popleft().result()
+            pending.append(executor.submit(readTimeStepWorker, atpFile))
+
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+def createSeriesDataset(h5File, numECs):
+    """ Create an empty time series dataset to append time-steps to, and the
+        dataset of their original step numbers.
+    """
+    compressionOpts = None
+    if compression == 'gzip':
+        compressionOpts = compressionLevel
+
+    dset = h5File.create_dataset("/atp", (0, numECs), 'f', maxshape=(None, numECs),
+                                 chunks=(timeChunkSize, numECs),
+                                 compression=compression, compression_opts=compressionOpts)
+    indexDset = h5File.create_dataset("/timeIndex", (0,), 'i', maxshape=(None,),
+                                      chunks=(max(1, batchSize),))
+
+    return dset, indexDset
+
+def appendTimeSteps(dsets, batch, timeIndices):
+    """ Append a batch of time-steps to a time series dataset and their step
+        numbers to its time index dataset.
+    """
+    dset, indexDset = dsets
+
+    numSteps = dset.shape[0]
+    dset.resize(numSteps + len(batch), axis=0)
+    dset[numSteps:] = numpy.vstack(batch)
+
+    indexDset.resize(numSteps + len(timeIndices), axis=0)
+    indexDset[numSteps:] = numpy.array(timeIndices, dtype=numpy.int32)
 
 def writeHdf5():
-    
+
     if timeStep < 0.01:
         exit("Timestep is too small, choose 0.01 or larger")
-    
+
     # This is where the data is for testing purposes.
     print("Current working directory:", os.getcwd())
 
     numQuadsPerRing = circQuads
 
-    # Working with the task mesh junt to figure out the quads and rows numbers.
-    taskMeshReader = vtk.vtkXMLPolyDataReader()
-    taskMeshReader.SetFileName(taskMeshIn)
-    taskMeshReader.Update()
+    # Labels and number of rings of the branches, from the analysis saved with
+    # the task mesh. The task mesh is only read if the analysis is missing or stale.
+    topology = BranchTopology.branchTopology(taskMeshIn, numQuadsPerRing)
 
-    taskMesh = taskMeshReader.GetOutput()
+    labelRange = topology["labels"]
+    print("Labels found in task mesh:", labelRange)
 
-    # Get the range of branch labels.
-    labelRange = [0, 0]
-    taskMesh.GetCellData().GetScalars().GetRange(labelRange, 0)
+    # Store the number of rings for each label.
+    numRingsPerLabel = topology["numRings"]
 
-    # Convert label range to a list of labels.
-    labelRange = range(int(labelRange[0]), int(labelRange[1]) + 1)
-    print("Labels found in task mesh:", labelRange)
+    # Reordering permutations for each number of rings, from the permutation cache.
+    permutations = {}
+    for numRings in set(int(numRings) for numRings in numRingsPerLabel.values()):
+        permutations[numRings] = MeshReordering.loadPermutation(taskMeshIn, topology["topologyKey"], numRings, numQuadsPerRing, numECsPerCol, numECsPerRow)
 
-    # Store the number of rings for each label. 
-    numRingsPerLabel = {}   
+    atpFiles = sorted(glob.glob(atpMeshPattern))
 
-    # For every label in the range of labels we want to extract all cells/quads.
+    # The h5 file of every branch.
+    branchFiles = {}
     for label in labelRange:
-        
-        # Use this filter to extract the cells for a given label value.
-        branchSelector = vtk.vtkThreshold()
-        branchSelector.SetInputData(taskMesh)
-        branchSelector.ThresholdBetween(label,label);
-        branchSelector.Update()
-
-        taskMeshBranch = branchSelector.GetOutput()
-
-        numQuadRowsPerBranch = taskMeshBranch.GetNumberOfCells() / numQuadsPerRing;
-        numRingsPerLabel[label] = numQuadRowsPerBranch
-        
-    atpFiles = sorted(glob.glob(atpMeshPattern))
+        branchFiles[label] = h5py.File(atpHdf5File % BranchTopology.branchName(label), 'w')
+
+    # Time series datasets and the batches of time-steps waiting to be appended.
+    seriesDatasets = {}
+    batches = {}
+    batchIndices = []
+
+    if perStepLayout == False:
+        for label in labelRange:
+            numECsPerLabel = numQuadsPerRing * numRingsPerLabel[label] * numECsPerQuad
+            seriesDatasets[label] = createSeriesDataset(branchFiles[label], int(numECsPerLabel))
+            batches[label] = []
 
-    parentFile = h5py.File(atpHdf5Files[0], 'w')
-    leftBranchFile = h5py.File(atpHdf5Files[1], 'w')
-    rightBranchFile = h5py.File(atpHdf5Files[2], 'w')
-    
-    for atpIndex in range(0, len(atpFiles), int(timeStep / originalTimeStep)):
+    atpIndices = range(0, len(atpFiles), int(timeStep / originalTimeStep))
+
+    if numWorkers > 1:
+        print("Reading time-steps with", numWorkers, "worker processes ...")
+
+    timeSteps = readTimeSteps([atpFiles[atpIndex] for atpIndex in atpIndices], labelRange, numRingsPerLabel, permutations)
+
+    # The time-steps arrive in order, the writer is this process only.
+    for atpIndex, reorderedATP in zip(atpIndices, timeSteps):
         print("Time step" + str(atpIndex * timeStep))
-        print("Reading", atpFiles[atpIndex], "at index", atpIndex)
+        print("Read", atpFiles[atpIndex], "at index", atpIndex)
 
-        atpMeshReader = vtk.vtkXMLPolyDataReader()
-        atpMeshReader.SetFileName(atpFiles[atpIndex])
-        atpMeshReader.Update()
-    
-        atpMesh = atpMeshReader.GetOutput()
+        if perStepLayout == True:
+            for label in labelRange:
+                branchFiles[label].create_dataset("/" + str(atpIndex), data=reorderedATP[label])
+            continue
 
-        # For every label in the range of labels we want to extract all ECs.
         for label in labelRange:
-    
-            # Keep track of how many branches we need to skip.
-            numECsPerLabel = numQuadsPerRing * numRingsPerLabel[label] * numECsPerQuad
-            atpCellOffset = label * numECsPerLabel
-    
-            # Collect cell ids to select.
-            selectionIds = vtk.vtkIdTypeArray()
-            for sId in range(0, int(numECsPerLabel)):
-                selectionIds.InsertNextValue(int(atpCellOffset) + sId)
-    
-            # Create selecion node.
-            selectionNode = vtk.vtkSelectionNode()
-            selectionNode.SetFieldType(selectionNode.CELL)
-            selectionNode.SetContentType(selectionNode.INDICES)
-            selectionNode.SetSelectionList(selectionIds)
-    
-            # Create selection.
-            selection = vtk.vtkSelection()
-            selection.AddNode(selectionNode)
-    
-            # Use vtkSelection filter.
-            selectionExtractor = vtk.vtkExtractSelection()
-            selectionExtractor.SetInputData(0, atpMesh)
-            selectionExtractor.SetInputData(1, selection)
-            selectionExtractor.Update()
-    
-            extractedCells = selectionExtractor.GetOutput()
-
-            # Ring ids list for traversal.
-            ringIds = range(0, int(numRingsPerLabel[label]))
-            ringIds = list(ringIds)
-            ringIds.reverse()
-
-            # Number of ECs rows is the number of ECs per quad.
-            rowIds = range(0, numECsPerCol)
-            rowIds = list(rowIds)
-            rowIds.reverse()
-
-            # Decide which h5 files to write to.
-            pointsOf = ''
-            
-            if label == 0:
-                pointsOf = parentFile
-            elif label == 1:
-                pointsOf = leftBranchFile
-            elif label == 2:
-                pointsOf = rightBranchFile
-
-            dset = pointsOf.create_dataset("/" + str(atpIndex), (numECsPerLabel,), 'f')
-            i = 0
-    
-            # Iterate over the rings in reverse order.
-            for ringNum in ringIds:
-                # Iterate over the 'imaginary' quads of cells in normal order.
-                for quadNum in range(0, numQuadsPerRing):
-                    # Iterate over the rows of cells in reverse order.
-                    # Calculate the 'real' id for the 'imaginary' quad.
-                    quadId = ringNum * numQuadsPerRing + quadNum
-                    # Iterate over rows of cells in reverse order.
-                    for rowNum in rowIds:
-                        # Iterate over the rows of cells in normal order.
-                        for cellNum in range(0, numECsPerRow):
-                            # Calculate the 'real' ec cell id and get the corresponding cell.
-                            realId = quadId * numECsPerQuad + rowNum * numECsPerRow + cellNum
-
-                            atpVal = extractedCells.GetCellData().GetArray("ATP").GetValue(realId)
-
-                            # Insert the value into the dataset.
-                            dset[i] = atpVal
-                            i += 1
-    parentFile.close()
-    leftBranchFile.close()
-    rightBranchFile.close()
+            batches[label].append(reorderedATP[label])
+        batchIndices.append(atpIndex)
+
+        # Append the batch once it is full or there are no more time-steps.
+        if len(batchIndices) == batchSize or atpIndex == atpIndices[-1]:
+            for label in labelRange:
+                appendTimeSteps(seriesDatasets[label], batches[label], batchIndices)
+                batches[label] = []
+            batchIndices = []
+
+    for label in labelRange:
+        branchFiles[label].close()
 
     print("All done ...")
-    
+
 def main():
     print("This script is to be run with global parameters (input, output files, etc.) set in the calling script.")
 
 if __name__ == '__main__':
     print("Starting", os.path.basename(__file__))
     main()
-    print("Exiting", os.path.basename(__file__))
\ No newline at end of file
+    print("Exiting", os.path.basename(__file__))
@@ -10,7 +10,12 @@ VTK files are written out for visual verification.
 """
 import h5py
 import os
+import numpy
 import vtk
+from vtk.util import numpy_support
+
+import MeshReordering
+import BranchTopology
 
 taskMeshIn = ''
 ecMeshIn = ''
@@ -26,18 +31,12 @@ numSMCsPerCol = numECsPerCol * 13
 numECsPerQuad = numECsPerRow * numECsPerCol
 numSMCsPerQuad = numSMCsPerCol * numSMCsPerRow
 
-atpHdf5Files = [
-"files/parent_atp.h5",
-"files/left_daughter_atp.h5",
-"files/right_daughter_atp.h5",
-]
+# H5 files to write, named after the branch of each label (see
+# BranchTopology.branchName).
+atpHdf5File = "files/%s_atp.h5"
 
 # EC VTP files used for their geometry in visual verification of ATP mesh.
-ecVTPFiles = [
-"vtk/ec_mesh_parent.vtp",
-"vtk/ec_mesh_left_daughter.vtp",
-"vtk/ec_mesh_right_daughter.vtp",
-]
+ecVTPFile = "vtk/ec_mesh_%s.vtp"
 
 def writeHdf5():
     # This is where the data is for testing purposes.
@@ -46,14 +45,10 @@ def writeHdf5():
     
     numQuadsPerRing = circQuads
 
-    # Working with the task mesh junt to figure out the quads and rows numbers.
-    taskMeshReader = vtk.vtkXMLPolyDataReader()
-    taskMeshReader.SetFileName(taskMeshIn)
-    taskMeshReader.Update()
+    # Labels and number of rings of the branches, from the analysis saved with
+    # the task mesh. The task mesh is only read if the analysis is missing or stale.
+    topology = BranchTopology.branchTopology(taskMeshIn, numQuadsPerRing)
 
-    taskMesh = taskMeshReader.GetOutput()
-    print(taskMesh.GetNumberOfPoints())
-    
     ecMeshReader = vtk.vtkXMLPolyDataReader()
     ecMeshReader.SetFileName(ecMeshIn)
     ecMeshReader.Update()
@@ -61,30 +56,11 @@ def writeHdf5():
     ecMesh = ecMeshReader.GetOutput()
     print(ecMesh.GetNumberOfPoints())
     
-    # Get the range of branch labels.
-    labelRange = [0, 0]
-    taskMesh.GetCellData().GetScalars().GetRange(labelRange, 0)
-
-    # Convert label range to a list of labels.
-    labelRange = range(int(labelRange[0]), int(labelRange[1]) + 1)
+    labelRange = topology["labels"]
     print("Labels found in task mesh:", labelRange)
 
-    # Store the number of rings for each label. 
-    numRingsPerLabel = {}   
-
-    # For every label in the range of labels we want to extract all cells/quads.
-    for label in labelRange:
-        
-        # Use this filter to extract the cells for a given label value.
-        branchSelector = vtk.vtkThreshold()
-        branchSelector.SetInputData(taskMesh)
-        branchSelector.ThresholdBetween(label,label);
-        branchSelector.Update()
-
-        taskMeshBranch = branchSelector.GetOutput()
-
-        numQuadRowsPerBranch = taskMeshBranch.GetNumberOfCells() / numQuadsPerRing;
-        numRingsPerLabel[label] = numQuadRowsPerBranch
+    # Store the number of rings for each label.
+    numRingsPerLabel = topology["numRings"]
 
     # Working with EC mesh only
     atpMeshReader = vtk.vtkXMLPolyDataReader()
@@ -95,17 +71,16 @@ def writeHdf5():
     atpMesh = atpMeshReader.GetOutput()
     print("There are", atpMesh.GetNumberOfCells(), "ATP values in total ...")
 
-    parentFile = h5py.File(atpHdf5Files[0], 'w')
-    leftBranchFile = h5py.File(atpHdf5Files[1], 'w')
-    rightBranchFile = h5py.File(atpHdf5Files[2], 'w')
-    
     appendPolyData = vtk.vtkAppendPolyData();
 
+    # Reordering permutations for each number of rings, from the permutation cache.
+    permutations = {}
+
     # For every label in the range of labels we want to extract all ECs.
     for label in labelRange:
         
         ecMeshReader = vtk.vtkXMLPolyDataReader()
-        ecMeshReader.SetFileName(ecVTPFiles[label])
+        ecMeshReader.SetFileName(ecVTPFile % BranchTopology.branchName(label))
         ecMeshReader.Update()
         tmpPolyData = ecMeshReader.GetOutput()
 
@@ -115,89 +90,31 @@ def writeHdf5():
 
         print("atpCellOffset", atpCellOffset)
 
-        # Collect cell ids to select.
-        selectionIds = vtk.vtkIdTypeArray()
-        for sId in range(0, int(numECsPerLabel)):
-            selectionIds.InsertNextValue(int(atpCellOffset) + sId)
-
-        # Create selecion node.
-        selectionNode = vtk.vtkSelectionNode()
-        selectionNode.SetFieldType(selectionNode.CELL)
-        selectionNode.SetContentType(selectionNode.INDICES)
-        selectionNode.SetSelectionList(selectionIds)
-
-        # Create selection.
-        selection = vtk.vtkSelection()
-        selection.AddNode(selectionNode)
-
-        # Use vtkSelection filter.
-        selectionExtractor = vtk.vtkExtractSelection()
-        selectionExtractor.SetInputData(0, atpMesh)
-        selectionExtractor.SetInputData(1, selection)
-        selectionExtractor.Update()
-
-        extractedCells = selectionExtractor.GetOutput()
-
-        # Ring ids list for traversal.
-        ringIds = range(0, int(numRingsPerLabel[label]))
-        ringIds = list(ringIds)
-        ringIds.reverse()
-
-        # Number of ECs rows is the number of ECs per quad.
-        rowIds = range(0, numECsPerCol)
-        rowIds = list(rowIds)
-        rowIds.reverse()
-        
-        reorderedATPArray = vtk.vtkDoubleArray()
-        reorderedATPArray.SetName("initialATP")
+        # The ECs of the branch are a contiguous block of the ATP mesh.
+        _, _, cellData = MeshReordering.branchSlice(atpMesh, label, numECsPerLabel, ["initialATP"])
+        atpValues = cellData["initialATP"]
 
-        # Decide which TXT files to write to.
-        pointsOf = ''
-        
-        if label == 0:
-            pointsOf = parentFile
-        elif label == 1:
-            pointsOf = leftBranchFile
-        elif label == 2:
-            pointsOf = rightBranchFile
+        # Gather the ATP values in the order the legacy code expects: rings and
+        # rows of ECs in reverse order.
+        numRings = int(numRingsPerLabel[label])
+        if numRings not in permutations:
+            permutations[numRings] = MeshReordering.loadPermutation(taskMeshIn, topology["topologyKey"], numRings, numQuadsPerRing, numECsPerCol, numECsPerRow)
+        reorderedATP = atpValues[permutations[numRings]]
+
+        # The H5 file of the branch.
+        pointsOf = h5py.File(atpHdf5File % BranchTopology.branchName(label), 'w')
 
         print("Writing H5 file for ECs ATP:")
         print(pointsOf)
-        dset = pointsOf.create_dataset("/atp", (numECsPerLabel,), 'f')
-        
-        i = 0
-
-        # Iterate over the rings in reverse order.
-        for ringNum in ringIds:
-            # Iterate over the 'imaginary' quads of cells in normal order.
-            for quadNum in range(0, numQuadsPerRing):
-                # Iterate over the rows of cells in reverse order.
-                # Calculate the 'real' id for the 'imaginary' quad.
-                quadId = ringNum * numQuadsPerRing + quadNum
-                # Iterate over rows of cells in reverse order.
-                for rowNum in rowIds:
-                    # Iterate over the rows of cells in normal order.
-                    for cellNum in range(0, numECsPerRow):
-                        # Calculate the 'real' ec cell id and get the corresponding cell.
-                        realId = quadId * numECsPerQuad + rowNum * numECsPerRow + cellNum
-                        
-                        atpVal = extractedCells.GetCellData().GetArray("initialATP").GetValue(realId)
-                        
-                        reorderedATPArray.InsertNextValue(atpVal)
-                        
-
-                        # Write the value to the txt file.
-                        dset[i] = atpVal
-                        i += 1
-        
+        pointsOf.create_dataset("/atp", data=reorderedATP.astype(numpy.float32))
+        pointsOf.close()
+
+        reorderedATPArray = numpy_support.numpy_to_vtk(reorderedATP.astype(numpy.float64), deep=True)
+        reorderedATPArray.SetName("initialATP")
+
         tmpPolyData.GetCellData().SetScalars(reorderedATPArray)
         appendPolyData.AddInputData(tmpPolyData)
-                        
 
-    parentFile.close()
-    leftBranchFile.close()
-    rightBranchFile.close()
-    
     print("Writing reorderd ATP map for verification...")
     appendPolyData.Update()
     reorderedATPWriter = vtk.vtkXMLPolyDataWriter()
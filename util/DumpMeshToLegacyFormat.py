@@ -8,12 +8,22 @@ legacy Coupled Cells code.
 The code reorders cells and produces the required files in TXT format.
 VTK files are written out for visual verification.
 
-This code assumes there are three branches (parent and two daughters) in the data.
+Every branch label in the task mesh is exported, with file names taken from
+the branch names in BranchTopology.
 
 """
 
 import os
+import numpy
+import collections
+import itertools
+import concurrent.futures
 import vtk
+from vtk.util import numpy_support
+
+import MeshReordering
+import BranchTopology
+import MeshContainer
 
 numECsPerCol = 4
 numSMCsPerRow = 4
@@ -27,103 +37,302 @@ numSMCsPerQuad = numSMCsPerCol * numSMCsPerRow
 numQuadsPerRing = 0
 meshSet = []
 
-# VTK files to write.
-taskVTKFiles = [
-"vtk/parent.vtp",
-"vtk/left_daughter.vtp",
-"vtk/right_daughter.vtp",
-]
-
-ecCentroidVTKFiles = [
-"vtk/ec_centeroid_parent.vtp",
-"vtk/ec_centeroid_left_daughter.vtp",
-"vtk/ec_centeroid_right_daughter.vtp",
-]
-
-ecVTKFiles = [
-"vtk/ec_mesh_parent.vtp",
-"vtk/ec_mesh_left_daughter.vtp",
-"vtk/ec_mesh_right_daughter.vtp",
-]
-
-smcVTKFiles = [
-"vtk/smc_mesh_parent.vtp",
-"vtk/smc_mesh_left_daughter.vtp",
-"vtk/smc_mesh_right_daughter.vtp"
+# Reordering engine: 'numpy' computes the reordering as index arrays in one go,
+# 'loop' uses the original cell by cell traversal.
+reorderingEngine = 'numpy'
+
+# Run the original loop as well and check the output is byte-identical.
+verifyReordering = False
+
+# VTK files to write, named after the branch of each label (see
+# BranchTopology.branchName).
+taskVTKFile = "vtk/%s.vtp"
+ecCentroidVTKFile = "vtk/ec_centeroid_%s.vtp"
+ecVTKFile = "vtk/ec_mesh_%s.vtp"
+smcVTKFile = "vtk/smc_mesh_%s.vtp"
+
+# Stream the reordered SMC mesh of each branch to its output one ring of quads
+# at a time, instead of building the whole reordered branch in memory. The
+# .vtp files then hold one piece per ring. Uses the NumPy reordering.
+streamSMCs = False
+
+# Also write the meshes of each branch to a binary container for the solver:
+# None, 'hdf5' or 'raw' (little-endian, see MeshContainer).
+binaryFormat = None
+
+# Binary container to write, named after the branch of each label. The .h5 or
+# .bin extension is added for the container format.
+binaryFile = "files/%s_mesh"
+
+# Number of worker processes exporting branches concurrently. With 0 or 1 the
+# branches are exported one after another in this process. Every worker reads
+# the task, EC and SMC meshes once.
+numWorkers = 0
+
+# Module globals set by the calling script, handed on to the worker processes.
+workerSettingNames = [
+"numECsPerCol", "numSMCsPerRow", "numECsPerRow", "numSMCsPerCol",
+"numECsPerQuad", "numSMCsPerQuad", "numQuadsPerRing", "meshSet",
+"reorderingEngine", "verifyReordering",
+"taskVTKFile", "ecCentroidVTKFile", "ecVTKFile", "smcVTKFile",
+"binaryFormat", "binaryFile", "streamSMCs",
 ]
 
-def writeLegacyVTK():
-    # This is where the data is for testing purposes.
-    print("Current working directory:", os.getcwd())
-    
-    if os.path.isdir("vtk") == False:
-        os.makedirs("vtk")
-        print("Cretated vtk output directory...")
-    
-    if os.path.isdir("files") == False:
-        os.makedirs("files")
-        print("Created files ouptut directory...")
-        
-
-    # Working with the task mesh.
-    taskMeshReader = vtk.vtkXMLPolyDataReader()
-    taskMeshReader.SetFileName(meshSet[0])
-    taskMeshReader.Update()
-
-    taskMesh = taskMeshReader.GetOutput()
-
-    # Get the range of branch labels.
-    labelRange = [0, 0]
+# Meshes read by this process, by file name.
+meshCache = {}
+
+def reorderTaskBranch(taskMesh, cellRange, numRings, permutation):
+    """ Reorder the quads of a task mesh branch: rings in reverse order, with shared vertices.
+    The branch is the cell range [begin, end) of the task mesh and the permutation
+    lists the branch cells in reversed ring order.
+    """
+    cellOffset = cellRange[0]
+
+    if reorderingEngine == 'loop':
+        return reorderTaskBranchLoop(taskMesh, cellOffset, numRings)
+
+    points = numpy_support.vtk_to_numpy(taskMesh.GetPoints().GetData())
+    quads = MeshReordering.quadConnectivity(taskMesh.GetPolys())[cellRange[0]:cellRange[1]]
+
+    # The whole branch is a single block of rings by quads.
+    newPoints, newQuads = MeshReordering.reorderBlocks(points, quads, permutation, 1, numRings, numQuadsPerRing)
+    reorderedMesh = MeshReordering.quadsToPolyData(newPoints, newQuads)
+
+    if verifyReordering == True:
+        MeshReordering.assertIdentical(reorderedMesh, reorderTaskBranchLoop(taskMesh, cellOffset, numRings), "task mesh branch")
+
+    return reorderedMesh
+
+def reorderCells(mesh, label, numRings, numRowsPerQuad, numCellsPerRow, permutation):
+    """ Reorder the EC/SMC cells of a branch: rings and rows of cells in reverse
+    order, with shared vertices within each quad. The permutation lists the
+    branch cells in that order.
+    """
+    numCellsPerLabel = numQuadsPerRing * numRings * numRowsPerQuad * numCellsPerRow
+    cellOffset = label * numCellsPerLabel
+
+    print("cellOffset", cellOffset)
+
+    if reorderingEngine == 'loop':
+        return reorderCellsLoop(mesh, cellOffset, numRings, numRowsPerQuad, numCellsPerRow)
+
+    # The cells of the branch are a contiguous block of the mesh.
+    points, quads, _ = MeshReordering.branchSlice(mesh, label, numCellsPerLabel)
+
+    # Each quad of the task mesh is a block of rows by cells.
+    newPoints, newQuads = MeshReordering.reorderBlocks(points, quads, permutation,
+                                                       numRings * numQuadsPerRing, numRowsPerQuad, numCellsPerRow)
+    reorderedMesh = MeshReordering.quadsToPolyData(newPoints, newQuads)
+
+    if verifyReordering == True:
+        MeshReordering.assertIdentical(reorderedMesh,
+                                       reorderCellsLoop(mesh, cellOffset, numRings, numRowsPerQuad, numCellsPerRow),
+                                       "EC/SMC mesh branch")
+
+    return reorderedMesh
+
+def streamCells(mesh, label, numRings, numRowsPerQuad, numCellsPerRow, permutation, fileName):
+    """ Reorder the EC/SMC cells of a branch as reorderCells does and write them
+    to fileName one ring of quads at a time, one piece per ring. Returns the
+    stream source, which can produce the reordered rings again.
+    """
+    numCellsPerLabel = numQuadsPerRing * numRings * numRowsPerQuad * numCellsPerRow
+
+    # The cells of the branch are a contiguous block of the mesh, no copies are made.
+    points, quads, _ = MeshReordering.branchSlice(mesh, label, numCellsPerLabel)
+    ringSource = MeshReordering.RingStreamSource(points, quads, permutation, numQuadsPerRing, numRowsPerQuad, numCellsPerRow)
+
+    # The writer requests and writes the pieces one after another.
+    meshWriter = vtk.vtkXMLPolyDataWriter()
+    meshWriter.SetInputConnection(ringSource.GetOutputPort())
+    meshWriter.SetNumberOfPieces(numRings)
+    meshWriter.SetFileName(fileName)
+    meshWriter.Write()
+
+    return ringSource
+
+def reorderTaskBranchLoop(taskMesh, cellOffset, numRings):
+    """ Reference implementation of the task mesh branch reordering. """
+    # New vtkPoints for storing reordered points.
+    reorderedPoints = vtk.vtkPoints()
+
+    # New vtkCellArray for storing reordeced cells.
+    reorderedCellArray = vtk.vtkCellArray()
+    # Working with rows in reverse order: UPSTREAM.
+    ringIds = range(0, numRings)
+    ringIds = list(ringIds)
+    ringIds.reverse()
+
+    rowBase = 0
+    # Iterate over the rings in reverse order.
+    for ringNum in ringIds:
+        # print("ringNum", ringNum)
+        # Iterate over the cells in normal order.
+        for cellNum in range(0, int(numQuadsPerRing)):
+            # Calculate the 'real' cell id and get the corresponding cell.
+            cellId = ringNum * numQuadsPerRing + cellNum
+            cell = taskMesh.GetCell(cellOffset + cellId)
+
+            # The ids to be written to the TXT file.
+            pointIdList = [cell.GetNumberOfPoints()]
+
+            # Write the appropriate points to TXT file.
+            for pPos in range(0, cell.GetNumberOfPoints()):
+                newPoint = False
+                if ringNum == ringIds[0]:
+                    if cellNum == 0:
+                        newPoint = True
+                    elif pPos == 1 or pPos == 2:
+                        newPoint = True
+                else:
+                    if cellNum == 0:
+                        if pPos == 0 or pPos == 1:
+                            newPoint = True
+                    else:
+                        if pPos == 1:
+                            newPoint = True
 
-    taskMesh.GetCellData().GetScalars().GetRange(labelRange, 0)
+                if newPoint == True:
 
-    # Convert label range to a list of labels.
-    labelRange = range(int(labelRange[0]), int(labelRange[1]) + 1)
-    print("Labels found in task mesh:", labelRange)
+                    # Inserting a new point...
+                    point = taskMesh.GetPoint(cell.GetPointId(pPos))
+                    # ... with a new id.
+                    newId = reorderedPoints.InsertNextPoint(point)
+                    pointIdList.append(newId)
 
-
-    # Store the number of rings for each label. 
-    numRingsPerLabel = {}
-
-    # For every label in the range of labels we want to extract all cells/quads.
-    for label in labelRange:
-        # Use this filter to extract the cells for a given label value.
-        branchSelector = vtk.vtkThreshold()
-        branchSelector.SetInputData(taskMesh)
-        branchSelector.ThresholdBetween(label,label);
-        branchSelector.Update()
-
-        taskMeshBranch = branchSelector.GetOutput()
-
-        # New vtkPoints for storing reordered points.
-        reorderedPoints = vtk.vtkPoints()
-
-        # New vtkCellArray for storing reordeced cells.
-        reorderedCellArray = vtk.vtkCellArray()
-        numQuadRowsPerBranch = taskMeshBranch.GetNumberOfCells() / numQuadsPerRing;
-        numRingsPerLabel[label] = numQuadRowsPerBranch
-        # Working with rows in reverse order: UPSTREAM.
-        ringIds = range(0, int(numQuadRowsPerBranch))
-        ringIds = list(ringIds)
-        ringIds.reverse()
-
-        rowBase = 0
-        # Iterate over the rings in reverse order.
-        for ringNum in ringIds:
-            # print("ringNum", ringNum)
-            # Iterate over the cells in normal order.
-            for cellNum in range(0, int(numQuadsPerRing)):
+                    # To make it easier for remembering the number of points instered in a row.
+                    if cellNum == 0 and pPos == 0:
+                        rowBasePrev = newId
+                else:
+                    # Perhaps this can be done in a nicer way.
+                    # Calculate the id of a previously inserted point.
+                    if ringNum == ringIds[0]:
+                        if cellNum == 1:
+                            if pPos == 0:
+                                pointIdList.append(1)
+                            elif pPos == 3:
+                                pointIdList.append(2)
+                        else:
+                            if pPos == 0:
+                                pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 2))
+                            elif pPos == 3:
+                                pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 3))
+                    elif ringNum == ringIds[1]:
+                        if cellNum == 0:
+                            if pPos == 2:
+                                pointIdList.append(1)
+                            elif pPos == 3:
+                                pointIdList.append(0)
+                        else:
+                            if pPos == 0:
+                                pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 1))
+                            elif pPos == 2:
+                                pointIdList.append(int(cellNum * 2 + 2))
+                            elif pPos == 3:
+                                if cellNum == 1:
+                                    pointIdList.append(1)
+                                else:
+                                    pointIdList.append(int(cellNum * 2))
+                    else:
+                        if cellNum == 0:
+                            if pPos == 2:
+                                pointIdList.append(int(rowBase + 1))
+                            elif pPos == 3:
+                                pointIdList.append(int(rowBase))
+                        else:
+                            if pPos == 0:
+                                pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 1))
+                            elif pPos == 2:
+                                pointIdList.append(int(rowBase + cellNum + 1))
+                            elif pPos == 3:
+                                pointIdList.append(int(rowBase + cellNum))
+
+            # print(pointIdList, rowBase)
+
+            # Insert the ids into the cell array.
+            newCell = vtk.vtkQuad()
+            newCell.GetPointIds().Reset()
+            for id in pointIdList[1:]:
+                newCell.GetPointIds().InsertNextId(id)
+            reorderedCellArray.InsertNextCell(newCell)
+
+        rowBase = rowBasePrev
+
+    # Create new vtkPolyData object for the new reordered mesh.
+    reorderedMesh = vtk.vtkPolyData()
+
+    # Put the reordered points and cells into the reordered mesh.
+    reorderedMesh.SetPoints(reorderedPoints)
+    reorderedMesh.SetPolys(reorderedCellArray)
+
+    return reorderedMesh
+
+def reorderCellsLoop(mesh, cellOffset, numRings, numRowsPerQuad, numCellsPerRow):
+    """ Reference implementation of the EC/SMC mesh branch reordering. """
+    numCellsPerQuad = numRowsPerQuad * numCellsPerRow
+
+    # Ring ids list for traversal.
+    ringIds = range(0, numRings)
+    ringIds = list(ringIds)
+    ringIds.reverse()
+
+    # Number of rows of cells in each quad.
+    rowIds = range(0, numRowsPerQuad)
+    rowIds = list(rowIds)
+    rowIds.reverse()
+
+    # The cells are organised in rings of blocks of cells.
+    # New vtkCellArray for storing reordeced cells.
+    reorderedCellArray = vtk.vtkCellArray()
+
+    # Iterate over the rings in reverse order.
+    for ringNum in ringIds:
+        # Iterate over the 'imaginary' quads of cells in normal order.
+        for quadNum in range(0, numQuadsPerRing):
+            # Iterate over the rows of cells in reverse order.
+            # Calculate the 'real' id for the 'imaginary' quad.
+            quadId = ringNum * numQuadsPerRing + quadNum
+            # Iterate over rows of cells in reverse order.
+            for rowNum in rowIds:
+                # Iterate over the rows of cells in normal order.
+                for cellNum in range(0, numCellsPerRow):
+                    # Calculate the 'real' cell id and get the corresponding cell.
+                    cellId = quadId * numCellsPerQuad + rowNum * numCellsPerRow + cellNum
+                    cell = mesh.GetCell(cellOffset + cellId)
+                    reorderedCellArray.InsertNextCell(cell)
+
+    # Create new vtkPolyData object for the new reordered mesh.
+    reorderedMeshBranch = vtk.vtkPolyData()
+
+    # Insert our new points.
+    reorderedMeshBranch.SetPoints(mesh.GetPoints())
+
+    # Set the reordered cells to the reordered cells mesh.
+    reorderedMeshBranch.SetPolys(reorderedCellArray)
+
+    # New vtkPoints for storing reordered points.
+    reorderedPoints = vtk.vtkPoints()
+
+    # New vtkCellArray for storing reordeced cells.
+    reorderedCellArray = vtk.vtkCellArray()
+
+    rowBase = 0
+    # Iterate over quads in normal order because they have been reordered.
+    for quadNum in range(0, numRings * numQuadsPerRing):
+        # Iterate over rows in normal order because they have been reordered.
+        for rowNum in range(0, numRowsPerQuad):
+            # Iterate over the cells in the row in normal order.
+            for cellNum in range(0, numCellsPerRow):
                 # Calculate the 'real' cell id and get the corresponding cell.
-                cellId = ringNum * numQuadsPerRing + cellNum
-                cell = taskMeshBranch.GetCell(cellId)
-
+                cellId = quadNum * numCellsPerQuad + rowNum * numCellsPerRow + cellNum
+                cell = reorderedMeshBranch.GetCell(cellId)
                 # The ids to be written to the TXT file.
                 pointIdList = [cell.GetNumberOfPoints()]
 
-                # Write the appropriate points to TXT file.
+                # Write the appropriate points to the TXT file.
                 for pPos in range(0, cell.GetNumberOfPoints()):
                     newPoint = False
-                    if ringNum == ringIds[0]:
+                    if rowNum == 0:
                         if cellNum == 0:
                             newPoint = True
                         elif pPos == 1 or pPos == 2:
@@ -139,44 +348,44 @@ def writeLegacyVTK():
                     if newPoint == True:
 
                         # Inserting a new point...
-                        point = taskMeshBranch.GetPoint(cell.GetPointId(pPos))
+                        point = reorderedMeshBranch.GetPoint(cell.GetPointId(pPos))
                         # ... with a new id.
                         newId = reorderedPoints.InsertNextPoint(point)
                         pointIdList.append(newId)
 
-                        # To make it easier for remembering the number of points instered in a row.
+
                         if cellNum == 0 and pPos == 0:
                             rowBasePrev = newId
                     else:
                         # Perhaps this can be done in a nicer way.
-                        # Calculate the id of a previously inserted point.
-                        if ringNum == ringIds[0]:
+                        # Calculate the ide of a previously inserted point.
+                        if rowNum == 0:
                             if cellNum == 1:
                                 if pPos == 0:
-                                    pointIdList.append(1)
+                                    pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 3))
                                 elif pPos == 3:
-                                    pointIdList.append(2)
+                                    pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 4))
                             else:
                                 if pPos == 0:
                                     pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 2))
                                 elif pPos == 3:
                                     pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 3))
-                        elif ringNum == ringIds[1]:
+                        elif rowNum == 1:
                             if cellNum == 0:
                                 if pPos == 2:
-                                    pointIdList.append(1)
+                                    pointIdList.append(int(rowBase + 1))
                                 elif pPos == 3:
-                                    pointIdList.append(0)
+                                    pointIdList.append(int(rowBase))
                             else:
                                 if pPos == 0:
                                     pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 1))
                                 elif pPos == 2:
-                                    pointIdList.append(int(cellNum * 2 + 2))
+                                    pointIdList.append(int(rowBase + cellNum * 2 + 2))
                                 elif pPos == 3:
                                     if cellNum == 1:
-                                        pointIdList.append(1)
+                                        pointIdList.append(int(rowBase + 1))
                                     else:
-                                        pointIdList.append(int(cellNum * 2))
+                                        pointIdList.append(int(rowBase + cellNum * 2))
                         else:
                             if cellNum == 0:
                                 if pPos == 2:
@@ -202,461 +411,237 @@ def writeLegacyVTK():
 
             rowBase = rowBasePrev
 
-        # print('\n')
-        print("Inserted", reorderedPoints.GetNumberOfPoints(), "task mesh points for label", label, "...")
-        print("Inserted", reorderedCellArray.GetNumberOfCells(), "task mesh cells for label", label, "...")
+    # Create new vtkPolyData object for the new reordered mesh.
+    reorderedMesh = vtk.vtkPolyData()
 
-        # Create new vtkPolyData object for the new reordered mesh.
-        reorderedTaskMeshBranch = vtk.vtkPolyData()
+    # Put the reordered points and cells into the reordered mesh.
+    reorderedMesh.SetPoints(reorderedPoints)
+    reorderedMesh.SetPolys(reorderedCellArray)
 
-        # Put the reordered points and cells into the reordered mesh.
-        reorderedTaskMeshBranch.SetPoints(reorderedPoints)
-        reorderedTaskMeshBranch.SetPolys(reorderedCellArray)
+    return reorderedMesh
 
-        # Write the VTK file.
-        reorderedMeshWriter = vtk.vtkXMLPolyDataWriter()
-        reorderedMeshWriter.SetInputData(reorderedTaskMeshBranch)
-        reorderedMeshWriter.SetFileName(taskVTKFiles[label])
-        reorderedMeshWriter.Update()
+def readMesh(fileName):
+    """ Read a mesh once per process. """
+    if fileName not in meshCache:
+        meshReader = vtk.vtkXMLPolyDataReader()
+        meshReader.SetFileName(fileName)
+        meshReader.Update()
+        meshCache[fileName] = meshReader.GetOutput()
 
-    print("Rings per label:", numRingsPerLabel, "...")
-    ringsPerLabelVals = numRingsPerLabel.values()
+    return meshCache[fileName]
 
-    # Check all rings per label values are the same.
-    # assert ringsPerLabelVals[1:] == ringsPerLabelVals[:-1], "All values of rings per label must be identical. Generated output is invalid ..."
-    print(ringsPerLabelVals)
+def writeMesh(mesh, fileName):
+    meshWriter = vtk.vtkXMLPolyDataWriter()
+    meshWriter.SetInputData(mesh)
+    meshWriter.SetFileName(fileName)
+    meshWriter.Update()
 
-    # Working with EC mesh.
-
-    ecMeshReader = vtk.vtkXMLPolyDataReader()
-    ecMeshReader.SetFileName(meshSet[1])
-    ecMeshReader.Update()
-
-    # Original ECs mesh to work with.
-    ecMesh = ecMeshReader.GetOutput()
-    print("There are", ecMesh.GetNumberOfCells(), "ECs in total ...")
-
-    # For every label in the range of labels we want to extract all ECs.
-    for label in labelRange:
-
-        # Keep track of how many branches we need to skip.
-        numECsPerLabel = numQuadsPerRing * numRingsPerLabel[label] * numECsPerQuad
-        ecCellOffset = label * numECsPerLabel
-
-        print("ecCellOffset", ecCellOffset)
-
-        # Collect cell ids to select.
-        selectionIds = vtk.vtkIdTypeArray()
-        for sId in range(0, int(numECsPerLabel)):
-            selectionIds.InsertNextValue(int(ecCellOffset) + sId)
-
-        # Create selecion node.
-        selectionNode = vtk.vtkSelectionNode()
-        selectionNode.SetFieldType(selectionNode.CELL)
-        selectionNode.SetContentType(selectionNode.INDICES)
-        selectionNode.SetSelectionList(selectionIds)
-
-        # Create selection.
-        selection = vtk.vtkSelection()
-        selection.AddNode(selectionNode)
-
-        # Use vtkSelection filter.
-        selectionExtractor = vtk.vtkExtractSelection()
-        selectionExtractor.SetInputData(0, ecMesh)
-        selectionExtractor.SetInputData(1, selection)
-        selectionExtractor.Update()
-
-        extractedECs = selectionExtractor.GetOutput()
-
-        # Ring ids list for traversal.
-        ringIds = range(0, int(numRingsPerLabel[label]))
-        ringIds = list(ringIds)
-        ringIds.reverse()
-
-        # Number of ECs rows is the number of ECs per quad.
-        rowIds = range(0, numECsPerCol)
-        rowIds = list(rowIds)
-        rowIds.reverse()
-
-        # The ECs are organised in rings of blocks of cells.
-        # New vtkCellArray for storing reordeced cells.
-        reorderedCellArray = vtk.vtkCellArray()
-
-        # Iterate over the rings in reverse order.
-        for ringNum in ringIds:
-            # Iterate over the 'imaginary' quads of cells in normal order.
-            for quadNum in range(0, numQuadsPerRing):
-                # Iterate over the rows of cells in reverse order.
-                # Calculate the 'real' id for the 'imaginary' quad.
-                quadId = ringNum * numQuadsPerRing + quadNum
-                # Iterate over rows of cells in reverse order.
-                for rowNum in rowIds:
-                    # Iterate over the rows of cells in normal order.
-                    for ecNum in range(0, numECsPerRow):
-                        # Calculate the 'real' ec cell id and get the corresponding cell.
-                        ecId = quadId * numECsPerQuad + rowNum * numECsPerRow + ecNum
-                        ecCell = extractedECs.GetCell(ecId)
-                        reorderedCellArray.InsertNextCell(ecCell)
-
-        # Create new vtkPolyData object for the new reordered mesh.
-        reorderedECMeshBranch = vtk.vtkPolyData()
-
-        # Insert our new points.
-        reorderedECMeshBranch.SetPoints(extractedECs.GetPoints())
-
-        # Set the reordered cells to the reordered ECs mesh.
-        reorderedECMeshBranch.SetPolys(reorderedCellArray)
-
-        # New vtkPoints for storing reordered points.
-        reorderedPoints = vtk.vtkPoints()
-
-        # New vtkCellArray for storing reordeced cells.
-        reorderedCellArray = vtk.vtkCellArray()
-
-        rowBase = 0
-        # Iterate over quads in normal order because they have been reordered.
-        for quadNum in range(0, int(numRingsPerLabel[label]) * numQuadsPerRing):
-            # Iterate over rows in normal order because they have been reordered.
-            for rowNum in range(0, numECsPerCol):
-                # Iterate over the ECs in the row in normal order.
-                for ecNum in range(0, numECsPerRow):
-                    # Calculate the 'real' ec cell id and get the corresponding cell.
-                    ecId = quadNum * numECsPerQuad + rowNum * numECsPerRow + ecNum
-                    ecCell = reorderedECMeshBranch.GetCell(ecId)
-                    # The ids to be written to the TXT file.
-                    pointIdList = [ecCell.GetNumberOfPoints()]
-
-                    # Write the appropriate points to the TXT file.
-                    for pPos in range(0, ecCell.GetNumberOfPoints()):
-                        newPoint = False
-                        if rowNum == 0:
-                            if ecNum == 0:
-                                newPoint = True
-                            elif pPos == 1 or pPos == 2:
-                                newPoint = True
-                        else:
-                            if ecNum == 0:
-                                if pPos == 0 or pPos == 1:
-                                    newPoint = True
-                            else:
-                                if pPos == 1:
-                                    newPoint = True
+def exportBranch(label, topology):
+    """ Reorder and write the task, EC, EC centroid and SMC meshes of one branch.
+    Branches share no state, so they can be exported in any order. Returns the
+    progress messages for the branch.
+    """
+    name = BranchTopology.branchName(label)
+    numRings = topology["numRings"][label]
+    messages = []
 
-                        if newPoint == True:
+    # Reorder the quads, rings are traversed in reverse order: UPSTREAM.
+    permutation = MeshReordering.loadPermutation(meshSet[0], topology["topologyKey"], numRings, numQuadsPerRing)
+    reorderedTaskMeshBranch = reorderTaskBranch(readMesh(meshSet[0]), topology["cellRanges"][label], numRings, permutation)
 
-                            # Inserting a new point...
-                            point = reorderedECMeshBranch.GetPoint(ecCell.GetPointId(pPos))
-                            # ... with a new id.
-                            newId = reorderedPoints.InsertNextPoint(point)
-                            pointIdList.append(newId)
+    messages.append("Inserted %d task mesh points for label %d ..." % (reorderedTaskMeshBranch.GetNumberOfPoints(), label))
+    messages.append("Inserted %d task mesh cells for label %d ..." % (reorderedTaskMeshBranch.GetNumberOfCells(), label))
 
+    # Write the VTK file.
+    writeMesh(reorderedTaskMeshBranch, taskVTKFile % name)
 
-                            if ecNum == 0 and pPos == 0:
-                                rowBasePrev = newId
-                        else:
-                            # Perhaps this can be done in a nicer way.
-                            # Calculate the ide of a previously inserted point.
-                            if rowNum == 0:
-                                if ecNum == 1:
-                                    if pPos == 0:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 3))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 4))
-                                else:
-                                    if pPos == 0:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 2))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 3))
-                            elif rowNum == 1:
-                                if ecNum == 0:
-                                    if pPos == 2:
-                                        pointIdList.append(int(rowBase + 1))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(rowBase))
-                                else:
-                                    if pPos == 0:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 1))
-                                    elif pPos == 2:
-                                        pointIdList.append(int(rowBase + ecNum * 2 + 2))
-                                    elif pPos == 3:
-                                        if ecNum == 1:
-                                            pointIdList.append(int(rowBase + 1))
-                                        else:
-                                            pointIdList.append(int(rowBase + ecNum * 2))
-                            else:
-                                if ecNum == 0:
-                                    if pPos == 2:
-                                        pointIdList.append(int(rowBase + 1))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(rowBase))
-                                else:
-                                    if pPos == 0:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 1))
-                                    elif pPos == 2:
-                                        pointIdList.append(int(rowBase + ecNum + 1))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(rowBase + ecNum))
+    # Reorder the ECs and build the shared-vertex mesh for the branch.
+    permutation = MeshReordering.loadPermutation(meshSet[0], topology["topologyKey"], numRings, numQuadsPerRing, numECsPerCol, numECsPerRow)
+    reorderedECs = reorderCells(readMesh(meshSet[1]), label, numRings, numECsPerCol, numECsPerRow, permutation)
 
-                    # print(pointIdList, rowBase)
-
-                    # Insert the ids into the cell array.
-                    newCell = vtk.vtkQuad()
-                    newCell.GetPointIds().Reset()
-                    for id in pointIdList[1:]:
-                        newCell.GetPointIds().InsertNextId(id)
-                    reorderedCellArray.InsertNextCell(newCell)
-
-                rowBase = rowBasePrev
+    messages.append("There are %d ECs points for label %d ..." % (reorderedECs.GetNumberOfPoints(), label))
+    messages.append("There are %d ECs cells for label %d ..." % (reorderedECs.GetNumberOfCells(), label))
 
-        # print('\n')
-        print("There are", reorderedPoints.GetNumberOfPoints(), "ECs points for label", label, "...")
-        print("There are", reorderedCellArray.GetNumberOfCells(), "ECs cells for label", label, "...")
+    # Write the VTK EC mesh file.
+    writeMesh(reorderedECs, ecVTKFile % name)
 
-        # Create new vtkPolyData object for the new reordered mesh.
-        reorderedECs = vtk.vtkPolyData()
-
-        # Put the reordered points and cells into the mesh.
-        reorderedECs.SetPoints(reorderedPoints)
-        reorderedECs.SetPolys(reorderedCellArray)
-
-        # Write the VTK EC mesh file.
-        reorderedMeshWriter = vtk.vtkXMLPolyDataWriter()
-        reorderedMeshWriter.SetInputData(reorderedECs)
-        reorderedMeshWriter.SetFileName(ecVTKFiles[label])
-        reorderedMeshWriter.Update()
-
-        # Use VTK centroid filter to get the centroids in the right order
-        # from the reorderedECMeshBranch.
-        centroidFilter = vtk.vtkCellCenters()
-        centroidFilter.SetInputData(reorderedECs)
-        centroidFilter.Update()
-
-        # Create a vertex cell for each point.
-        pointsToVerticesFilter = vtk.vtkVertexGlyphFilter()
-        pointsToVerticesFilter.SetInputData(centroidFilter.GetOutput())
-        pointsToVerticesFilter.Update()
-
-        reorderedCentroidBranch = pointsToVerticesFilter.GetOutput()
-
-        # Write the VTK EC centrouid file.
-        centroidWriter = vtk.vtkXMLPolyDataWriter()
-        centroidWriter.SetInputData(reorderedCentroidBranch)
-        centroidWriter.SetFileName(ecCentroidVTKFiles[label])
-        centroidWriter.Update()
-
-        # Write the centroids to the TXT points and cells files.
-        for cId in range(0, reorderedCentroidBranch.GetNumberOfCells()):
-            centCell = reorderedCentroidBranch.GetCell(cId)
-            centIds = [centCell.GetNumberOfPoints()]
-
-            # Write centroid ids.
-            ptId = centCell.GetPointId(0)
-            centIds.append(ptId)
-
-            # Write centroid points.
-            point = reorderedCentroidBranch.GetPoint(ptId)
-
-
-
-
-    # Working with SMC mesh.
-    # Working with SMC mesh.
-    # Working with SMC mesh.
-    smcMeshReader = vtk.vtkXMLPolyDataReader()
-    smcMeshReader.SetFileName(meshSet[2])
-    smcMeshReader.Update()
-
-    # Original SMCs mesh to work with.
-    smcMesh = smcMeshReader.GetOutput()
-    print("There are", smcMesh.GetNumberOfCells(), "SMCs in total ...")
-
-    # For every label in the range of labels we want to extract all SMCs.
-    for label in labelRange:
-
-        # Keep track of how many branches we need to skip.
-        numSMCsPerLabel = numQuadsPerRing * numRingsPerLabel[label] * numSMCsPerQuad
-        smcCellOffset = label * numSMCsPerLabel
-
-        print("smcCellOffset", smcCellOffset)
-
-        # Collect cell ids to select.
-        selectionIds = vtk.vtkIdTypeArray()
-        for sId in range(0, int(numSMCsPerLabel)):
-            selectionIds.InsertNextValue(int(smcCellOffset) + sId)
-
-        # Create selecion node.
-        selectionNode = vtk.vtkSelectionNode()
-        selectionNode.SetFieldType(selectionNode.CELL)
-        selectionNode.SetContentType(selectionNode.INDICES)
-        selectionNode.SetSelectionList(selectionIds)
-
-        # Create selection.
-        selection = vtk.vtkSelection()
-        selection.AddNode(selectionNode)
-
-        # Use vtkSelection filter.
-        selectionExtractor = vtk.vtkExtractSelection()
-        selectionExtractor.SetInputData(0, smcMesh)
-        selectionExtractor.SetInputData(1, selection)
-        selectionExtractor.Update()
-
-        extractedSMCs = selectionExtractor.GetOutput()
-
-        # Ring ids list for traversal.
-        ringIds = range(0, int(numRingsPerLabel[label]))
-        ringIds = list(ringIds)
-        ringIds.reverse()
-
-        # Number of SMCs rows is the number of ECs per quad times 13.
-        rowIds = range(0, numSMCsPerCol)
-        rowIds = list(rowIds)
-        rowIds.reverse()
-
-        # The SMCs are organised in rings of blocks of cells.
-        # New vtkCellArray for storing reordeced cells.
-        reorderedCellArray = vtk.vtkCellArray()
-
-        # Iterate over the rings in reverse order.
-        for ringNum in ringIds:
-            # Iterate over the 'imaginary' quads of cells in normal order.
-            for quadNum in range(0, numQuadsPerRing):
-                # Iterate over the rows of cells in reverse order.
-                # Calculate the 'real' id for the 'imaginary' quad.
-                quadId = ringNum * numQuadsPerRing + quadNum
-                # Iterate over rows of cells in reverse order.
-                for rowNum in rowIds:
-                    # Iterate over the rows of cells in normal order.
-                    for smcNum in range(0, numSMCsPerRow):
-                        # Calculate the 'real' smc cell id and get the corresponding cell.
-                        smcId = quadId * numSMCsPerQuad + rowNum * numSMCsPerRow + smcNum
-                        smcCell = extractedSMCs.GetCell(smcId)
-                        reorderedCellArray.InsertNextCell(smcCell)
-
-        # Create new vtkPolyData object for the new reordered mesh.
-        reorderedSMCMeshBranch = vtk.vtkPolyData()
-
-        # Insert our new points.
-        reorderedSMCMeshBranch.SetPoints(extractedSMCs.GetPoints())
-
-        # Set the reordered cells to the reordered SMCs mesh.
-        reorderedSMCMeshBranch.SetPolys(reorderedCellArray)
-
-        # New vtkPoints for storing reordered points.
-        reorderedPoints = vtk.vtkPoints()
-
-        # New vtkCellArray for storing reordeced cells.
-        reorderedCellArray = vtk.vtkCellArray()
-
-        rowBase = 0
-        # Iterate over quads in normal order because they have been reordered.
-        for quadNum in range(0, int(numRingsPerLabel[label]) * numQuadsPerRing):
-            # Iterate over rows in normal order because they have been reordered.
-            for rowNum in range(0, numSMCsPerCol):
-                # Iterate over the SMCs in the row in normal order.
-                for smcNum in range(0, numSMCsPerRow):
-                    # Calculate the 'real' smc cell id and get the corresponding cell.
-                    smcId = quadNum * numSMCsPerQuad + rowNum * numSMCsPerRow + smcNum
-                    smcCell = reorderedSMCMeshBranch.GetCell(smcId)
-
-                    # The ids to be written to the TXT file.
-                    pointIdList = [smcCell.GetNumberOfPoints()]
-
-                    # Write the appropriate points to the TXT file.
-                    for pPos in range(0, smcCell.GetNumberOfPoints()):
-                        newPoint = False
-                        if rowNum == 0:
-                            if smcNum == 0:
-                                newPoint = True
-                            elif pPos == 1 or pPos == 2:
-                                newPoint = True
-                        else:
-                            if smcNum == 0:
-                                if pPos == 0 or pPos == 1:
-                                    newPoint = True
-                            else:
-                                if pPos == 1:
-                                    newPoint = True
-                        if newPoint == True:
-
-                            # Inserting a new point...
-                            point = reorderedSMCMeshBranch.GetPoint(smcCell.GetPointId(pPos))
-                            # with a new id.
-                            newId = reorderedPoints.InsertNextPoint(point)
-                            pointIdList.append(newId)
-
-                            if smcNum == 0 and pPos == 0:
-                                rowBasePrev = newId
-                        else:
-                            # Perhaps this can be done in a nicer way.
-                            # Calculate the ide of a previously inserted point.
-                            if rowNum == 0:
-                                if smcNum == 1:
-                                    if pPos == 0:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 3))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 4))
-                                else:
-                                    if pPos == 0:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 2))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 3))
-                            elif rowNum == 1:
-                                if smcNum == 0:
-                                    if pPos == 2:
-                                        pointIdList.append(int(rowBase + 1))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(rowBase))
-                                else:
-                                    if pPos == 0:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 1))
-                                    elif pPos == 2:
-                                        pointIdList.append(int(rowBase + smcNum * 2 + 2))
-                                    elif pPos == 3:
-                                        if smcNum == 1:
-                                            pointIdList.append(int(rowBase + 1))
-                                        else:
-                                            pointIdList.append(int(rowBase + smcNum * 2))
-                            else:
-                                if smcNum == 0:
-                                    if pPos == 2:
-                                        pointIdList.append(int(rowBase + 1))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(rowBase))
-                                else:
-                                    if pPos == 0:
-                                        pointIdList.append(int(reorderedPoints.GetNumberOfPoints() - 1))
-                                    elif pPos == 2:
-                                        pointIdList.append(int(rowBase + smcNum + 1))
-                                    elif pPos == 3:
-                                        pointIdList.append(int(rowBase + smcNum))
+    # Use VTK centroid filter to get the centroids in the right order
+    # from the reorderedECMeshBranch.
+    centroidFilter = vtk.vtkCellCenters()
+    centroidFilter.SetInputData(reorderedECs)
+    centroidFilter.Update()
 
-                    # print(pointIdList, rowBase)
+    # Create a vertex cell for each point.
+    pointsToVerticesFilter = vtk.vtkVertexGlyphFilter()
+    pointsToVerticesFilter.SetInputData(centroidFilter.GetOutput())
+    pointsToVerticesFilter.Update()
 
-                    # Insert the ids into the cell array.
-                    newCell = vtk.vtkQuad()
-                    newCell.GetPointIds().Reset()
-                    for id in pointIdList[1:]:
-                        newCell.GetPointIds().InsertNextId(id)
-                    reorderedCellArray.InsertNextCell(newCell)
+    reorderedCentroids = pointsToVerticesFilter.GetOutput()
 
-                rowBase = rowBasePrev
+    # Write the VTK EC centrouid file.
+    writeMesh(reorderedCentroids, ecCentroidVTKFile % name)
 
-        # print('\n')
-        print("There are", reorderedPoints.GetNumberOfPoints(), "SMCs points for label", label, "...")
-        print("There are", reorderedCellArray.GetNumberOfCells(), "SMCs cells for label", label, "...")
+    # Reorder the SMCs and build the shared-vertex mesh for the branch.
+    permutation = MeshReordering.loadPermutation(meshSet[0], topology["topologyKey"], numRings, numQuadsPerRing, numSMCsPerCol, numSMCsPerRow)
+    if streamSMCs == True:
+        # Written to the VTK SMC mesh file one ring at a time.
+        reorderedSMCs = streamCells(readMesh(meshSet[2]), label, numRings, numSMCsPerCol, numSMCsPerRow, permutation, smcVTKFile % name)
 
-        # Create new vtkPolyData object for the new reordered mesh.
-        reorderedSMCs = vtk.vtkPolyData()
+        numQuads = numRings * numQuadsPerRing
+        messages.append("There are %d SMCs points for label %d ..." % (numQuads * (numSMCsPerCol + 1) * (numSMCsPerRow + 1), label))
+        messages.append("There are %d SMCs cells for label %d ..." % (numQuads * numSMCsPerCol * numSMCsPerRow, label))
+    else:
+        reorderedSMCs = reorderCells(readMesh(meshSet[2]), label, numRings, numSMCsPerCol, numSMCsPerRow, permutation)
 
-        # Put the reordered points and cells in to the mesh.
-        reorderedSMCs.SetPoints(reorderedPoints)
-        reorderedSMCs.SetPolys(reorderedCellArray)
+        messages.append("There are %d SMCs points for label %d ..." % (reorderedSMCs.GetNumberOfPoints(), label))
+        messages.append("There are %d SMCs cells for label %d ..." % (reorderedSMCs.GetNumberOfCells(), label))
 
         # Write the VTK SMC mesh file.
-        reorderedMeshWriter = vtk.vtkXMLPolyDataWriter()
-        reorderedMeshWriter.SetInputData(reorderedSMCs)
-        reorderedMeshWriter.SetFileName(smcVTKFiles[label])
-        reorderedMeshWriter.Update()
+        writeMesh(reorderedSMCs, smcVTKFile % name)
+
+    if binaryFormat != None:
+        containerFile = writeBranchContainer(binaryFile % name, label, numRings, reorderedTaskMeshBranch,
+                                             reorderedECs, reorderedCentroids, reorderedSMCs)
+        messages.append("Wrote binary mesh container %s for label %d ..." % (containerFile, label))
+
+    return messages
+
+def writeBranchContainer(fileName, label, numRings, taskMeshBranch, ecMeshBranch, ecCentroids, smcMeshBranch):
+    """ Write the reordered meshes of a branch to a binary container. The EC and
+    SMC datasets are indexed by quad first, with point ids relative to the quad,
+    so a solver rank reads its own cells with one contiguous hyperslab.
+    The attributes are the dimensions written to configuration_info.txt.
+    The SMC mesh may be a RingStreamSource, which is then written ring by ring.
+    """
+    numQuads = numRings * numQuadsPerRing
+
+    def quadBlocks(meshBranch, numRowsPerQuad, numCellsPerRow):
+        numPointsPerQuad = (numRowsPerQuad + 1) * (numCellsPerRow + 1)
+        points = numpy_support.vtk_to_numpy(meshBranch.GetPoints().GetData())
+        quads = MeshReordering.quadConnectivity(meshBranch.GetPolys()).reshape(numQuads, -1, 4)
+
+        # The points of every quad are a contiguous block of the reordered mesh.
+        quads = quads - (numpy.arange(numQuads) * numPointsPerQuad)[:, None, None]
+        return (points.reshape(numQuads, numPointsPerQuad, 3).astype(numpy.float32),
+                quads.astype(numpy.int32))
+
+    def streamedQuadBlocks(ringSource, numRowsPerQuad, numCellsPerRow):
+        numPointsPerQuad = (numRowsPerQuad + 1) * (numCellsPerRow + 1)
+        numCellsPerQuad = numRowsPerQuad * numCellsPerRow
+        quadOffsets = (numpy.arange(numQuadsPerRing) * numPointsPerQuad)[:, None, None]
+
+        # Every ring is reordered once and split into its points and quads
+        # blocks, the container writes the two datasets a block of each in turn.
+        pointRings, quadRings = itertools.tee(ringSource.rings())
+        points = (ringPoints.reshape(numQuadsPerRing, numPointsPerQuad, 3) for ringPoints, _ in pointRings)
+        quads = (ringQuads.reshape(numQuadsPerRing, numCellsPerQuad, 4) - quadOffsets for _, ringQuads in quadRings)
+
+        return (MeshContainer.StreamedDataset((numQuads, numPointsPerQuad, 3), numpy.float32, points),
+                MeshContainer.StreamedDataset((numQuads, numCellsPerQuad, 4), numpy.int32, quads))
+
+    ecPoints, ecQuads = quadBlocks(ecMeshBranch, numECsPerCol, numECsPerRow)
+    if isinstance(smcMeshBranch, MeshReordering.RingStreamSource):
+        smcPoints, smcQuads = streamedQuadBlocks(smcMeshBranch, numSMCsPerCol, numSMCsPerRow)
+    else:
+        smcPoints, smcQuads = quadBlocks(smcMeshBranch, numSMCsPerCol, numSMCsPerRow)
+    centroids = numpy_support.vtk_to_numpy(ecCentroids.GetPoints().GetData())
+
+    datasets = collections.OrderedDict([
+        ("task/points", numpy_support.vtk_to_numpy(taskMeshBranch.GetPoints().GetData()).astype(numpy.float32)),
+        ("task/quads", MeshReordering.quadConnectivity(taskMeshBranch.GetPolys()).astype(numpy.int32)),
+        ("ec/points", ecPoints),
+        ("ec/quads", ecQuads),
+        ("ec/centroids", centroids.reshape(numQuads, -1, 3).astype(numpy.float32)),
+        ("smc/points", smcPoints),
+        ("smc/quads", smcQuads),
+    ])
+
+    attributes = collections.OrderedDict([
+        ("label", label),
+        ("numQuadsPerRing", numQuadsPerRing),
+        ("numRings", numRings),
+        ("numECsPerCol", numECsPerCol),
+        ("numECsPerRow", numECsPerRow),
+        ("numSMCsPerCol", numSMCsPerCol),
+        ("numSMCsPerRow", numSMCsPerRow),
+        ("numTaskPoints", (numQuadsPerRing + 1) * (numRings + 1)),
+        ("numTaskCells", numQuads),
+        ("numSMCPointsPerQuad", (numSMCsPerCol + 1) * (numSMCsPerRow + 1)),
+        ("numSMCCellsPerQuad", numSMCsPerCol * numSMCsPerRow),
+        ("numECPointsPerQuad", (numECsPerCol + 1) * (numECsPerRow + 1)),
+        ("numECCellsPerQuad", numECsPerCol * numECsPerRow),
+    ])
+
+    return MeshContainer.writeContainer(fileName, datasets, attributes, binaryFormat)
+
+def initWorker(settings, branchNames, permutationCache):
+    globals().update(settings)
+    BranchTopology.branchNames = branchNames
+    MeshReordering.permutationCache = permutationCache
+
+def exportBranches(labelRange, topology):
+    """ Export the given branches, in a pool of numWorkers processes if set.
+    Yields the progress messages of each branch in label order.
+    """
+    if numWorkers <= 1:
+        for label in labelRange:
+            yield exportBranch(label, topology)
+        return
+
+    settings = dict((name, globals()[name]) for name in workerSettingNames)
+
+    with concurrent.futures.ProcessPoolExecutor(numWorkers, initializer=initWorker,
+                                                initargs=(settings, BranchTopology.branchNames, MeshReordering.permutationCache)) as executor:
+        pending = collections.deque(executor.submit(exportBranch, label, topology) for label in labelRange)
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+def writeLegacyVTK():
+    # This is where the data is for testing purposes.
+    print("Current working directory:", os.getcwd())
+    
+    if os.path.isdir("vtk") == False:
+        os.makedirs("vtk")
+        print("Cretated vtk output directory...")
+    
+    if os.path.isdir("files") == False:
+        os.makedirs("files")
+        print("Created files ouptut directory...")
+        
+
+    # Working with the task mesh.
+    taskMesh = readMesh(meshSet[0])
+
+    # Labels, cell ranges and number of rings of the branches, in one pass over
+    # the task mesh. The analysis is saved for the ATP export scripts.
+    topology = BranchTopology.branchTopology(meshSet[0], numQuadsPerRing, taskMesh)
+
+    labelRange = topology["labels"]
+    print("Labels found in task mesh:", labelRange)
+
+    # Store the number of rings for each label.
+    numRingsPerLabel = topology["numRings"]
+
+    print("Rings per label:", numRingsPerLabel, "...")
+    ringsPerLabelVals = numRingsPerLabel.values()
+
+    # Check all rings per label values are the same.
+    # assert ringsPerLabelVals[1:] == ringsPerLabelVals[:-1], "All values of rings per label must be identical. Generated output is invalid ..."
+    print(ringsPerLabelVals)
+
+    # Fill the permutation cache before the workers read from it.
+    for numRings in set(numRingsPerLabel.values()):
+        MeshReordering.loadPermutation(meshSet[0], topology["topologyKey"], numRings, numQuadsPerRing)
+        MeshReordering.loadPermutation(meshSet[0], topology["topologyKey"], numRings, numQuadsPerRing, numECsPerCol, numECsPerRow)
+        MeshReordering.loadPermutation(meshSet[0], topology["topologyKey"], numRings, numQuadsPerRing, numSMCsPerCol, numSMCsPerRow)
+
+    if numWorkers > 1:
+        print("Exporting branches with", numWorkers, "worker processes ...")
+
+    # Every branch is reordered and written independently of the others.
+    for messages in exportBranches(labelRange, topology):
+        for message in messages:
+            print(message)
 
     print("All done ...")
     print("... Except the last configuration_info.txt file ...")
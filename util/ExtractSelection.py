@@ -1,12 +1,25 @@
+"""
+Extract a selection of cells, e.g. a column of SMCs, from a series of solution
+.vtu files. The selected cell data values of every file are written either to a
+small .vtu file per time-step, or all together to one HDF5 file with a
+(time-steps, cells) dataset per cell data array.
+"""
 import os
 import re
 import vtk
+import h5py
+import numpy
+import collections
+import concurrent.futures
+from vtk.util import numpy_support
 
-def sortNicely(l): 
-    """ Sort the given list in the way that humans expect. 
-    """ 
-    convert = lambda text: int(text) if text.isdigit() else text 
-    alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ] 
+import XMLDataArrayReader
+
+def sortNicely(l):
+    """ Sort the given list in the way that humans expect.
+    """
+    convert = lambda text: int(text) if text.isdigit() else text
+    alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ]
     l.sort( key=alphanum_key )
 
 # These parameters are to be set in the calling script.
@@ -17,74 +30,200 @@ outputPattern = ''
 branches = []
 numSMCsPerCol = 4 * 13
 
-def ExtractSelection(fileList):
-    # Report our CWD just for testing purposes.
-    print "CWD:", os.getcwd()
+# Cell data arrays to extract, None for all of them.
+arrayNames = None
+
+# Output of the selected values: 'vtu' writes outputPattern + <time-step> + '.vtu'
+# for every file, 'hdf5' writes all time-steps to hdf5File.
+outputFormat = 'vtu'
+hdf5File = ''
+
+# Read the cell data arrays straight out of the XML files, without building the
+# grid. Set to False to read the files with the VTK reader instead.
+partialRead = True
+
+# Number of worker processes reading the files. With 0 or 1 the files are read
+# in this process.
+numWorkers = 0
+
+# Maximum number of files being read ahead of the writer.
+maxInFlight = 16
 
+# Arguments for readSelection in the worker processes, set by initWorker.
+workerArgs = None
+
+def selectionIds():
+    """ Ids of the selected cells: a column of numSMCsPerCol cells from start in
+        every ring of the selected branches, in ascending order.
+    """
     ringOffset = numQuadsPerRing * numSMCsPerCol * 4
     branchOffset = numRingsPerBranch * ringOffset
 
-    # Prepare selection id array.    
-    selectionIds = vtk.vtkIdTypeArray()
-    
-    for branch in branches:
-        thisBranchOffset = branch * branchOffset
-        # print thisBranchOffset,
-    
-        for ring in range(numRingsPerBranch):
-            thisRingOffset = ring * ringOffset
-            # print thisRingOffset, 
-            
-            for cell in range(numSMCsPerCol):
-                thisOffset = start + thisBranchOffset + thisRingOffset + cell
-                # print thisOffset,
-                selectionIds.InsertNextValue(thisOffset)
-    
-    # Create selection node.
+    ids = (start + numpy.asarray(branches, dtype=numpy.int64)[:, None, None] * branchOffset +
+           numpy.arange(numRingsPerBranch, dtype=numpy.int64)[None, :, None] * ringOffset +
+           numpy.arange(numSMCsPerCol, dtype=numpy.int64)[None, None, :])
+
+    return numpy.unique(ids)
+
+def timeStepNumber(fileName):
+    """ The first number in the base name of a file. """
+    baseName = os.path.basename(fileName)
+    return [int(s) for s in re.split('([0-9]+)', baseName) if s.isdigit()][0]
+
+def readGrid(inFile):
+    reader = vtk.vtkXMLUnstructuredGridReader()
+    reader.SetFileName(inFile)
+    reader.Update()
+    return reader.GetOutput()
+
+def readSelection(inFile, ids, names):
+    """ Read one file and return the values of its cell data arrays at the ids. """
+    if partialRead:
+        arrays = XMLDataArrayReader.readDataArrays(inFile, names)
+        return collections.OrderedDict((name, data[ids]) for name, data in arrays.items())
+
+    cellData = readGrid(inFile).GetCellData()
+
+    if names == None:
+        names = [cellData.GetArrayName(i) for i in range(cellData.GetNumberOfArrays())]
+
+    values = collections.OrderedDict()
+    for name in names:
+        values[name] = numpy_support.vtk_to_numpy(cellData.GetArray(name))[ids]
+
+    return values
+
+def initWorker(ids, names, usePartialRead):
+    global workerArgs, partialRead
+    workerArgs = (ids, names)
+    partialRead = usePartialRead
+
+def readSelectionWorker(inFile):
+    return readSelection(inFile, *workerArgs)
+
+def readSelections(fileList, ids, names):
+    """ Yield the selected values of the given files in order, reading them in a
+        pool of numWorkers processes with at most maxInFlight files pending.
+    """
+    if numWorkers <= 1:
+        for inFile in fileList:
+            yield readSelection(inFile, ids, names)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(numWorkers, initializer=initWorker,
+                                                initargs=(ids, names, partialRead)) as executor:
+        pending = collections.deque()
+        for inFile in fileList:
+            if len(pending) >= max(1, maxInFlight):
+                yield pending.popleft().result()
+            pending.append(executor.submit(readSelectionWorker, inFile))
+
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+def selectionGrid(inFile, ids):
+    """ The selected cells of a solution file as a grid with the cell and point
+        ids of the original grid, and without any other data arrays.
+    """
     selectionNode = vtk.vtkSelectionNode()
     selectionNode.SetFieldType(selectionNode.CELL)
     selectionNode.SetContentType(selectionNode.INDICES)
-    selectionNode.SetSelectionList(selectionIds)
-    
-    # Create selection.
+    selectionNode.SetSelectionList(numpy_support.numpy_to_vtkIdTypeArray(ids, deep=True))
+
     selection = vtk.vtkSelection()
     selection.AddNode(selectionNode)
-    
+
+    reader = vtk.vtkXMLUnstructuredGridReader()
+    reader.SetFileName(inFile)
+
+    selectionExtractor = vtk.vtkExtractSelection()
+    selectionExtractor.SetInputConnection(reader.GetOutputPort())
+    selectionExtractor.SetInputData(1, selection)
+    selectionExtractor.Update()
+
+    grid = vtk.vtkUnstructuredGrid()
+    grid.ShallowCopy(selectionExtractor.GetOutput())
+
+    for data, keep in ((grid.GetCellData(), "vtkOriginalCellIds"), (grid.GetPointData(), "vtkOriginalPointIds")):
+        for name in [data.GetArrayName(i) for i in range(data.GetNumberOfArrays())]:
+            if name != keep:
+                data.RemoveArray(name)
+
+    return grid
+
+def writeSelectionVTU(grid, values, outFile):
+    # The copy has its own cell data, the template grid is left unchanged.
+    stepGrid = vtk.vtkUnstructuredGrid()
+    stepGrid.ShallowCopy(grid)
+
+    for name, data in values.items():
+        dataArray = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(data), deep=True)
+        dataArray.SetName(name)
+        stepGrid.GetCellData().AddArray(dataArray)
+
+    writer = vtk.vtkXMLUnstructuredGridWriter()
+    writer.SetInputData(stepGrid)
+    writer.SetFileName(outFile)
+    writer.Update()
+
+def ExtractSelection(fileList):
+    # Report our CWD just for testing purposes.
+    print("CWD:", os.getcwd())
+
+    if outputFormat not in ['vtu', 'hdf5']:
+        raise ValueError("Unknown output format '%s', expected 'vtu' or 'hdf5'." % outputFormat)
+
+    # Prepare selection id array.
+    ids = selectionIds()
+
     sortNicely(fileList)
-    
+
+    if len(fileList) == 0:
+        print('No files to process...')
+        return
+
+    print('Extracting', ids.shape[0], 'cells from', len(fileList), 'files...')
+
+    if numWorkers > 1:
+        print("Reading files with", numWorkers, "worker processes ...")
+
+    grid = None
+    h5File = None
+    datasets = {}
+
+    if outputFormat == 'vtu':
+        # The geometry of the selection is the same in every file.
+        grid = selectionGrid(fileList[0], ids)
+    else:
+        h5File = h5py.File(hdf5File, 'w')
+        h5File.create_dataset("/cellIds", data=ids)
+        h5File.create_dataset("/timeIndex", data=numpy.array([timeStepNumber(inFile) for inFile in fileList], dtype=numpy.int64))
+
     # Process every file by extracting selection.
-    for inFile in fileList:
-        print 'Reading file', inFile
-        reader = vtk.vtkXMLUnstructuredGridReader()
-        reader.SetFileName(inFile)
-        
-        print '\tExtracting ', selectionIds.GetNumberOfTuples(), 'cells...'
-        selectionExtractor = vtk.vtkExtractSelection()
-        selectionExtractor.SetInputConnection(reader.GetOutputPort())
-        if vtk.vtkVersion().GetVTKMajorVersion() > 5:
-            selectionExtractor.SetInputData(1, selection)
-        else:
-            selectionExtractor.SetInput(1, selection)
-        
-        baseName = os.path.basename(inFile)
-        number = [int(s) for s in re.split('([0-9]+)', baseName) if s.isdigit()]
-        outFile = outputPattern + str(number[0]) + '.vtu'
-        
-        print '\t\tSaving file', outFile
-        writer = vtk.vtkXMLUnstructuredGridWriter()
-        writer.SetInputConnection(selectionExtractor.GetOutputPort())
-        writer.SetFileName(outFile)
-        writer.Update()
-        
-        print '\n'
-    
-    print 'All done...'
+    for step, (inFile, values) in enumerate(zip(fileList, readSelections(fileList, ids, arrayNames))):
+        print('Read file', inFile)
+
+        if outputFormat == 'vtu':
+            outFile = outputPattern + str(timeStepNumber(inFile)) + '.vtu'
+            print('\tSaving file', outFile)
+            writeSelectionVTU(grid, values, outFile)
+            continue
+
+        for name, data in values.items():
+            if name not in datasets:
+                datasets[name] = h5File.create_dataset("/" + name, (len(fileList),) + data.shape, data.dtype)
+            datasets[name][step] = data
+
+    if h5File != None:
+        print('Saving file', hdf5File)
+        h5File.close()
+
+    print('All done...')
 
 def Usage():
-	print "This script is to be run with global parameters (mesh dimensions, output file name pattern, etc.) set in the calling script."
-	
-if __name__ == '__main__':
-	print "Starting", os.path.basename(__file__)
-	Usage()
-	print "Exiting", os.path.basename(__file__)
+    print("This script is to be run with global parameters (mesh dimensions, output file name pattern, etc.) set in the calling script.")
 
+if __name__ == '__main__':
+    print("Starting", os.path.basename(__file__))
+    Usage()
+    print("Exiting", os.path.basename(__file__))
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+ATP maps for flat meshes.
+
+The profiles take the cell centres of an EC mesh as an (N, 3) NumPy array and
+return an array of N ATP values. Linear and sigmoid profiles set a background
+along one axis, rectangular and radial patches are laid over a background, e.g.
+
+    centres = FlatMeshATP.cellCentres(ecMesh)
+    points = FlatMeshATP.centreArray(centres)
+    atp = FlatMeshATP.linearATP(points, 0.2, 0.7)
+    atp = FlatMeshATP.rectangularPatchATP(points, atp, (3000, 7000), (6000, 7000), 0.7)
+    FlatMeshATP.writeATPMap(ecMesh, atp, "quadMeshFullATPc2000.vtp")
+"""
+
+import os
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+import HotSpotATP
+
+def cellCentres(mesh):
+    """ Cell centres of a mesh as a vtkPolyData with a vertex cell per centre. """
+    return HotSpotATP.cellCentres(mesh)
+
+def centreArray(centres):
+    """ The points of a vtkPolyData as an (N, 3) array of doubles. """
+    return numpy_support.vtk_to_numpy(centres.GetPoints().GetData()).astype(numpy.float64)
+
+def axisRange(points, axis, lower, upper):
+    if lower is None:
+        lower = points[:, axis].min()
+    if upper is None:
+        upper = points[:, axis].max()
+    return lower, upper
+
+def linearATP(points, atpMin, atpMax, axis = 1, lower = None, upper = None):
+    """ ATP rising linearly from atpMin at lower to atpMax at upper along the
+        axis, lower and upper default to the range of the points.
+    """
+    lower, upper = axisRange(points, axis, lower, upper)
+    return (points[:, axis] - lower) * (atpMax - atpMin) / (upper - lower) + atpMin
+
+def sigmoidATP(points, atpMin, atpMax, gradient, axis = 1, lower = None, upper = None, domain = (-1.0, 1.0)):
+    """ The sigmoid of GenerateATPMapV2 along the axis, with the range from lower
+        to upper rescaled to the sigmoid domain.
+    """
+    lower, upper = axisRange(points, axis, lower, upper)
+    x = (points[:, axis] - lower) * (domain[1] - domain[0]) / (upper - lower) + domain[0]
+    return atpMin + (atpMax / (1.0 + numpy.exp(-gradient * x)))
+
+def rectangularPatchATP(points, atp, xRange, yRange, value):
+    """ The atp array with the value set within the open xRange by yRange
+        rectangle.
+    """
+    inside = ((xRange[0] < points[:, 0]) & (points[:, 0] < xRange[1]) &
+              (yRange[0] < points[:, 1]) & (points[:, 1] < yRange[1]))
+    return numpy.where(inside, value, atp)
+
+def radialATP(points, atp, centre, radius, peak, sigmoidGradient = -3.0, innerRadius = 0.5, sigmoidDomain = (-2.0, 2.0)):
+    """ The atp array with a hot spot of HotSpotATP laid over it, falling off
+        from the peak value to the atp values at the radius.
+    """
+    parDist = numpy.sqrt(((points - numpy.asarray(centre, dtype=numpy.float64)) ** 2).sum(axis=1)) / radius
+    inside = parDist <= 1.0
+
+    atp = numpy.array(atp, dtype=numpy.float64)
+    atp[inside] = HotSpotATP.hotSpotProfile(parDist[inside], peak, atp[inside], sigmoidGradient, innerRadius, sigmoidDomain)
+    return atp
+
+def writeATPMap(dataset, atp, fileName, name = "initialATP", replaceScalars = False):
+    """ Attach the ATP values to the cells of the dataset as the active scalars
+        and write it to fileName. With replaceScalars the ATP array takes the
+        place of the previous active scalars. Returns the dataset.
+    """
+    atpArray = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(atp, dtype=numpy.float64), deep=True)
+    atpArray.SetName(name)
+
+    assert atpArray.GetNumberOfTuples() == dataset.GetNumberOfCells(), "Number of cells (%d) and ATP values (%d) mismatch." % (dataset.GetNumberOfCells(), atpArray.GetNumberOfTuples())
+
+    if replaceScalars:
+        dataset.GetCellData().SetScalars(atpArray)
+    else:
+        dataset.GetCellData().AddArray(atpArray)
+        dataset.GetCellData().SetActiveScalars(name)
+
+    mapWriter = vtk.vtkXMLPolyDataWriter()
+    mapWriter.SetFileName(fileName)
+    mapWriter.SetInputData(dataset)
+    mapWriter.Update()
+
+    return dataset
+
+def usage():
+    print("This module provides flat mesh ATP profiles to be imported by the ATP map scripts.")
+
+if __name__ == '__main__':
+    print("Starting", os.path.basename(__file__))
+    usage()
+    print("Exiting", os.path.basename(__file__))
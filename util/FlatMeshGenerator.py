@@ -7,6 +7,11 @@ A horrible quick and dirty script to build a mesh in our desired format.
 @author: sed59
 """
 import vtk
+import numpy
+from vtk.util import numpy_support
+
+import FlatMeshATP
+import MeshReordering
 
 bifurcation = True
 xQuads = 4
@@ -17,57 +22,64 @@ quadHeight = 260
 
 def buildATPMesh(polydata, filename):
     
-    centroidFilter = vtk.vtkCellCenters()
-    centroidFilter.VertexCellsOn()
-    centroidFilter.SetInputData(polydata)
-    
-    newPolydata = vtk.vtkPolyData()
-    newPolydata = centroidFilter.GetOutput()
-    centroidFilter.Update()
-    
-    ATPValues = vtk.vtkDoubleArray()
-    ATPValues.SetName("initialATP")
-    
+    # ATP rising linearly along y, from 0 at y = 0 to 1 at the height of the
+    # mesh. It replaces the branchId scalars passed on to the centres.
+    centres = FlatMeshATP.cellCentres(polydata)
     _, _, yMin, yMax, _, _ = polydata.GetBounds()
-    yRange = yMax - yMin
-    
-    for pointId in range(0, newPolydata.GetNumberOfPoints()):
-        _, y, _ = newPolydata.GetPoint(pointId)
-        ATPValue = y / (yRange * 1.0)
-        ATPValues.InsertNextValue(ATPValue)
-        
-    newPolydata.GetCellData().SetScalars(ATPValues)
-    
-    polyDataWriter = vtk.vtkXMLPolyDataWriter()
-    polyDataWriter.SetFileName(filename)
-    polyDataWriter.SetInputData(newPolydata)    
-    polyDataWriter.Write()
 
+    atp = FlatMeshATP.linearATP(FlatMeshATP.centreArray(centres), 0.0, 1.0, lower=0.0, upper=yMax - yMin)
 
-def buildMesh(xNumCells, yNumCells, filename):
-    
-    polydata = vtk.vtkPolyData()
-    points = vtk.vtkPoints()
-    quads = vtk.vtkCellArray()
+    return FlatMeshATP.writeATPMap(centres, atp, filename, replaceScalars=True)
+
+
+def rectangleGrid(xNumCells, yNumCells, xBase, yBase, pointOffset):
+    """ Points and quads of one rectangle of xQuads by yQuads quads, each split
+        into xNumCells by yNumCells cells. The cells share their vertices on a
+        structured grid and are ordered quad by quad, row by row.
+    """
+    xStep = quadLength / float(xNumCells)
+    yStep = quadHeight / float(yNumCells)
+
+    numCols = xQuads * xNumCells
+    numRows = yQuads * yNumCells
+
+    # Grid coordinates, the same values as the corners of the individual quads.
+    cols = numpy.arange(numCols + 1)
+    rows = numpy.arange(numRows + 1)
+    xCoords = (cols % xNumCells) * xStep + xBase + quadLength * (cols // xNumCells)
+    yCoords = (rows % yNumCells) * yStep + yBase + quadHeight * (rows // yNumCells)
+
+    points = numpy.zeros(((numRows + 1) * (numCols + 1), 3))
+    points[:, 0] = numpy.tile(xCoords, numRows + 1)
+    points[:, 1] = numpy.repeat(yCoords, numCols + 1)
 
-    counter = 0 
+    # Cells in the order of quad row, quad column, cell row, cell column.
+    i, j, x, y = numpy.meshgrid(numpy.arange(yQuads), numpy.arange(xQuads),
+                                numpy.arange(yNumCells), numpy.arange(xNumCells), indexing='ij')
+    cellRows = (i * yNumCells + x).ravel()
+    cellCols = (j * xNumCells + y).ravel()
+
+    p0 = pointOffset + cellRows * (numCols + 1) + cellCols
+    quads = numpy.column_stack((p0, p0 + 1, p0 + numCols + 2, p0 + numCols + 1))
+
+    return points, quads
+
+def buildMesh(xNumCells, yNumCells, filename):
     
     xBase = 0
     yBase = 0
     
-    xStep = quadLength/(xNumCells * 1.0) # Focing float division (python 2).
-    yStep = quadHeight/(yNumCells * 1.0)
-    
-    branchId = vtk.vtkDoubleArray()
-    branchId.SetName("branchId")
-
-    
     # Three rectangles in space for a bifurcation.
     if bifurcation == True:
         stopAt = 3
     else:
         stopAt = 1
 
+    pointBlocks = []
+    quadBlocks = []
+    branchIds = []
+    numPoints = 0
+
     for k in range(0, stopAt):
         if k == 1:
             xBase = - quadLength * (xQuads / 2)
@@ -76,47 +88,19 @@ def buildMesh(xNumCells, yNumCells, filename):
         elif k == 2:
             xBase = + quadLength * (xQuads / 2) 
             yBase = quadHeight * yQuads     
-                       
-        # The framework for each quad. The total number is set by globals.
-        for i in range(0, yQuads):
-            for j in range(0, xQuads):
-                
-                    # For how ever many cells are within each main quad.
-                    # The total number is decided by the function parameters.
-                    for x in range(0, yNumCells):
-                        for y in range(0, xNumCells):
-                            
-                            quad = vtk.vtkQuad()
-                                                        
-                            p0 = [y * xStep + xBase + (quadLength * j), 
-                                  x * yStep + yBase + (quadHeight * i), 0]
-                                  
-                            p1 = [(y + 1) * xStep + xBase + (quadLength * j),
-                                  x * yStep + yBase + (quadHeight * i), 0]
-                                  
-                            p2 = [(y + 1) * xStep + xBase + (quadLength * j), 
-                                  (x + 1) * yStep + yBase + (quadHeight * i), 0]
-                                  
-                            p3 = [y * xStep + xBase + (quadLength * j),
-                                  (x + 1) * yStep + yBase + (quadHeight * i), 0]
-                                  
-                            
-                            points.InsertNextPoint(p0)
-                            points.InsertNextPoint(p1)
-                            points.InsertNextPoint(p2)
-                            points.InsertNextPoint(p3)
-                            
-                            quad.GetPointIds().InsertId(0, counter)
-                            quad.GetPointIds().InsertId(1, counter + 1)
-                            quad.GetPointIds().InsertId(2, counter + 2)
-                            quad.GetPointIds().InsertId(3, counter + 3)
-                            counter += 4
-                            
-                            quads.InsertNextCell(quad)
-                            branchId.InsertNextValue(k)
-
-    polydata.SetPoints(points)
-    polydata.SetPolys(quads)
+
+        points, quads = rectangleGrid(xNumCells, yNumCells, xBase, yBase, numPoints)
+        numPoints += points.shape[0]
+
+        pointBlocks.append(points)
+        quadBlocks.append(quads)
+        branchIds.append(numpy.full(quads.shape[0], k, dtype=numpy.float64))
+
+    polydata = MeshReordering.quadsToPolyData(numpy.concatenate(pointBlocks), numpy.concatenate(quadBlocks))
+
+    branchId = numpy_support.numpy_to_vtk(numpy.concatenate(branchIds), deep=True)
+    branchId.SetName("branchId")
+
     polydata.GetCellData().SetScalars(branchId)
     
     polyDataWriter = vtk.vtkXMLPolyDataWriter()
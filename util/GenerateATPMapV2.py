@@ -4,10 +4,14 @@ Create an initial V2 ATP Profile for an ECs Mesh and write it out as .vtp.
 """
 import os
 import sys
-import math
+import time
 import vtk
 import numpy
+import h5py
+from vtk.util import numpy_support
 import matplotlib.pyplot as pyplot
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 centrelineFile = None
 meshFile = None
@@ -23,18 +27,56 @@ atpMax = 1.0
 outMin = -1.0
 outMax = 1.0
 
+# Preview of the ATP profile: 'show' opens an interactive plot window, 'png'
+# renders it off-screen to previewFile and None skips it. 'png' and None do not
+# need a display, so sweeps can run unattended.
+preview = 'show'
+
+# PNG file for the 'png' preview, defaults to atpFile with the .png extension.
+previewFile = None
+
 def rescale(val, inMin, inMax):
     return (val - inMin) * (outMax - outMin) / (inMax - inMin) + outMin
 
 # Sigmoid function for providing ATP values. The atpGradient variable
-# controls the "spread" of the values across the given domain.
-def sigmoidATP(x):
-    return atpMin + (atpMax / (1.0 + numpy.exp(-atpGradient * x)))
-
-def buildATPMesh():
-    # Report our CWD just for testing purposes.
-    print("CWD:", os.getcwd())
-
+# controls the "spread" of the values across the given domain. The parameters
+# default to the module values, given as arrays they broadcast against x.
+def sigmoidATP(x, gradient = None, minimum = None, maximum = None):
+    if gradient is None:
+        gradient = atpGradient
+    if minimum is None:
+        minimum = atpMin
+    if maximum is None:
+        maximum = atpMax
+    return minimum + (maximum / (1.0 + numpy.exp(-gradient * x)))
+
+def plotATPProfile():
+    """ Plot the sigmoid ATP profile over the rescaled distance range. """
+    # Provide a quick visualisation of the ATP profile for validation.
+    pointsX = numpy.arange(outMin, outMax, 0.001)
+    pointsY = sigmoidATP(pointsX)
+
+    if preview == 'show':
+        pyplot.plot(pointsX, pointsY, 'b')
+        pyplot.show()
+    elif preview == 'png':
+        fileName = previewFile
+        if fileName == None:
+            fileName = os.path.splitext(atpFile)[0] + ".png"
+
+        # Off-screen figure, independent of the pyplot state and backend.
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        figure.gca().plot(pointsX, pointsY, 'b')
+        figure.savefig(fileName)
+        print("Wrote ATP profile preview", fileName)
+    elif preview != None:
+        raise ValueError("Unknown preview '%s', expected 'show', 'png' or None." % preview)
+
+def readATPGeometry():
+    """ Read the EC mesh and centreline. Returns the EC mesh, its cell centroids
+    and the distance of every centroid from the centreline origin.
+    """
     # Read in the mesh.
     print("Reading", meshFile)
     meshReader = vtk.vtkXMLPolyDataReader()
@@ -60,32 +102,35 @@ def buildATPMesh():
 
     centroids = centroidFilter.GetOutput()
 
-    # Iterate over each centroid and find the closest segment
-    centroidPoints = centroids.GetPoints()
-
-    # Only for DEBUG output.
-    distArray = vtk.vtkDoubleArray()
-    distArray.SetName("Dist")
+    # All centroid coordinates as one array.
+    centroidPoints = numpy_support.vtk_to_numpy(centroids.GetPoints().GetData()).astype(numpy.float64)
 
     # For each point calculate the distance from origin.
-    totalPoints = centroidPoints.GetNumberOfPoints()
-    for ptId in range(totalPoints):        
-        distance = vtk.vtkMath.Distance2BetweenPoints(origin, centroidPoints.GetPoint(ptId))
-        distArray.InsertNextValue(math.sqrt(distance))
+    distances = numpy.sqrt(((centroidPoints - numpy.asarray(origin)) ** 2).sum(axis=1))
+
+    return ecMesh, centroids, distances
+
+def buildATPMesh():
+    startTime = time.time()
+
+    # Report our CWD just for testing purposes.
+    print("CWD:", os.getcwd())
+
+    ecMesh, centroids, distances = readATPGeometry()
+
+    # Only for DEBUG output. The arrays reference the NumPy data without copying.
+    distArray = numpy_support.numpy_to_vtk(distances, deep=False)
+    distArray.SetName("Dist")
 
     # Get the range of the distance values.
     inMin, inMax = distArray.GetRange()
-    
-    atpArray = vtk.vtkFloatArray()
-    atpArray.SetName('initialATP')
-    
+
     # Normalise distance values.
-    for i in range(distArray.GetNumberOfTuples()):
-        dist = distArray.GetTuple(i)[0]
-        distRescaled = rescale(dist, inMin, inMax)
-        atpVal = sigmoidATP(distRescaled)
-        atpArray.InsertNextValue(atpVal)
-    
+    atpValues = sigmoidATP(rescale(distances, inMin, inMax)).astype(numpy.float32)
+
+    atpArray = numpy_support.numpy_to_vtk(atpValues, deep=False)
+    atpArray.SetName('initialATP')
+
     # Prepare debug ATP mesh.
     debugAtpDataset = ecMesh
     debugAtpDataset.GetCellData().AddArray(distArray)
@@ -112,14 +157,66 @@ def buildATPMesh():
     atpMapWriter.SetInputData(atpDataset)
     atpMapWriter.Update()
     
-    # Provide a quick visualisation of the ATP profile for validation.
-    pointsX = numpy.arange(outMin, outMax, 0.001)
-    pointsY = []
-    for pt in pointsX:
-        pointsY.append(sigmoidATP(pt))
-    
-    pyplot.plot(pointsX, pointsY, 'b')
-    pyplot.show()
+    plotATPProfile()
+
+    print("Built ATP map in %.2f seconds." % (time.time() - startTime))
+
+def sweepATPMaps(parameters, atpFilePattern = None, hdf5File = None):
+    """ Build the ATP maps for many (atpGradient, atpMin, atpMax) combinations.
+
+    The EC mesh is read and its centroids computed once, and the maps of all
+    combinations are evaluated in one broadcast NumPy computation. Each map is
+    written to atpFilePattern, formatted with the index of the combination and
+    its parameters, e.g. "atp_%(index)d_%(atpGradient).1f.vtp". With hdf5File
+    all maps are also written as a stacked (combinations, ECs) "initialATP"
+    dataset, with the combinations in the "parameters" dataset. Returns the
+    (combinations, ECs) array of ATP values.
+    """
+    startTime = time.time()
+
+    parameters = numpy.asarray(parameters, dtype=numpy.float64).reshape(-1, 3)
+
+    ecMesh, centroids, distances = readATPGeometry()
+
+    # Normalise distance values.
+    distRescaled = rescale(distances, distances.min(), distances.max())
+
+    # One row of ATP values per combination.
+    atpMaps = sigmoidATP(distRescaled[None, :], parameters[:, 0:1], parameters[:, 1:2], parameters[:, 2:3]).astype(numpy.float32)
+
+    print("Evaluated", atpMaps.shape[0], "ATP maps of", atpMaps.shape[1], "ECs ...")
+
+    if atpFilePattern != None:
+        # Prepare the ATP mesh by converting all points to vercices, the map
+        # arrays are swapped in for each combination.
+        pointsToVerticesFilter = vtk.vtkVertexGlyphFilter()
+        pointsToVerticesFilter.SetInputData(centroids)
+        pointsToVerticesFilter.Update()
+        atpDataset = pointsToVerticesFilter.GetOutput()
+
+        for index in range(atpMaps.shape[0]):
+            atpArray = numpy_support.numpy_to_vtk(atpMaps[index], deep=False)
+            atpArray.SetName('initialATP')
+            atpDataset.GetCellData().AddArray(atpArray)
+
+            fileName = atpFilePattern % {"index": index, "atpGradient": parameters[index, 0],
+                                         "atpMin": parameters[index, 1], "atpMax": parameters[index, 2]}
+
+            atpMapWriter = vtk.vtkXMLPolyDataWriter()
+            atpMapWriter.SetFileName(fileName)
+            atpMapWriter.SetInputData(atpDataset)
+            atpMapWriter.Update()
+
+    if hdf5File != None:
+        h5File = h5py.File(hdf5File, 'w')
+        h5File.create_dataset("/initialATP", data=atpMaps)
+        dset = h5File.create_dataset("/parameters", data=parameters)
+        dset.attrs["columns"] = numpy.array([b"atpGradient", b"atpMin", b"atpMax"])
+        h5File.close()
+
+    print("Built %d ATP maps in %.2f seconds." % (atpMaps.shape[0], time.time() - startTime))
+
+    return atpMaps
 
 def usage():
     print("This script is to be run with global parameters (input centrelin, EC mesh, etc.) set in the calling script.")
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Radial hot-spot ATP maps.
+
+Each hot spot is a sphere around a centre point. ECs whose centres fall within
+the inner part of the sphere get the peak ATP value, and the value falls off
+along a sigmoid to the background ATP value at the sphere radius. ECs outside
+all spheres keep the background value.
+
+The cell centres are put into a vtkStaticPointLocator once, so every sphere only
+visits the cells inside it, and the values of all spheres are composed into a
+single ATP array with NumPy.
+"""
+
+import os
+import collections
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+# A hot spot: its centre, radius and peak ATP value, and the sigmoid fall-off.
+# The part of the sphere within innerRadius (relative to the radius) is at the
+# peak value, the rest of the radius is mapped to sigmoidDomain.
+HotSpot = collections.namedtuple("HotSpot", ["centre", "radius", "peak", "sigmoidGradient", "innerRadius", "sigmoidDomain"])
+HotSpot.__new__.__defaults__ = (-3.0, 0.5, (-2.0, 2.0))
+
+def hotSpotProfile(parDist, peak, base, sigmoidGradient, innerRadius, sigmoidDomain):
+    """ ATP values for parametric distances (distance / radius) within a hot
+        spot. The parameters may be arrays broadcasting against parDist.
+    """
+    domainMin, domainMax = sigmoidDomain
+
+    # Map the distance outside the inner radius to the sigmoid domain.
+    x = (parDist - innerRadius) * ((domainMax - domainMin) / (1.0 - innerRadius)) + domainMin
+    s = 1.0 / (1.0 + numpy.exp(-sigmoidGradient * x))
+
+    return numpy.where(parDist <= innerRadius, peak, base + s * (peak - base))
+
+def cellCentres(mesh):
+    """ Cell centres of a mesh as a vtkPolyData with a vertex cell per centre. """
+    centresFilter = vtk.vtkCellCenters()
+    centresFilter.VertexCellsOn()
+    centresFilter.SetInputData(mesh)
+    centresFilter.Update()
+
+    return centresFilter.GetOutput()
+
+def pointsWithinRadius(locator, centre, radius):
+    """ Ids of the located points within radius of the centre. """
+    idList = vtk.vtkIdList()
+    locator.FindPointsWithinRadius(radius, centre, idList)
+    return numpy.fromiter((idList.GetId(i) for i in range(idList.GetNumberOfIds())),
+                          dtype=numpy.int64, count=idList.GetNumberOfIds())
+
+def hotSpotATP(centres, hotSpots, base, composition = 'last'):
+    """ ATP value of every point in centres (a vtkPolyData, see cellCentres) for
+        a list of HotSpots on a background ATP value.
+
+        Where spheres overlap, composition decides which one sets the value:
+        'last' -- the sphere listed last.
+        'nearest' -- the sphere with the nearest centre, out of all hot spots.
+                     Points nearest to a sphere they are not in keep the
+                     background value.
+    """
+    if composition not in ['last', 'nearest']:
+        raise ValueError("Unknown composition '%s', expected 'last' or 'nearest'." % composition)
+
+    points = numpy_support.vtk_to_numpy(centres.GetPoints().GetData()).astype(numpy.float64)
+    atp = numpy.full(points.shape[0], base, dtype=numpy.float64)
+
+    if len(hotSpots) == 0:
+        return atp
+
+    locator = vtk.vtkStaticPointLocator()
+    locator.SetDataSet(centres)
+    locator.BuildLocator()
+
+    # Points inside each sphere, and which sphere they are inside.
+    pointIds = [pointsWithinRadius(locator, spot.centre, spot.radius) for spot in hotSpots]
+    spotIds = numpy.repeat(numpy.arange(len(hotSpots)), [ids.shape[0] for ids in pointIds])
+    pointIds = numpy.concatenate(pointIds)
+
+    spotCentres = numpy.array([spot.centre for spot in hotSpots], dtype=numpy.float64)
+    spotRadii = numpy.array([spot.radius for spot in hotSpots], dtype=numpy.float64)
+
+    if composition == 'last':
+        # Keep the last sphere of every point, pairs are ordered by sphere.
+        _, last = numpy.unique(pointIds[::-1], return_index=True)
+        keep = pointIds.shape[0] - 1 - last
+        pointIds = pointIds[keep]
+        spotIds = spotIds[keep]
+    else:
+        # The nearest of all centres for every point inside a sphere.
+        pointIds = numpy.unique(pointIds)
+        dist2 = ((points[pointIds, None, :] - spotCentres[None, :, :]) ** 2).sum(axis=2)
+        spotIds = dist2.argmin(axis=1)
+
+        inside = dist2[numpy.arange(pointIds.shape[0]), spotIds] <= spotRadii[spotIds] ** 2
+        pointIds = pointIds[inside]
+        spotIds = spotIds[inside]
+
+    parDist = numpy.sqrt(((points[pointIds] - spotCentres[spotIds]) ** 2).sum(axis=1)) / spotRadii[spotIds]
+
+    def spotParameter(name):
+        return numpy.array([getattr(spot, name) for spot in hotSpots], dtype=numpy.float64)[spotIds]
+
+    domains = numpy.array([spot.sigmoidDomain for spot in hotSpots], dtype=numpy.float64)[spotIds]
+
+    atp[pointIds] = hotSpotProfile(parDist, spotParameter("peak"), base, spotParameter("sigmoidGradient"),
+                                   spotParameter("innerRadius"), (domains[:, 0], domains[:, 1]))
+
+    return atp
+
+def hotSpotATPArray(atp, name = "initialATP"):
+    """ A vtkDoubleArray of ATP values. """
+    atpArray = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(atp, dtype=numpy.float64), deep=True)
+    atpArray.SetName(name)
+    return atpArray
+
+def usage():
+    print("This module provides hot-spot ATP map helpers to be imported by the ATP map scripts.")
+
+if __name__ == '__main__':
+    print("Starting", os.path.basename(__file__))
+    usage()
+    print("Exiting", os.path.basename(__file__))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Binary containers for the reordered meshes of a branch, read by the coupled
+cells solver instead of the XML .vtp files and configuration_info.txt.
+
+A container holds named arrays and integer attributes. EC and SMC arrays are
+stored with the quad of the task mesh as their first dimension and with point
+ids relative to the quad, so the cells of one quad (one MPI rank) are a single
+contiguous hyperslab, e.g. ec/points[quad], ec/quads[quad].
+
+Containers are written either as HDF5 (.h5) or in a raw little-endian format
+(.bin) laid out as:
+
+    8 bytes     magic "DBMESH01"
+    8 bytes     uint64 length of the JSON header
+    header      JSON {"attributes": {...}, "datasets": {name: {"dtype", "shape", "offset"}}}
+    data        the datasets in C order, each starting at an 8-byte aligned file offset
+"""
+
+import os
+import json
+import collections
+import numpy
+import h5py
+
+rawMagic = b"DBMESH01"
+
+# A dataset written block by block: its full shape and dtype, and an iterable of
+# arrays that make up the dataset along its first dimension.
+StreamedDataset = collections.namedtuple("StreamedDataset", ["shape", "dtype", "blocks"])
+
+def interleavedBlocks(datasets):
+    """ Yield (name, block) pairs of the streamed datasets, taking one block of
+        each dataset in turn. Datasets whose blocks are split from one source,
+        e.g. with itertools.tee, are then consumed in step and the source is
+        iterated once without holding more than a block of each.
+    """
+    streams = collections.OrderedDict((name, iter(data.blocks)) for name, data in datasets.items()
+                                      if isinstance(data, StreamedDataset))
+    while len(streams) > 0:
+        for name in list(streams.keys()):
+            block = next(streams[name], None)
+            if block is None:
+                del streams[name]
+            else:
+                yield name, block
+
+def writeHdf5Container(fileName, datasets, attributes):
+    h5File = h5py.File(fileName, 'w')
+    for name, data in datasets.items():
+        if isinstance(data, StreamedDataset):
+            h5File.create_dataset(name, data.shape, data.dtype)
+        else:
+            h5File.create_dataset(name, data=data)
+
+    written = dict((name, 0) for name in datasets.keys())
+    for name, block in interleavedBlocks(datasets):
+        h5File[name][written[name]:written[name] + block.shape[0]] = block
+        written[name] += block.shape[0]
+
+    for name, value in attributes.items():
+        h5File.attrs[name] = value
+    h5File.close()
+
+def writeRawContainer(fileName, datasets, attributes):
+    # Little-endian copies of the datasets.
+    def littleEndian(data):
+        if isinstance(data, StreamedDataset):
+            return data._replace(dtype=numpy.dtype(data.dtype).newbyteorder('<'))
+        return numpy.ascontiguousarray(data, dtype=numpy.asarray(data).dtype.newbyteorder('<'))
+
+    datasets = collections.OrderedDict((name, littleEndian(data)) for name, data in datasets.items())
+
+    def numBytes(data):
+        return int(numpy.prod(data.shape)) * numpy.dtype(data.dtype).itemsize
+
+    # The header size depends on the offsets, so place the data after a header
+    # laid out with the largest offsets it could need.
+    def layout(dataOffset):
+        entries = collections.OrderedDict()
+        offset = dataOffset
+        for name, data in datasets.items():
+            entries[name] = {"dtype": numpy.dtype(data.dtype).str, "shape": list(data.shape), "offset": offset}
+            offset += (numBytes(data) + 7) // 8 * 8
+        return entries, offset
+
+    def header(dataOffset):
+        return json.dumps({"attributes": attributes, "datasets": dict(layout(dataOffset)[0])}).encode()
+
+    headerLength = len(header(2 ** 62))
+    dataOffset = (16 + headerLength + 7) // 8 * 8
+    headerBytes = header(dataOffset).ljust(dataOffset - 16)
+    entries, fileSize = layout(dataOffset)
+
+    with open(fileName, 'wb') as f:
+        f.write(rawMagic)
+        f.write(numpy.array([len(headerBytes)], dtype='<u8').tobytes())
+        f.write(headerBytes)
+        for name, data in datasets.items():
+            if not isinstance(data, StreamedDataset):
+                f.seek(entries[name]["offset"])
+                f.write(data.tobytes())
+
+        # Streamed blocks go to the end of what is written of their dataset.
+        written = dict((name, entry["offset"]) for name, entry in entries.items())
+        for name, block in interleavedBlocks(datasets):
+            blockBytes = numpy.ascontiguousarray(block, dtype=datasets[name].dtype).tobytes()
+            f.seek(written[name])
+            f.write(blockBytes)
+            written[name] += len(blockBytes)
+
+        # The padding of the last dataset.
+        f.truncate(fileSize)
+
+def readRawHeader(fileName):
+    with open(fileName, 'rb') as f:
+        assert f.read(8) == rawMagic, "%s is not a raw mesh container." % fileName
+        headerLength = int(numpy.frombuffer(f.read(8), dtype='<u8')[0])
+        return json.loads(f.read(headerLength).decode())
+
+def writeContainer(fileName, datasets, attributes, containerFormat = 'hdf5'):
+    """ Write the datasets (arrays or StreamedDatasets) and integer attributes
+        to fileName with the .h5 or .bin extension added for the 'hdf5' or
+        'raw' format. Returns the name of the written file.
+    """
+    attributes = dict((name, int(value)) for name, value in attributes.items())
+
+    if containerFormat == 'hdf5':
+        fileName += ".h5"
+        writeHdf5Container(fileName, datasets, attributes)
+    elif containerFormat == 'raw':
+        fileName += ".bin"
+        writeRawContainer(fileName, datasets, attributes)
+    else:
+        raise ValueError("Unknown container format '%s', expected 'hdf5' or 'raw'." % containerFormat)
+
+    return fileName
+
+def readBlock(fileName, name, index):
+    """ Read dataset[index] from a container with one contiguous read, as a
+        solver rank reads the cells of its own quad.
+    """
+    if os.path.splitext(fileName)[1] == ".h5":
+        with h5py.File(fileName, 'r') as h5File:
+            return h5File[name][index]
+
+    entry = readRawHeader(fileName)["datasets"][name]
+    dtype = numpy.dtype(entry["dtype"])
+    blockShape = entry["shape"][1:]
+    blockSize = int(numpy.prod(blockShape)) * dtype.itemsize
+
+    with open(fileName, 'rb') as f:
+        f.seek(entry["offset"] + index * blockSize)
+        return numpy.frombuffer(f.read(blockSize), dtype=dtype).reshape(blockShape)
+
+def usage():
+    print("This module provides binary mesh container helpers to be imported by the mesh export scripts.")
+
+if __name__ == '__main__':
+    print("Starting", os.path.basename(__file__))
+    usage()
+    print("Exiting", os.path.basename(__file__))
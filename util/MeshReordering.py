@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Closed-form reordering of structured quad meshes for the legacy Coupled Cells code.
+
+The legacy exporters traverse the rings of a branch in reverse order and, for
+EC and SMC meshes, the rows of cells within each quad in reverse order. The
+reordered cells are then renumbered so that neighbouring cells share their
+vertices. Both steps depend only on the mesh dimensions, so they are computed
+here once as NumPy index arrays and applied to the whole mesh in one go.
+"""
+
+import os
+import hashlib
+import numpy
+import vtk
+from vtk.util import numpy_support
+from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
+
+# Cache reordering permutations on disk next to the task mesh.
+permutationCache = True
+
+def reorderPermutation(numRings, numQuadsPerRing, numRowsPerQuad = 1, numCellsPerRow = 1):
+    """ Original (branch-local) cell ids in the order the legacy exporters visit them:
+        rings in reverse order, quads in normal order, rows of cells in reverse
+        order and cells within a row in normal order.
+    """
+    rings = numpy.arange(numRings, dtype=numpy.int64)[::-1]
+    quads = numpy.arange(numQuadsPerRing, dtype=numpy.int64)
+    rows = numpy.arange(numRowsPerQuad, dtype=numpy.int64)[::-1]
+    cells = numpy.arange(numCellsPerRow, dtype=numpy.int64)
+
+    quadIds = rings[:, None] * numQuadsPerRing + quads[None, :]
+    rowIds = quadIds[:, :, None] * numRowsPerQuad + rows[None, None, :]
+    cellIds = rowIds[:, :, :, None] * numCellsPerRow + cells[None, None, None, :]
+
+    return cellIds.ravel()
+
+def topologyKey(taskMesh):
+    """ Hash of the task mesh topology: its connectivity and, where present, the
+        "branchId" and "gridCoords" cell arrays.
+    """
+    key = hashlib.sha1()
+    key.update(numpy.ascontiguousarray(quadConnectivity(taskMesh.GetPolys()), dtype=numpy.int64).tobytes())
+
+    for arrayName in ["branchId", "gridCoords"]:
+        if taskMesh.GetCellData().HasArray(arrayName):
+            key.update(numpy.ascontiguousarray(numpy_support.vtk_to_numpy(taskMesh.GetCellData().GetArray(arrayName))).tobytes())
+
+    return key.hexdigest()
+
+def loadPermutation(taskMeshFile, taskMeshKey, numRings, numQuadsPerRing, numRowsPerQuad = 1, numCellsPerRow = 1):
+    """ reorderPermutation for the given dimensions, loaded from the cache next to
+        the task mesh. The cache entry is recomputed if it is missing or was
+        written for a different task mesh topology, as given by the topologyKey
+        of the task mesh (see BranchTopology, which keeps it with the analysis).
+    """
+    dimensions = (int(numRings), int(numQuadsPerRing), int(numRowsPerQuad), int(numCellsPerRow))
+
+    if permutationCache == False:
+        return reorderPermutation(*dimensions)
+
+    cacheFile = os.path.splitext(taskMeshFile)[0] + ".reorder_%d_%d_%d_%d.npz" % dimensions
+
+    key = hashlib.sha1()
+    key.update(numpy.asarray(dimensions, dtype=numpy.int64).tobytes())
+    key.update(taskMeshKey.encode())
+    key = key.hexdigest()
+
+    if os.path.isfile(cacheFile):
+        with numpy.load(cacheFile) as cached:
+            if str(cached["key"]) == key:
+                return cached["permutation"]
+        print("Permutation cache", cacheFile, "is stale, recomputing ...")
+
+    permutation = reorderPermutation(*dimensions)
+
+    try:
+        with open(cacheFile, 'wb') as f:
+            numpy.savez(f, permutation=permutation, key=numpy.array(key))
+    except (IOError, OSError) as e:
+        print("Could not write permutation cache", cacheFile, ":", e)
+
+    return permutation
+
+def blockSources(numRows, numCols):
+    """ Source (cell, point position) pairs for every point of one reordered
+        numRows x numCols block, in the order the points are inserted.
+
+        The first row inserts all four points of its first cell followed by
+        points 1 and 2 of every other cell. Every following row inserts points
+        0 and 1 of its first cell followed by point 1 of every other cell.
+    """
+    firstCells = numpy.concatenate((numpy.zeros(4, dtype=numpy.int64),
+                                    numpy.repeat(numpy.arange(1, numCols, dtype=numpy.int64), 2)))
+    firstPositions = numpy.concatenate((numpy.arange(4, dtype=numpy.int64),
+                                        numpy.tile(numpy.array([1, 2], dtype=numpy.int64), numCols - 1)))
+
+    rowCells = numpy.concatenate((numpy.zeros(1, dtype=numpy.int64), numpy.arange(numCols, dtype=numpy.int64)))
+    rowPositions = numpy.concatenate((numpy.zeros(1, dtype=numpy.int64), numpy.ones(numCols, dtype=numpy.int64)))
+
+    rowOffsets = numpy.arange(1, numRows, dtype=numpy.int64) * numCols
+    otherCells = (rowOffsets[:, None] + rowCells[None, :]).ravel()
+    otherPositions = numpy.tile(rowPositions, numRows - 1)
+
+    return (numpy.concatenate((firstCells, otherCells)),
+            numpy.concatenate((firstPositions, otherPositions)))
+
+def blockConnectivity(numRows, numCols):
+    """ Point ids (numRows * numCols, 4) of the cells in one reordered block,
+        relative to the first point of the block.
+    """
+    cols = numpy.arange(numCols + 1, dtype=numpy.int64)
+
+    # Ids of the two edges of the first row: points 0/1 and points 3/2 of its cells.
+    firstBottom = 2 * cols
+    firstBottom[1] = 1
+    firstTop = 2 * cols + 1
+    firstTop[0] = 3
+    firstTop[1] = 2
+
+    # Every following row inserts a single edge of numCols + 1 points.
+    rowStart = 2 * (numCols + 1) + numpy.arange(numRows - 1, dtype=numpy.int64) * (numCols + 1)
+    rows = numpy.vstack((firstBottom, rowStart[:, None] + cols[None, :]))
+
+    quads = numpy.empty((numRows, numCols, 4), dtype=numpy.int64)
+
+    quads[0, :, 0] = firstBottom[:-1]
+    quads[0, :, 1] = firstBottom[1:]
+    quads[0, :, 2] = firstTop[1:]
+    quads[0, :, 3] = firstTop[:-1]
+
+    # The far edge of each row is the near edge of the row inserted before it.
+    quads[1:, :, 0] = rows[1:, :-1]
+    quads[1:, :, 1] = rows[1:, 1:]
+    quads[1:, :, 2] = rows[:-1, 1:]
+    quads[1:, :, 3] = rows[:-1, :-1]
+
+    return quads.reshape(-1, 4)
+
+def reorderBlocks(points, quads, cellIds, numBlocks, numRows, numCols):
+    """ Build the reordered points and cells for numBlocks consecutive blocks.
+
+        points  -- (N, 3) array of the original points.
+        quads   -- (M, 4) array of the original cell point ids.
+        cellIds -- original cell ids in the reordered order, numBlocks * numRows * numCols of them.
+    """
+    numCellsPerBlock = numRows * numCols
+    numPointsPerBlock = (numRows + 1) * (numCols + 1)
+
+    sourceCells, sourcePositions = blockSources(numRows, numCols)
+    blockOffsets = numpy.arange(numBlocks, dtype=numpy.int64)
+
+    sourceCells = (blockOffsets[:, None] * numCellsPerBlock + sourceCells[None, :]).ravel()
+    sourcePositions = numpy.tile(sourcePositions, numBlocks)
+    pointIds = quads[cellIds[sourceCells], sourcePositions]
+
+    # vtkPoints stores single precision coordinates by default.
+    newPoints = numpy.asarray(points)[pointIds].astype(numpy.float32)
+
+    newQuads = blockConnectivity(numRows, numCols)
+    newQuads = (blockOffsets[:, None, None] * numPointsPerBlock + newQuads[None, :, :]).reshape(-1, 4)
+
+    return newPoints, newQuads
+
+class RingStreamSource(VTKPythonAlgorithmBase):
+    """ VTK source producing the reordered cells of a branch a few rings of quads
+        at a time. Each piece requested downstream is a contiguous range of the
+        reordered rings with point ids relative to that range, so a writer with
+        NumberOfPieces set to the number of rings streams the branch to disk
+        holding a single reordered ring in memory.
+
+        points, quads -- original points and (M, 4) cell point ids of the branch.
+        permutation   -- original cell ids in the reordered order (see reorderPermutation).
+    """
+    def __init__(self, points, quads, permutation, numQuadsPerRing, numRowsPerQuad, numCellsPerRow):
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType='vtkPolyData')
+
+        self.points = points
+        self.quads = quads
+        self.permutation = permutation
+        self.numQuadsPerRing = numQuadsPerRing
+        self.numRowsPerQuad = numRowsPerQuad
+        self.numCellsPerRow = numCellsPerRow
+
+        self.numCellsPerRing = numQuadsPerRing * numRowsPerQuad * numCellsPerRow
+        self.numRings = permutation.shape[0] // self.numCellsPerRing
+
+    def ringRange(self, firstRing, lastRing):
+        """ Reordered points and cells of the reordered rings [firstRing, lastRing). """
+        cellIds = self.permutation[firstRing * self.numCellsPerRing:lastRing * self.numCellsPerRing]
+        return reorderBlocks(self.points, self.quads, cellIds, (lastRing - firstRing) * self.numQuadsPerRing,
+                             self.numRowsPerQuad, self.numCellsPerRow)
+
+    def rings(self):
+        """ Yield the reordered points and cells one ring at a time. """
+        for ringNum in range(self.numRings):
+            yield self.ringRange(ringNum, ringNum + 1)
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        info = outInfo.GetInformationObject(0)
+        if hasattr(vtk.vtkAlgorithm, "CAN_HANDLE_PIECE_REQUEST"):
+            info.Set(vtk.vtkAlgorithm.CAN_HANDLE_PIECE_REQUEST(), 1)
+        else:
+            info.Set(vtk.vtkStreamingDemandDrivenPipeline.MAXIMUM_NUMBER_OF_PIECES(), -1)
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        info = outInfo.GetInformationObject(0)
+        piece = info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_PIECE_NUMBER())
+        numPieces = info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_NUMBER_OF_PIECES())
+
+        newPoints, newQuads = self.ringRange(piece * self.numRings // numPieces,
+                                             (piece + 1) * self.numRings // numPieces)
+
+        output = vtk.vtkPolyData.GetData(outInfo)
+        output.ShallowCopy(quadsToPolyData(newPoints, newQuads))
+        return 1
+
+def quadConnectivity(cellArray):
+    """ Point ids (M, 4) of a vtkCellArray made up of quads only. """
+    if vtk.vtkVersion().GetVTKMajorVersion() > 8:
+        connectivity = numpy_support.vtk_to_numpy(cellArray.GetConnectivityArray())
+        assert connectivity.shape[0] == 4 * cellArray.GetNumberOfCells(), "Only quad cells are supported."
+        return connectivity.reshape(-1, 4)
+
+    legacyCells = numpy_support.vtk_to_numpy(cellArray.GetData()).reshape(-1, 5)
+    assert (legacyCells[:, 0] == 4).all(), "Only quad cells are supported."
+    return legacyCells[:, 1:]
+
+def branchSlice(mesh, label, numCellsPerLabel, arrayNames = [], numLabels = 1):
+    """ Zero-copy NumPy views of a contiguous block of branches.
+
+        The cells of each label are stored contiguously, label after label, so the
+        cells of labels [label, label + numLabels) are the cell range
+        [label * numCellsPerLabel, (label + numLabels) * numCellsPerLabel). This
+        replaces running vtkExtractSelection over that range of indices.
+
+        Returns the points of the mesh, the (M, 4) point ids of the cells in the
+        range (None for meshes without polygons) and a dictionary of the
+        requested cell data arrays for the range.
+    """
+    begin = int(label * numCellsPerLabel)
+    end = int((label + numLabels) * numCellsPerLabel)
+    assert end <= mesh.GetNumberOfCells(), "Cell range [%d, %d) is out of bounds for %d cells." % (begin, end, mesh.GetNumberOfCells())
+
+    points = numpy_support.vtk_to_numpy(mesh.GetPoints().GetData())
+    # ATP maps are made up of vertices, they only carry cell data.
+    quads = None
+    if mesh.GetNumberOfPolys() > 0:
+        quads = quadConnectivity(mesh.GetPolys())[begin:end]
+
+    cellData = {}
+    for arrayName in arrayNames:
+        cellData[arrayName] = numpy_support.vtk_to_numpy(mesh.GetCellData().GetArray(arrayName))[begin:end]
+
+    return points, quads, cellData
+
+def buildCellArray(offsets, connectivity):
+    """ Create a vtkCellArray from the offsets (number of cells + 1) of the cells
+        into their concatenated point ids.
+    """
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+    connectivity = numpy.ascontiguousarray(connectivity, dtype=numpy.int64).ravel()
+
+    cellArray = vtk.vtkCellArray()
+    if vtk.vtkVersion().GetVTKMajorVersion() > 8:
+        # Same 64-bit storage vtkCellArray uses when cells are inserted one at a time.
+        cellArray.SetData(numpy_support.numpy_to_vtk(offsets, deep=True, array_type=vtk.VTK_TYPE_INT64),
+                          numpy_support.numpy_to_vtk(connectivity, deep=True, array_type=vtk.VTK_TYPE_INT64))
+    else:
+        # Legacy layout, the number of points of every cell before its point ids.
+        sizes = numpy.diff(offsets)
+        legacyCells = numpy.empty(sizes.shape[0] + connectivity.shape[0], dtype=numpy.int64)
+        sizePositions = offsets[:-1] + numpy.arange(sizes.shape[0])
+        legacyCells[sizePositions] = sizes
+        legacyCells[numpy.delete(numpy.arange(legacyCells.shape[0]), sizePositions)] = connectivity
+        cellArray.SetCells(sizes.shape[0], numpy_support.numpy_to_vtkIdTypeArray(legacyCells, deep=True))
+
+    return cellArray
+
+def quadsToPolyData(points, quads):
+    """ Create a vtkPolyData object from (N, 3) points and (M, 4) quad point ids. """
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_support.numpy_to_vtk(numpy.ascontiguousarray(points, dtype=numpy.float32), deep=True))
+
+    cellArray = buildCellArray(numpy.arange(0, 4 * quads.shape[0] + 1, 4, dtype=numpy.int64), quads)
+
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(vtkPoints)
+    polyData.SetPolys(cellArray)
+
+    return polyData
+
+def polyDataToString(polyData):
+    """ Serialise a vtkPolyData object the way vtkXMLPolyDataWriter writes it to disk. """
+    # The writer caches array ranges as information keys, so write a copy to
+    # leave the mesh that is written to disk later untouched.
+    polyDataCopy = vtk.vtkPolyData()
+    polyDataCopy.DeepCopy(polyData)
+
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetInputData(polyDataCopy)
+    writer.WriteToOutputStringOn()
+    writer.Write()
+    return writer.GetOutputString()
+
+def assertIdentical(polyData, referencePolyData, what):
+    """ Check two meshes serialise to byte-identical XML. """
+    assert polyDataToString(polyData) == polyDataToString(referencePolyData), \
+        "Reordered %s differs from the reference loop output." % what
+    print("Reordered", what, "is identical to the reference loop output ...")
+
+def usage():
+    print("This module provides reordering helpers to be imported by the mesh export scripts.")
+
+if __name__ == '__main__':
+    print("Starting", os.path.basename(__file__))
+    usage()
+    print("Exiting", os.path.basename(__file__))
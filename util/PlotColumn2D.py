@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 """
 Read SMC Ca2+ values from a line of cells in temporal series and produce a 2D plot
+
+The values of every time-step are streamed into a (cells, time-steps) float32
+array memory-mapped to kymographFile, so series of any length are read in
+constant memory. The plot is rendered off-screen to a .png file.
 """
 import re
 import os
-import vtk
 import numpy
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import XMLDataArrayReader
 
-print 'Importing ', __file__
+print('Importing ', __file__)
 
 def tryInt(s):
     try:
@@ -35,84 +41,119 @@ xMax = -1
 yMin = 0
 yMax = -1
 
-def plotColumn2D(fileList):
-    # Report our CWD just for testing purposes.
-    print "CWD:", os.getcwd()
+# The .npy file the kymograph is memory-mapped to, defaults to the figure name
+# with the .npy extension. It is kept for renderKymograph.
+kymographFile = None
 
-    global splitPos
-    global xMax
-    global yMax
+# Number of time-steps gathered in memory before they are written to the
+# kymograph as one block of columns.
+blockSize = 256
 
-    sortNicely(fileList)
+# Maximum number of time-step columns drawn, longer series are decimated by
+# drawing every n-th time-step. With 0 all time-steps are drawn.
+maxColumns = 4000
+
+def rowPermutation(numCells):
+    """ Index array taking the cell values of a file to the plotted rows: the
+        branches spliced at splitPos and the row reversed, to fix the crooked
+        backwards ordering in the output data.
+    """
+    split = splitPos
+    if isinstance(split, str):
+        if split != 'mid':
+            raise ValueError("Can't split row with splitPos = '%s'." % split)
+        split = numCells // 2
+
+    return numpy.concatenate((numpy.arange(split, numCells), numpy.arange(split)))[::-1]
+
+def buildKymograph(fileList, fileName):
+    """ Stream the first cell data array of every file into a (cells, files)
+        float32 array memory-mapped to fileName and return it.
+    """
+    firstFile = os.path.abspath(fileList[0])
+    arrayName = XMLDataArrayReader.dataArrayNames(firstFile)[0]
+    numCells = XMLDataArrayReader.readDataArray(firstFile, arrayName).shape[0]
+
+    permutation = rowPermutation(numCells)
 
-    allRows = []
+    kymograph = numpy.lib.format.open_memmap(fileName, mode='w+', dtype=numpy.float32, shape=(numCells, len(fileList)))
+    block = numpy.empty((numCells, max(1, blockSize)), dtype=numpy.float32)
 
-    for file in fileList:
-        print 'Reading', file
+    for blockStart in range(0, len(fileList), block.shape[1]):
+        blockFiles = fileList[blockStart:blockStart + block.shape[1]]
 
-        file_name = os.path.abspath(file)
-        reader = vtk.vtkXMLUnstructuredGridReader()
-        reader.SetFileName(file_name)
-        reader.Update()
-        data = reader.GetOutput().GetCellData().GetArray(0)
+        for column, file in enumerate(blockFiles):
+            print('Reading', file)
 
-        row = []
-        for i in range(data.GetNumberOfTuples()):
-            row.append(data.GetValue(i))
+            # Only the first cell data array is read out of the file.
+            block[:, column] = XMLDataArrayReader.readDataArray(os.path.abspath(file), arrayName)[permutation]
 
-        # Fix the crooked backwards ordering in the output data. Sigh...
-        # Also, splice the branches.
-        if isinstance(splitPos, str):
-            if splitPos == 'mid':
-                splitPos = len(row) / 2
-            else:
-                print 'Can\'t split row with splitPos =', splitPos
-                return
+        kymograph[:, blockStart:blockStart + len(blockFiles)] = block[:, :len(blockFiles)]
 
-        r1 = row[:splitPos]
-        r2 = row[len(r1):]
-        row = r2 + r1
+    kymograph.flush()
+    return kymograph
 
-        # Plot in ascending order.
-        row.reverse()
+def renderKymograph(kymograph, figName):
+    """ Plot a (cells, time-steps) kymograph to figName + '.png'. """
+    numCells, numSteps = kymograph.shape
 
-        allRows.append(row)
+    step = 1
+    if maxColumns > 0 and numSteps > maxColumns:
+        step = -(-numSteps // maxColumns)
+        print('Drawing every', step, 'of', numSteps, 'time-steps')
 
-    array2D = numpy.array(allRows)
-    array2D = numpy.transpose(array2D)
+    # The drawn columns keep their time-step coordinates, each spanning the
+    # time-steps up to the next drawn one.
+    xEdges = numpy.append(numpy.arange(0, numSteps, step), numSteps)
+    yEdges = numpy.arange(numCells + 1)
 
-    plt.pcolormesh(array2D, vmin=0.0, vmax=1.0)
+    # Off-screen figure, independent of the pyplot state and backend.
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.gca()
+
+    mesh = axes.pcolormesh(xEdges, yEdges, numpy.asarray(kymograph[:, ::step]), vmin=0.0, vmax=1.0)
 
     if yLine != None:
-        plt.axhline(yLine, color='r')
+        axes.axhline(yLine, color='r')
 
-    figName = os.path.split(os.getcwd())[1]
-#    plt.title(figName)
-    plt.xlabel('Time (sec.)')
-    plt.ylabel('Cell (ord.)')
-    plt.colorbar()
-    # plt.axis([0, array2D.shape[1], 0, array2D.shape[0]])
+    axes.set_xlabel('Time (sec.)')
+    axes.set_ylabel('Cell (ord.)')
+    figure.colorbar(mesh)
+
+    axes.set_xlim((xMin, numSteps if xMax == -1 else xMax))
+    axes.set_ylim((yMin, numCells if yMax == -1 else yMax))
+    figure.tight_layout()
+
+    figure.savefig(figName + '.png', bbox_inches='tight', dpi=400)
+    print('Saved', figName + '.png')
+
+def plotColumn2D(fileList):
+    # Report our CWD just for testing purposes.
+    print("CWD:", os.getcwd())
 
-    if xMax == -1:
-        xMax = array2D.shape[1]
-    if yMax == -1:
-        yMax = array2D.shape[0]
+    sortNicely(fileList)
 
-    plt.xlim((xMin, xMax))
-    plt.ylim((yMin, yMax))
-    plt.tight_layout()
+    if len(fileList) == 0:
+        print('No files to process...')
+        return
 
+    figName = os.path.split(os.getcwd())[1]
     if suffix != '':
         figName = figName + '.' + suffix
     figName = figName.replace('.', '-')
 
-    plt.savefig(figName + '.png', bbox_inches='tight', dpi=400)
-    plt.show()
+    fileName = kymographFile
+    if fileName == None:
+        fileName = figName + '.npy'
+
+    kymograph = buildKymograph(fileList, fileName)
+    renderKymograph(kymograph, figName)
 
 def usage():
-    print "This script is to be run with global parameters (input files, splitPos, yMin, yMax) set in the calling script."
+    print("This script is to be run with global parameters (input files, splitPos, yMin, yMax) set in the calling script.")
 
 if __name__ == '__main__':
-    print "Starting", os.path.basename(__file__)
+    print("Starting", os.path.basename(__file__))
     usage()
-    print "Exiting", os.path.basename(__file__)
+    print("Exiting", os.path.basename(__file__))
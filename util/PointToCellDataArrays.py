@@ -1,52 +1,281 @@
 '''
 This script looks through a directory of .vtp files and converts the point
 data to cell data for them all. The output is in a new directory.
+
+Run it as a script with the input and output directories and the arrays to
+keep, e.g.
+
+    python PointToCellDataArrays.py cfd/ converted/ --cell-arrays ATP tau --workers 8
+
+or set the global parameters in a calling script and call pointToCellData.
 '''
 
 import glob
 import os
+import sys
+import argparse
+import collections
+import concurrent.futures
+import h5py
 import vtk
+from vtk.util import numpy_support
 
-# This should really expect a directory as a parameter.
+import PointToCellOperator
+import XMLDataArrayReader
 
-def pointToCellData():
-    
-    atpFiles = sorted(glob.glob('*.vtp'))
-    
-    if not atpFiles:
-        exit("No atp files found")
+# These parameters are to be set in the calling script or on the command line.
+inputDir = '.'
+outputDir = '.'
+outputPrefix = '_'
+
+# Point data arrays converted to cell data, None for all of them but those in
+# dropCellArrays. The cell data arrays of the input are always kept.
+cellArrays = None
+dropCellArrays = ['p']
+
+# Point data arrays passed through unchanged, None for all of them but those in
+# dropPointArrays.
+pointArrays = None
+dropPointArrays = ['ATP', 'tau']
+
+# Write only the converted cell arrays of every file, as datasets of a
+# <outputPrefix><name>.h5 file, and the geometry once to geometryFile. The
+# geometry is the same in every time-step.
+cellArraysOnly = False
+geometryFile = 'geometry.vtp'
+
+# Average the point data with a PointToCellOperator built once for the mesh of
+# the first file and kept in operatorFile in the output directory. The meshes
+# of all files are taken to be the same. With False every file goes through
+# vtkPointDataToCellData.
+useOperator = True
+operatorFile = 'pointToCell.npz'
+
+# The operator of the current conversion, set by pointToCellData.
+operator = None
+
+# Number of worker processes converting the files. With 0 or 1 the files are
+# converted in this process.
+numWorkers = 0
+
+def readPolyData(inputFile):
+    reader = vtk.vtkXMLPolyDataReader()
+    reader.SetFileName(inputFile)
+    reader.Update()
+    return reader.GetOutput()
 
-    for inputFile in atpFiles: 
+def writePolyData(dataset, outputFile):
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetInputData(dataset)
+    writer.SetFileName(outputFile)
+    writer.Update()
 
-        print('Reading', inputFile)
-        atpReader = vtk.vtkXMLPolyDataReader()
-        atpReader.SetFileName(inputFile)
-        atpReader.Update()
+def arrayNames(data):
+    return [data.GetArrayName(i) for i in range(data.GetNumberOfArrays())]
 
-        atpDataset = atpReader.GetOutput()
-        
+def convertedArrayNames(pointNames):
+    """ The point data arrays to convert, in point data order. """
+    if cellArrays == None:
+        return [name for name in pointNames if name not in dropCellArrays]
+    return [name for name in pointNames if name in cellArrays]
+
+def keptPointArrayNames(pointNames):
+    """ The point data arrays passed through, in point data order. """
+    if pointArrays == None:
+        return [name for name in pointNames if name not in dropPointArrays]
+    return [name for name in pointNames if name in pointArrays]
+
+def averagePointData(dataset, cellNames, pointToCellOperator):
+    """ The dataset with its point and cell data and the cellNames point data
+        arrays averaged to cell data by the operator, as vtkPointDataToCellData
+        would.
+    """
+    pointData = dataset.GetPointData()
+
+    convertedData = vtk.vtkPolyData()
+    convertedData.CopyStructure(dataset)
+    convertedData.GetPointData().PassData(pointData)
+    convertedData.GetCellData().PassData(dataset.GetCellData())
+    convertedData.GetFieldData().PassData(dataset.GetFieldData())
+
+    for i, name in enumerate(arrayNames(pointData)):
+        if pointData.GetAbstractArray(i).IsNumeric() == 0 or name not in cellNames:
+            continue
+
+        convertedData.GetCellData().AddArray(pointToCellOperator.ApplyArray(pointData.GetArray(i)))
+
+        # The converted arrays keep their attribute, e.g. the active scalars.
+        attribute = pointData.IsArrayAnAttribute(i)
+        if attribute >= 0:
+            convertedData.GetCellData().SetActiveAttribute(name, attribute)
+
+    return convertedData
+
+def convertPointData(dataset, pointToCellOperator = None):
+    """ The dataset with the point data arrays selected by cellArrays converted
+        to cell data, next to its own cell data, and the point data arrays
+        selected by pointArrays passed through. The point data is averaged by
+        the operator if one is given, else by vtkPointDataToCellData.
+    """
+    pointNames = arrayNames(dataset.GetPointData())
+    cellNames = convertedArrayNames(pointNames)
+
+    if pointToCellOperator != None:
+        convertedData = averagePointData(dataset, cellNames, pointToCellOperator)
+    else:
         pointToCell = vtk.vtkPointDataToCellData()
-        pointToCell.SetInputData(atpDataset)
+        pointToCell.SetInputData(dataset)
         pointToCell.PassPointDataOn()
         pointToCell.Update()
-        
         convertedData = pointToCell.GetOutput()
-        
-        # Remove the point data arrays, they exist as cell data.
-        convertedData.GetPointData().RemoveArray('ATP')
-        convertedData.GetPointData().RemoveArray('tau')
-        convertedData.GetCellData().RemoveArray('p')
-    
-        atpWriter = vtk.vtkXMLPolyDataWriter()
-        atpWriter.SetInputData(convertedData)
-        atpWriter.SetFileName("_" + inputFile)
-        atpWriter.Update()
 
+        # All arrays are averaged, so that the cell data keeps the array order
+        # and attributes of the filter. Only the input cell data arrays are
+        # kept next to the selected ones.
+        inputCellNames = arrayNames(dataset.GetCellData())
+        for name in pointNames:
+            if name not in cellNames and name not in inputCellNames:
+                convertedData.GetCellData().RemoveArray(name)
+
+    keptNames = keptPointArrayNames(pointNames)
+    for name in pointNames:
+        if name not in keptNames:
+            convertedData.GetPointData().RemoveArray(name)
+
+    return convertedData
+
+def outputName(inputFile, extension):
+    baseName = os.path.splitext(os.path.basename(inputFile))[0]
+    return os.path.join(outputDir, outputPrefix + baseName + extension)
+
+def writeCellArrays(arrays, outputFile):
+    """ Write named arrays as datasets of an HDF5 file. """
+    with h5py.File(outputFile, 'w') as h5File:
+        for name, data in arrays.items():
+            h5File.create_dataset("/" + name, data=data)
+
+def averagedCellArrays(inputFile):
+    """ The converted cell arrays of a file, averaged by the operator from the
+        point data arrays read straight out of the file.
+    """
+    names = convertedArrayNames(XMLDataArrayReader.dataArrayNames(inputFile, "PointData"))
+    pointData = XMLDataArrayReader.readDataArrays(inputFile, names, "PointData")
+    return collections.OrderedDict((name, operator.Apply(data)) for name, data in pointData.items())
+
+def convertFile(inputFile):
+    """ Convert one file and write it to the output directory. Returns the name
+        of the written file.
+    """
+    if cellArraysOnly:
+        outputFile = outputName(inputFile, '.h5')
+        if operator != None:
+            writeCellArrays(averagedCellArrays(inputFile), outputFile)
+        else:
+            dataset = readPolyData(inputFile)
+            cellData = convertPointData(dataset).GetCellData()
+            names = convertedArrayNames(arrayNames(dataset.GetPointData()))
+            writeCellArrays(collections.OrderedDict((name, numpy_support.vtk_to_numpy(cellData.GetArray(name))) for name in names if cellData.GetArray(name) != None), outputFile)
+    else:
+        convertedData = convertPointData(readPolyData(inputFile), operator)
+        outputFile = outputName(inputFile, '.vtp')
+        writePolyData(convertedData, outputFile)
+
+    return outputFile
+
+def writeGeometry(dataset):
+    """ Write the geometry of a dataset without its data arrays to geometryFile
+        in the output directory.
+    """
+    geometry = vtk.vtkPolyData()
+    geometry.CopyStructure(dataset)
+
+    outputFile = os.path.join(outputDir, geometryFile)
+    print('Writing', outputFile)
+    writePolyData(geometry, outputFile)
+
+def initWorker(args):
+    """ Set the parameters of the calling script in a worker process. """
+    global outputDir, outputPrefix, cellArrays, dropCellArrays, pointArrays, dropPointArrays, cellArraysOnly, operator
+    outputDir, outputPrefix, cellArrays, dropCellArrays, pointArrays, dropPointArrays, cellArraysOnly, operator = args
+
+def convertFiles(atpFiles):
+    """ Convert the files, in a pool of numWorkers processes, and yield the names
+        of the written files in order.
+    """
+    if numWorkers <= 1:
+        for inputFile in atpFiles:
+            yield convertFile(inputFile)
+        return
+
+    args = (outputDir, outputPrefix, cellArrays, dropCellArrays, pointArrays, dropPointArrays, cellArraysOnly, operator)
+    with concurrent.futures.ProcessPoolExecutor(numWorkers, initializer=initWorker, initargs=(args,)) as executor:
+        for outputFile in executor.map(convertFile, atpFiles, chunksize=4):
+            yield outputFile
+
+def pointToCellData():
+    global operator
+
+    atpFiles = sorted(glob.glob(os.path.join(inputDir, '*.vtp')))
+
+    if not atpFiles:
+        exit("No atp files found")
+
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+
+    firstDataset = None
+    if cellArraysOnly or useOperator:
+        firstDataset = readPolyData(atpFiles[0])
+
+    if cellArraysOnly:
+        writeGeometry(firstDataset)
+
+    operator = None
+    if useOperator:
+        operator = PointToCellOperator.loadOperator(firstDataset, os.path.join(outputDir, operatorFile))
+
+    if numWorkers > 1:
+        print('Converting', len(atpFiles), 'files with', numWorkers, 'worker processes ...')
+
+    for inputFile, outputFile in zip(atpFiles, convertFiles(atpFiles)):
+        print('Converted', inputFile, 'to', outputFile)
 
 def usage():
-    print('This script is to be run with global parameters (angle) set in the calling script.')
+    print('This script is to be run with global parameters (input and output directories, arrays to keep) set in the calling script or on the command line.')
+
+def main():
+    global inputDir, outputDir, outputPrefix, cellArrays, dropCellArrays, pointArrays, dropPointArrays, cellArraysOnly, useOperator, numWorkers
+
+    argParser = argparse.ArgumentParser(description='Convert the point data of a directory of .vtp files to cell data.')
+    argParser.add_argument('inputDir', help='Directory of the input .vtp files')
+    argParser.add_argument('outputDir', help='Directory for the converted files, created if missing')
+    argParser.add_argument('--cell-arrays', nargs='+', default=cellArrays, help='Point data arrays to convert to cell data (default: all but the dropped ones)')
+    argParser.add_argument('--drop-cell-arrays', nargs='*', default=dropCellArrays, help='Point data arrays not converted without --cell-arrays (default: %(default)s)')
+    argParser.add_argument('--point-arrays', nargs='*', default=pointArrays, help='Point data arrays to keep (default: all but the dropped ones)')
+    argParser.add_argument('--drop-point-arrays', nargs='*', default=dropPointArrays, help='Point data arrays removed without --point-arrays (default: %(default)s)')
+    argParser.add_argument('--cell-arrays-only', action='store_true', help='Write only the converted cell arrays to .h5 files and the geometry once to ' + geometryFile)
+    argParser.add_argument('--no-operator', action='store_true', help='Convert every file with vtkPointDataToCellData instead of the averaging operator in ' + operatorFile)
+    argParser.add_argument('--prefix', default=outputPrefix, help='Prefix of the output file names (default: %(default)s)')
+    argParser.add_argument('--workers', type=int, default=numWorkers, help='Number of worker processes (default: %(default)s)')
+    args = argParser.parse_args()
+
+    inputDir = args.inputDir
+    outputDir = args.outputDir
+    outputPrefix = args.prefix
+    cellArrays = args.cell_arrays
+    dropCellArrays = args.drop_cell_arrays
+    pointArrays = args.point_arrays
+    dropPointArrays = args.drop_point_arrays
+    cellArraysOnly = args.cell_arrays_only
+    useOperator = not args.no_operator
+    numWorkers = args.workers
+
+    pointToCellData()
 
 if __name__ == '__main__':
     print("Starting", os.path.basename(__file__))
-    usage()
+    if len(sys.argv) > 1:
+        main()
+    else:
+        usage()
     print("Exiting", os.path.basename(__file__))
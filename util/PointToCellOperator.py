@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Point to cell data averaging as a precomputed sparse operator.
+
+vtkPointDataToCellData sets the value of every cell to the mean of the values
+at its points. The cell to point incidence it walks depends only on the mesh,
+so for a series of time-steps on the same mesh it is built here once, in CSR
+form: the point ids of every cell, the offsets of the cells into them and the
+number of points of every cell. Applying it to a point array is one gather and
+one weighted bincount, with the sums divided by the point counts in the same
+order of operations as vtkPointDataToCellData, so the results are identical.
+
+The operator is kept in a .npz file keyed by the mesh topology, see
+loadOperator.
+"""
+
+import os
+import hashlib
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+# Cache operators on disk.
+operatorCache = True
+
+def cellArrayConnectivity(cellArray):
+    """ Offsets and point ids of a vtkCellArray as int64 arrays. """
+    offsets = numpy_support.vtk_to_numpy(cellArray.GetOffsetsArray()).astype(numpy.int64)
+    pointIds = numpy_support.vtk_to_numpy(cellArray.GetConnectivityArray()).astype(numpy.int64)
+    return offsets, pointIds
+
+def cellConnectivity(dataset):
+    """ Offsets (number of cells + 1) and point ids of the cells of a dataset, in
+        cell id order.
+    """
+    if isinstance(dataset, vtk.vtkPolyData):
+        # Poly data cells are numbered vertices first, then lines, polygons and
+        # strips.
+        cellArrays = [dataset.GetVerts(), dataset.GetLines(), dataset.GetPolys(), dataset.GetStrips()]
+    elif isinstance(dataset, vtk.vtkUnstructuredGrid):
+        cellArrays = [dataset.GetCells()]
+    else:
+        cellArrays = []
+        pointIds = vtk.vtkIdList()
+        connectivity = vtk.vtkCellArray()
+        for cellId in range(dataset.GetNumberOfCells()):
+            dataset.GetCellPoints(cellId, pointIds)
+            connectivity.InsertNextCell(pointIds)
+        cellArrays.append(connectivity)
+
+    offsets = [numpy.zeros(1, dtype=numpy.int64)]
+    pointIds = []
+    for cellArray in cellArrays:
+        if cellArray == None or cellArray.GetNumberOfCells() == 0:
+            continue
+        arrayOffsets, arrayPointIds = cellArrayConnectivity(cellArray)
+        offsets.append(arrayOffsets[1:] + offsets[-1][-1])
+        pointIds.append(arrayPointIds)
+
+    return numpy.concatenate(offsets), numpy.concatenate(pointIds + [numpy.zeros(0, dtype=numpy.int64)])
+
+def topologyKey(numPoints, offsets, pointIds):
+    """ Hash of the number of points and the cell connectivity of a mesh. """
+    key = hashlib.sha1()
+    key.update(numpy.array([numPoints], dtype=numpy.int64).tobytes())
+    key.update(offsets.tobytes())
+    key.update(pointIds.tobytes())
+
+    return key.hexdigest()
+
+class PointToCellOperator(object):
+    """ Averaging of point data to cell data for one mesh. """
+
+    def __init__(self, numPoints, offsets, pointIds):
+        self.numPoints = int(numPoints)
+        self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        self.pointIds = numpy.asarray(pointIds, dtype=numpy.int64)
+        self.numCells = self.offsets.shape[0] - 1
+
+        # Point counts as the weights, and the cell of every entry of pointIds.
+        self.counts = numpy.diff(self.offsets)
+        self.cellIds = numpy.repeat(numpy.arange(self.numCells, dtype=numpy.int64), self.counts)
+
+    def Apply(self, values):
+        """ Cell averages of an array of point values, shaped (points,) or
+            (points, components). The result has the type of floating point
+            values and is float32 for integer values, as in vtkPointDataToCellData.
+        """
+        values = numpy.asarray(values)
+        cellType = values.dtype if numpy.issubdtype(values.dtype, numpy.floating) else numpy.float32
+        assert values.shape[0] == self.numPoints, "Number of points (%d) and point data values (%d) mismatch." % (self.numPoints, values.shape[0])
+
+        components = values.reshape(self.numPoints, -1)
+        cellValues = numpy.empty((self.numCells, components.shape[1]), dtype=cellType)
+
+        # Cells without points are left at 0.
+        divisors = numpy.maximum(self.counts, 1).astype(numpy.float64)
+
+        for component in range(components.shape[1]):
+            gathered = components[self.pointIds, component].astype(numpy.float64)
+            sums = numpy.bincount(self.cellIds, weights=gathered, minlength=self.numCells)
+            cellValues[:, component] = sums / divisors
+
+        return cellValues.reshape((self.numCells,) + values.shape[1:])
+
+    def ApplyArray(self, pointArray):
+        """ A named VTK cell data array averaged from a VTK point data array. """
+        values = numpy_support.vtk_to_numpy(pointArray)
+        cellArray = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(self.Apply(values)), deep=True)
+        cellArray.SetName(pointArray.GetName())
+        return cellArray
+
+    def Save(self, fileName, key = ''):
+        with open(fileName, 'wb') as f:
+            numpy.savez(f, numPoints=numpy.int64(self.numPoints), offsets=self.offsets, pointIds=self.pointIds, key=numpy.array(key))
+
+def buildOperator(dataset):
+    offsets, pointIds = cellConnectivity(dataset)
+    return PointToCellOperator(dataset.GetNumberOfPoints(), offsets, pointIds)
+
+def loadOperator(dataset, cacheFile):
+    """ The operator of the dataset, loaded from cacheFile. The cache file is
+        rewritten if it is missing or was written for a different topology.
+    """
+    if operatorCache == False:
+        return buildOperator(dataset)
+
+    offsets, pointIds = cellConnectivity(dataset)
+    key = topologyKey(dataset.GetNumberOfPoints(), offsets, pointIds)
+
+    if os.path.isfile(cacheFile):
+        with numpy.load(cacheFile) as cached:
+            if str(cached["key"]) == key:
+                return PointToCellOperator(cached["numPoints"], cached["offsets"], cached["pointIds"])
+        print("Point to cell operator", cacheFile, "is stale, recomputing ...")
+
+    operator = PointToCellOperator(dataset.GetNumberOfPoints(), offsets, pointIds)
+
+    try:
+        operator.Save(cacheFile, key)
+    except (IOError, OSError) as e:
+        print("Could not write point to cell operator", cacheFile, ":", e)
+
+    return operator
+
+def usage():
+    print("This module provides a point to cell data averaging operator to be imported by the conversion scripts.")
+
+if __name__ == '__main__':
+    print("Starting", os.path.basename(__file__))
+    usage()
+    print("Exiting", os.path.basename(__file__))
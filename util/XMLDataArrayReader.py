@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Read named DataArrays out of VTK XML files (.vtu, .vtp) without building the
+dataset.
+
+Only the XML header of the file is parsed. Arrays in the appended data section
+are read with a seek to their offset, in raw or base64 encoding, and inline
+binary and ascii arrays are decoded from their element. The file is read up to
+the last requested inline array, or up to the start of the appended data.
+Uncompressed, zlib and lzma compressed data are supported. Only the first piece
+of a file is read.
+"""
+
+import os
+import re
+import io
+import zlib
+import lzma
+import base64
+import collections
+import numpy
+
+typeCodes = {"Int8": "i1", "UInt8": "u1", "Int16": "i2", "UInt16": "u2",
+             "Int32": "i4", "UInt32": "u4", "Int64": "i8", "UInt64": "u8",
+             "Float32": "f4", "Float64": "f8"}
+
+decompressors = {"vtkZLibDataCompressor": zlib.decompress,
+                 "vtkLZMADataCompressor": lzma.decompress}
+
+# Number of bytes read from the file at a time while looking for tags.
+chunkSize = 1 << 20
+
+def parseAttributes(tag):
+    """ The attributes of an XML start tag as a dict. """
+    return dict((key.decode(), value.decode()) for key, value in re.findall(rb'(\w+)="([^"]*)"', tag))
+
+class HeaderScanner(object):
+    """ The start of a file read as far as needed to find a pattern. """
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = bytearray()
+
+    def find(self, pattern, start = 0):
+        while True:
+            pos = self.buffer.find(pattern, start)
+            if pos >= 0:
+                return pos
+            start = max(start, len(self.buffer) - len(pattern) + 1)
+            chunk = self.f.read(chunkSize)
+            if len(chunk) == 0:
+                return -1
+            self.buffer.extend(chunk)
+
+    def findOrFail(self, pattern, start = 0):
+        pos = self.find(pattern, start)
+        if pos < 0:
+            raise ValueError("Missing %s in %s." % (pattern.decode(), self.f.name))
+        return pos
+
+def decodeBlock(stream, headerType, compressor, encoded):
+    """ Read the data of one binary DataArray from a stream positioned at its
+        start, the header and data as written by vtkXMLWriter.
+    """
+    headerSize = headerType.itemsize
+
+    def readBase64(numBytes, prefix = b""):
+        # Base64 data is read in whole groups of 4 characters for 3 bytes.
+        numChars = 4 * ((numBytes + 2) // 3)
+        return base64.b64decode(prefix + stream.read(numChars - len(prefix)))
+
+    if compressor == None:
+        if encoded:
+            # The header and data are encoded together.
+            firstGroups = stream.read(4 * ((headerSize + 2) // 3))
+            numBytes = int(numpy.frombuffer(base64.b64decode(firstGroups)[:headerSize], dtype=headerType)[0])
+            return readBase64(headerSize + numBytes, firstGroups)[headerSize:]
+
+        numBytes = int(numpy.frombuffer(stream.read(headerSize), dtype=headerType)[0])
+        return stream.read(numBytes)
+
+    if compressor not in decompressors:
+        raise ValueError("Unsupported compressor %s." % compressor)
+    decompress = decompressors[compressor]
+
+    # The header is [number of blocks, block size, last block size, compressed
+    # block sizes...], encoded apart from the compressed blocks.
+    if encoded:
+        firstGroups = stream.read(4 * headerSize)
+        numBlocks = int(numpy.frombuffer(base64.b64decode(firstGroups), dtype=headerType)[0])
+        header = numpy.frombuffer(readBase64((3 + numBlocks) * headerSize, firstGroups), dtype=headerType)
+    else:
+        header = numpy.frombuffer(stream.read(3 * headerSize), dtype=headerType)
+        numBlocks = int(header[0])
+        header = numpy.concatenate((header, numpy.frombuffer(stream.read(numBlocks * headerSize), dtype=headerType)))
+
+    blockSizes = header[3:3 + numBlocks].astype(numpy.int64)
+    if encoded:
+        compressedData = readBase64(int(blockSizes.sum()))
+    else:
+        compressedData = stream.read(int(blockSizes.sum()))
+
+    ends = numpy.cumsum(blockSizes)
+    return bytearray().join(decompress(compressedData[end - size:end]) for end, size in zip(ends, blockSizes))
+
+def fileAttributes(scanner):
+    """ Byte order, header type and compressor of the file. """
+    fileTag = scanner.findOrFail(b"<VTKFile")
+    attributes = parseAttributes(scanner.buffer[fileTag:scanner.findOrFail(b">", fileTag)])
+
+    byteOrder = '<' if attributes.get("byte_order", "LittleEndian") == "LittleEndian" else '>'
+    headerType = numpy.dtype(byteOrder + typeCodes[attributes.get("header_type", "UInt32")])
+
+    return byteOrder, headerType, attributes.get("compressor")
+
+def sectionDataArrays(scanner, section):
+    """ Yield the attributes of every DataArray in the section of the first
+        piece, with the start and end of the element content.
+    """
+    piece = scanner.findOrFail(b"<Piece")
+    sectionTag = scanner.find(b"<" + section.encode(), piece)
+    if sectionTag < 0:
+        raise ValueError("No %s in %s." % (section, scanner.f.name))
+
+    position = scanner.findOrFail(b">", sectionTag) + 1
+    if scanner.buffer[position - 2:position] == b"/>":
+        return
+
+    sectionEnd = b"</" + section.encode()
+
+    while True:
+        tagStart = scanner.find(b"<DataArray", position)
+        end = scanner.buffer.find(sectionEnd, position)
+        if tagStart < 0 or (end >= 0 and end < tagStart):
+            return
+
+        tagEnd = scanner.findOrFail(b">", tagStart)
+        attributes = parseAttributes(scanner.buffer[tagStart:tagEnd])
+
+        position = tagEnd + 1
+        if scanner.buffer[tagEnd - 1:tagEnd] != b"/":
+            position = scanner.findOrFail(b"</DataArray>", tagEnd)
+
+        yield attributes, tagEnd + 1, position
+
+def dataArrayNames(fileName, section = "CellData"):
+    """ Names of the DataArrays in the section of the first piece. """
+    with open(fileName, 'rb') as f:
+        return [attributes.get("Name") for attributes, _, _ in sectionDataArrays(HeaderScanner(f), section)]
+
+def readDataArrays(fileName, names = None, section = "CellData"):
+    """ Read the named DataArrays from the section ("CellData", "PointData",
+        "Points", ...) of the first piece of a VTK XML file, all arrays of the
+        section if names is None. Returns an ordered dict of NumPy arrays,
+        shaped (tuples, components) for arrays of more than one component.
+    """
+    arrays = collections.OrderedDict()
+    appended = []
+
+    with open(fileName, 'rb') as f:
+        scanner = HeaderScanner(f)
+        byteOrder, headerType, compressor = fileAttributes(scanner)
+
+        for attributes, contentStart, contentEnd in sectionDataArrays(scanner, section):
+            name = attributes.get("Name")
+            if names != None and name not in names:
+                continue
+
+            if attributes["type"] not in typeCodes:
+                raise ValueError("Unsupported DataArray type %s in %s." % (attributes["type"], fileName))
+
+            dtype = numpy.dtype(byteOrder + typeCodes[attributes["type"]])
+            numComponents = int(attributes.get("NumberOfComponents", "1"))
+            dataFormat = attributes.get("format", "ascii")
+
+            if dataFormat == "appended":
+                arrays[name] = None
+                appended.append((name, int(attributes["offset"]), dtype, numComponents))
+            else:
+                # The data comes before any InformationKey elements of the array.
+                content = scanner.buffer[contentStart:contentEnd]
+                childStart = content.find(b"<")
+                text = bytes(content if childStart < 0 else content[:childStart])
+
+                if dataFormat == "ascii":
+                    values = numpy.array(text.split()).astype(dtype)
+                else:
+                    values = numpy.frombuffer(decodeBlock(io.BytesIO(text.strip()), headerType, compressor, True), dtype=dtype)
+
+                arrays[name] = values.reshape(-1, numComponents) if numComponents > 1 else values
+
+            # Stop reading the section once all named arrays are found.
+            if names != None and len(arrays) == len(names):
+                break
+
+        if len(appended) != 0:
+            appendedTag = scanner.findOrFail(b"<AppendedData")
+            appendedAttributes = parseAttributes(scanner.buffer[appendedTag:scanner.findOrFail(b">", appendedTag)])
+            encoded = appendedAttributes.get("encoding", "raw") == "base64"
+
+            # The offsets count from the character after the underscore.
+            dataStart = scanner.findOrFail(b"_", appendedTag) + 1
+
+            for name, offset, dtype, numComponents in appended:
+                f.seek(dataStart + offset)
+                values = numpy.frombuffer(decodeBlock(f, headerType, compressor, encoded), dtype=dtype)
+                arrays[name] = values.reshape(-1, numComponents) if numComponents > 1 else values
+
+    if names != None:
+        missing = [name for name in names if name not in arrays]
+        if len(missing) != 0:
+            raise ValueError("No %s arrays %s in %s." % (section, ", ".join(missing), fileName))
+        return collections.OrderedDict((name, arrays[name]) for name in names)
+
+    return arrays
+
+def readDataArray(fileName, name, section = "CellData"):
+    """ Read one named DataArray, see readDataArrays. """
+    return readDataArrays(fileName, [name], section)[name]
+
+def usage():
+    print("This module provides a partial VTK XML DataArray reader to be imported by the post-processing scripts.")
+
+if __name__ == '__main__':
+    print("Starting", os.path.basename(__file__))
+    usage()
+    print("Exiting", os.path.basename(__file__))